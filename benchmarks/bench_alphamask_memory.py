@@ -0,0 +1,59 @@
+"""Peak allocation of the simple_mask and _diff_nodata kernels
+
+    python benchmarks/bench_alphamask_memory.py
+
+Measures the peak memory (via tracemalloc, which numpy reports its
+buffers to) allocated by one call on a window, next to the size of the
+window itself, for the current kernels and the dstack / float64 list
+versions they replaced.
+"""
+from __future__ import print_function
+import tracemalloc
+
+import numpy as np
+
+from nodata.alphamask import _diff_nodata, simple_mask
+
+
+def dstack_simple_mask(data, ndv):
+    nd = np.iinfo(data.dtype).max
+    return np.invert(np.all(np.dstack(data) == ndv, axis=2)).astype(data.dtype) * nd
+
+
+def list_diff_nodata(image, ndv):
+    return np.sum([np.abs(im.astype(float) - n) for im, n in zip(image, ndv)], axis=0)
+
+
+def peak(func, *args, **kwargs):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    func(*args, **kwargs)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main(size=1024):
+    print("{:<28}{:>8}{:>12}{:>10}".format(
+        "kernel", "dtype", "peak MB", "x input"))
+    for dtype in ('uint8', 'uint16'):
+        data = np.random.randint(
+            0, 200, size=(3, size, size)).astype(dtype)
+        ndv = (0, 0, 0)
+        out = np.empty((size, size), dtype=dtype)
+        acc = _diff_nodata(data, ndv)
+
+        for name, func, kwargs in [
+                ('simple_mask (dstack)', dstack_simple_mask, {}),
+                ('simple_mask', simple_mask, {}),
+                ('simple_mask out=', simple_mask, {'out': out}),
+                ('_diff_nodata (list)', list_diff_nodata, {}),
+                ('_diff_nodata', _diff_nodata, {}),
+                ('_diff_nodata out=', _diff_nodata, {'out': acc})]:
+            nbytes = peak(func, data, ndv, **kwargs)
+            print("{:<28}{:>8}{:>12.1f}{:>10.2f}".format(
+                name, dtype, nbytes / 1e6, nbytes / float(data.nbytes)))
+
+
+if __name__ == '__main__':
+    main()
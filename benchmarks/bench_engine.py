@@ -0,0 +1,60 @@
+"""blob_nodata execution engines: riomucho processes against the threaded
+read-ahead pipeline
+
+    python benchmarks/bench_engine.py [size]
+
+Blobs (and alphafies) a DEFLATE compressed, 256px tiled synthetic RGB raster with
+scattered nodata holes, with each engine and a few worker counts.
+"""
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+from affine import Affine
+import numpy
+import rasterio
+from scipy.ndimage import binary_dilation
+
+from nodata.blob import blob_nodata
+
+
+def make_raster(path, size=4096, block=256):
+    data = (numpy.random.rand(3, size, size) * 200 + 20).astype(numpy.uint8)
+    holes = numpy.random.rand(size // 16, size // 16) > 0.97
+    holes = binary_dilation(holes.repeat(16, 0).repeat(16, 1), iterations=4)
+    data[:, holes] = 0
+    profile = {
+        'driver': 'GTiff', 'dtype': 'uint8', 'count': 3, 'nodata': 0,
+        'height': size, 'width': size, 'tiled': True, 'compress': 'deflate',
+        'blockxsize': block, 'blockysize': block,
+        'transform': Affine(1, 0, 0, 0, -1, size)}
+    with rasterio.open(path, 'w', **profile) as dst:
+        dst.write(data)
+
+
+def main(size=4096):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        src_path = os.path.join(tmpdir, 'src.tif')
+        make_raster(src_path, size)
+        print('%d x %d RGB, -m 10, %d cores' % (size, size, os.cpu_count()))
+        for engine in ('riomucho', 'pipeline'):
+            for workers in (1, 2, 4):
+                dst_path = os.path.join(tmpdir, '%s-%d.tif' % (engine, workers))
+                start = timeit.default_timer()
+                blob_nodata(
+                    src_path, dst_path, None, 10, False,
+                    {'compress': 'deflate'}, None, workers, True,
+                    engine=engine)
+                seconds = timeit.default_timer() - start
+                print('  %-9s -j %d %7.2f s %7.1f Mpx/s' % (
+                    engine, workers, seconds, size * size / seconds / 1e6))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
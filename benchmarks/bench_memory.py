@@ -0,0 +1,103 @@
+"""Peak memory of blob and alpha runs against their --max-memory budget
+
+    python benchmarks/bench_memory.py [--size 4096] [--max-memory 256M ...]
+
+Runs the nodata command on a synthetic raster (see synthetic.py) with
+and without each budget, sampling the proportional set size (PSS, which
+splits pages shared between the parent and its forked workers) of the
+whole process tree every 20 ms, Linux only. Budgets don't cover the
+parent process itself, which is reported as the baseline: the peak of
+a run that imports everything and exits.
+"""
+from __future__ import print_function
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+from synthetic import make_synthetic
+
+
+def tree_pss(pid):
+    """Sum of the PSS in bytes of pid and its descendants"""
+    total = 0
+    pids = [pid]
+    while pids:
+        p = pids.pop()
+        try:
+            with open('/proc/%d/smaps_rollup' % p) as f:
+                for line in f:
+                    if line.startswith('Pss:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+            for task in os.listdir('/proc/%d/task' % p):
+                with open('/proc/%d/task/%s/children' % (p, task)) as f:
+                    pids.extend(int(c) for c in f.read().split())
+        except (IOError, OSError):
+            # gone in the meantime
+            pass
+    return total
+
+
+def peak_pss(args):
+    """Run a command, returning its exit status and peak tree PSS"""
+    proc = subprocess.Popen(args)
+    peak = 0
+    while proc.poll() is None:
+        peak = max(peak, tree_pss(proc.pid))
+        time.sleep(0.02)
+    return proc.returncode, peak
+
+
+@click.command()
+@click.option('--size', default=4096, type=int,
+    help="Raster width and height [default=4096]")
+@click.option('--jobs', '-j', default=4, type=int,
+    help="Workers asked for [default=4]")
+@click.option('--tile-size', default=2048, type=int,
+    help="Blob tile size asked for [default=2048]")
+@click.option('--max-memory', 'budgets', multiple=True,
+    help="Budgets to run with [default=512M, 256M, 128M]")
+def main(size, jobs, tile_size, budgets):
+    budgets = budgets or ('512M', '256M', '128M')
+    tmpdir = tempfile.mkdtemp()
+    try:
+        src_path = os.path.join(tmpdir, 'src.tif')
+        dst_path = os.path.join(tmpdir, 'dst.tif')
+        make_synthetic(src_path, size, count=3, dtype='uint16',
+                       nodata_fraction=0.3)
+
+        status, baseline = peak_pss([
+            sys.executable, '-c',
+            'import nodata.blob, nodata.scripts.alpha, scipy.ndimage'])
+        print('%d x %d uint16 RGB, parent baseline %.0f MB' % (
+            size, size, baseline / 2 ** 20))
+
+        commands = {
+            'blob': ['blob', src_path, dst_path, '-m', '10', '--alphafy',
+                     '--tile-size', str(tile_size)],
+            'alpha': ['alpha', src_path, dst_path, '--merge-blocks',
+                      str(max(1, tile_size // 256))],
+        }
+        for name, command in sorted(commands.items()):
+            for budget in (None,) + tuple(budgets):
+                args = ['nodata'] + command + ['-j', str(jobs)]
+                if budget:
+                    args += ['--max-memory', budget]
+                start = time.time()
+                status, peak = peak_pss(args)
+                print('  %-6s %-10s %8.0f MB peak %8.0f MB over baseline '
+                      '%6.1f s%s' % (
+                          name, budget or 'no limit', peak / 2 ** 20,
+                          (peak - baseline) / 2 ** 20, time.time() - start,
+                          '' if status == 0 else '  FAILED'))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Region mean painting in slic_mask: regionprops + labeled_comprehension
+against bincount + lookup table
+
+    python benchmarks/bench_region_painter.py [n_clusters]
+
+Segments 256x256 windows of the lossy test fixtures with SLIC, the way
+slic_mask does, then times only the step that paints every region with
+its mean nodata distance, and checks both give the same mask.
+"""
+from __future__ import print_function
+import glob
+import sys
+import timeit
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+import scipy.ndimage as ndimage
+import skimage.measure as measure
+from skimage.segmentation import slic
+from scipy.ndimage import binary_fill_holes
+
+from nodata.alphamask import _diff_nodata, _label_means, _paint_labels
+
+
+def segment(near_nodata, n_clusters):
+    try:
+        return slic(near_nodata, n_clusters, channel_axis=None, start_label=0)
+    except TypeError:
+        # scikit-image < 0.19
+        return slic(near_nodata, n_clusters)
+
+
+def comprehension_paint(labeled, near_nodata):
+    measures = measure.regionprops(labeled, intensity_image=near_nodata, cache=True)
+    out = np.zeros(labeled.shape, dtype=np.int16).ravel()
+
+    def value_grab(a, b):
+        out[b] = measures[a[0] - 1]['mean_intensity']
+        return None
+
+    ndimage.labeled_comprehension(
+        labeled, labeled, np.unique(labeled), value_grab, float, 0,
+        pass_positions=True)
+    return out.reshape(labeled.shape)
+
+
+def bincount_paint(labeled, near_nodata):
+    return _paint_labels(labeled, _label_means(labeled, near_nodata))
+
+
+def to_mask(mean_intensity, threshold=5):
+    return binary_fill_holes(np.invert(binary_fill_holes(mean_intensity >= threshold)))
+
+
+def main(n_clusters=50):
+    workload = []
+    for path in sorted(glob.glob('tests/fixtures/alpha/*.tif')):
+        with rasterio.open(path) as src:
+            for row in (0, 256):
+                for col in (0, 256):
+                    arr = src.read(window=Window(col, row, 256, 256))
+                    near_nodata = _diff_nodata(
+                        arr, (0,) * src.count,
+                        out=np.empty(arr.shape[1:], dtype=np.float64))
+                    labeled = measure.label(segment(near_nodata, n_clusters)) + 1
+                    workload.append((labeled, near_nodata))
+
+    labels = np.mean([l.max() for l, n in workload])
+    print("{} windows, {:.0f} regions per window".format(len(workload), labels))
+
+    for labeled, near_nodata in workload:
+        assert np.array_equal(
+            to_mask(comprehension_paint(labeled, near_nodata)),
+            to_mask(bincount_paint(labeled, near_nodata)))
+
+    for name, paint in [('labeled_comprehension', comprehension_paint),
+                        ('bincount', bincount_paint)]:
+        elapsed = min(timeit.repeat(
+            lambda: [paint(l, n) for l, n in workload], number=1, repeat=3))
+        print("{:<24}{:>10.2f} ms/window".format(
+            name, 1000 * elapsed / len(workload)))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
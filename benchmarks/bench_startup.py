@@ -0,0 +1,38 @@
+"""Import time of the CLI and library modules
+
+    python benchmarks/bench_startup.py
+
+Reports the cumulative `python -X importtime` of each module in a fresh
+interpreter, and the wall time of `nodata --help`.
+"""
+from __future__ import print_function
+import subprocess
+import sys
+import timeit
+
+
+def import_time(module):
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+        stderr=subprocess.PIPE, check=True, universal_newlines=True).stderr
+    last = [l for l in stderr.splitlines() if l.startswith('import time:')][-1]
+    return int(last.split('|')[1]) / 1000.0
+
+
+def main(repeat=5):
+    for module in ['nodata.scripts.cli', 'nodata.alphamask',
+                   'nodata.scripts.alpha', 'nodata.blob', 'nodata.batch']:
+        print('%-22s %7.1f ms' % (
+            module, min(import_time(module) for i in range(repeat))))
+
+    seconds = min(timeit.repeat(
+        lambda: subprocess.run(
+            [sys.executable, '-c',
+             'from nodata.scripts.cli import cli; cli(["--help"])'],
+            stdout=subprocess.PIPE, check=True),
+        number=1, repeat=repeat))
+    print('%-22s %7.1f ms' % ('nodata --help', seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
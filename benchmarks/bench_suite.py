@@ -0,0 +1,191 @@
+"""Throughput of the blob and alpha paths over synthetic scenes
+
+    python benchmarks/bench_suite.py [--size 2048] [-j 1 -j 2 ...]
+        [--json results.json] [--compare baseline.json]
+
+Generates one raster per scene with synthetic.py (nodata fraction, edge
+complexity, dtype, band count and block layout vary between scenes),
+then times blob_nodata and NodataPoolMan.mask with simple_mask on every
+scene for every worker count, and nibble_filled_mask, simple_mask and
+slic_mask on a single window of every scene. Each case is run --repeat
+times and the best time kept.
+
+With --json the results are saved; with --compare they are checked
+against saved results, and cases more than --tolerance times slower
+are reported as regressions, making the exit status 1.
+"""
+from __future__ import print_function
+import json
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+import click
+import rasterio
+from rasterio.windows import Window
+
+from synthetic import make_synthetic
+from nodata.alphamask import simple_mask, slic_mask
+from nodata.blob import blob_nodata, nibble_filled_mask
+from nodata.scripts.alpha import NodataPoolMan
+
+
+scenes = {
+    'rgb-sparse': dict(
+        count=3, dtype='uint8', nodata_fraction=0.05, edge_complexity=0.2),
+    'rgb-ragged': dict(
+        count=3, dtype='uint8', nodata_fraction=0.3, edge_complexity=0.9),
+    'rgba-alpha': dict(
+        count=3, dtype='uint8', nodata_fraction=0.2, edge_complexity=0.5,
+        alpha=True),
+    'uint16-strips': dict(
+        count=3, dtype='uint16', nodata_fraction=0.2, edge_complexity=0.5,
+        tiled=False, block=16),
+}
+
+
+def best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        func()
+        times.append(timeit.default_timer() - start)
+    return min(times)
+
+
+def run_blob(src_path, dst_path, scene, workers):
+    # nodata scenes are alphafied, alpha scenes blobbed as they are
+    alpha = scenes[scene].get('alpha', False)
+    blob_nodata(
+        src_path, dst_path, None, 10, False, {'compress': 'deflate'},
+        0 if alpha else None, workers, not alpha)
+
+
+def run_pool_mask(src_path, scene, workers):
+    count = scenes[scene]['count']
+    with rasterio.open(src_path) as src:
+        windows = [window for ij, window in src.block_windows()]
+    manager = NodataPoolMan(
+        src_path, simple_mask, (0,) * count, num_workers=workers,
+        max_in_flight=2 * workers)
+    try:
+        for window, mask in manager.mask(windows):
+            pass
+    finally:
+        manager.close()
+
+
+def window_cases(src_path, scene, size):
+    """Single window array functions, as (name, params, pixels, func)"""
+    count = scenes[scene]['count']
+    nodata = (0,) * count
+    with rasterio.open(src_path) as src:
+        arr = src.read(list(range(1, count + 1)), window=Window(0, 0, size, size))
+    small = arr[:, :size // 2, :size // 2]
+
+    return [
+        ('nibble_filled_mask', 'm=4', size * size,
+         lambda: nibble_filled_mask(arr[:3], 0, 4)),
+        ('nibble_filled_mask', 'm=16', size * size,
+         lambda: nibble_filled_mask(arr[:3], 0, 16)),
+        ('simple_mask', '', size * size,
+         lambda: simple_mask(arr, nodata)),
+        ('slic_mask', '', small[0].size,
+         lambda: slic_mask(small, nodata)),
+        ('slic_mask', 'decimation=4', small[0].size,
+         lambda: slic_mask(small, nodata, decimation=4)),
+    ]
+
+
+def compare(results, baseline, tolerance):
+    """Print each case's time against the baseline's; returns the number
+    of regressions"""
+    previous = dict(
+        ((r['name'], r['scene'], r['params']), r['seconds']) for r in baseline)
+    regressions = 0
+    for r in results:
+        key = (r['name'], r['scene'], r['params'])
+        if key not in previous:
+            continue
+        ratio = r['seconds'] / previous[key]
+        flag = ''
+        if ratio > tolerance:
+            flag = '  REGRESSION'
+            regressions += 1
+        print('  %-20s %-14s %-14s %5.2fx%s' % (key + (ratio, flag)))
+    return regressions
+
+
+@click.command()
+@click.option('--size', default=2048, type=int,
+    help="Scene width and height [default=2048]")
+@click.option('--jobs', '-j', 'workers', multiple=True, type=int,
+    help="Worker counts [default=1, 2, 4]")
+@click.option('--scene', 'selected', multiple=True,
+    type=click.Choice(sorted(scenes)), help="Scenes [default=all]")
+@click.option('--window', default=1024, type=int,
+    help="Window size of the array functions [default=1024]")
+@click.option('--repeat', default=3, type=int,
+    help="Runs of every case, the best is kept [default=3]")
+@click.option('--json', 'json_path', default=None,
+    help="Save the results to this file")
+@click.option('--compare', 'baseline_path', default=None,
+    help="Compare against results saved with --json")
+@click.option('--tolerance', default=1.25, type=float,
+    help="Slowdown against the baseline reported as a regression "
+         "[default=1.25]")
+def main(size, workers, selected, window, repeat, json_path, baseline_path,
+         tolerance):
+    workers = workers or (1, 2, 4)
+    selected = selected or sorted(scenes)
+    results = []
+
+    def record(name, scene, params, pixels, seconds):
+        results.append({
+            'name': name, 'scene': scene, 'params': params,
+            'seconds': seconds, 'mpx_s': pixels / seconds / 1e6})
+        print('  %-20s %-14s %-14s %8.3f s %8.1f Mpx/s' % (
+            name, scene, params, seconds, pixels / seconds / 1e6))
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print('%d x %d scenes, %d cores' % (size, size, os.cpu_count()))
+        for scene in selected:
+            src_path = os.path.join(tmpdir, scene + '.tif')
+            dst_path = os.path.join(tmpdir, scene + '-out.tif')
+            make_synthetic(src_path, size, **scenes[scene])
+
+            for n in workers:
+                record('blob_nodata', scene, '-j %d' % n, size * size,
+                       best_time(
+                           lambda: run_blob(src_path, dst_path, scene, n),
+                           repeat))
+                if not scenes[scene].get('alpha'):
+                    record('NodataPoolMan.mask', scene, '-j %d' % n,
+                           size * size,
+                           best_time(
+                               lambda: run_pool_mask(src_path, scene, n),
+                               repeat))
+
+            for name, params, pixels, func in window_cases(
+                    src_path, scene, min(window, size)):
+                record(name, scene, params, pixels, best_time(func, repeat))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        print('against %s' % baseline_path)
+        if compare(results, baseline, tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
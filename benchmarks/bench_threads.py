@@ -0,0 +1,67 @@
+"""Worker count against throughput for process and thread execution
+
+    python benchmarks/bench_threads.py [size]
+
+Runs blob_nodata (riomucho processes and the threads engine) and
+alpha_nodata with simple_mask (NodataPoolMan processes and threads)
+over the synthetic raster of bench_engine.py for 1 worker up to the
+number of cores.
+"""
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+from bench_engine import make_raster
+from nodata.alphamask import simple_mask
+from nodata.blob import blob_nodata
+from nodata.scripts.alpha import alpha_nodata
+
+
+def worker_counts():
+    cores = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 <= max(cores, 2):
+        counts.append(counts[-1] * 2)
+    return counts
+
+
+def run_blob(src_path, dst_path, workers, engine):
+    blob_nodata(
+        src_path, dst_path, None, 10, False, {'compress': 'deflate'}, None,
+        workers, True, engine=engine)
+
+
+def run_alpha(src_path, dst_path, workers, engine):
+    alpha_nodata(
+        src_path, dst_path, simple_mask, (0, 0, 0), {'compress': 'deflate'},
+        workers=workers, engine=engine)
+
+
+def main(size=4096):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        src_path = os.path.join(tmpdir, 'src.tif')
+        make_raster(src_path, size)
+        print('%d x %d RGB, %d cores (Mpx/s)' % (size, size, os.cpu_count()))
+        for name, func, engines in [
+                ('blob', run_blob, ('riomucho', 'threads')),
+                ('alpha', run_alpha, ('processes', 'threads'))]:
+            for engine in engines:
+                row = []
+                for workers in worker_counts():
+                    dst_path = os.path.join(tmpdir, 'out.tif')
+                    start = timeit.default_timer()
+                    func(src_path, dst_path, workers, engine)
+                    seconds = timeit.default_timer() - start
+                    row.append('-j %d %6.1f' % (
+                        workers, size * size / seconds / 1e6))
+                print('  %-6s %-10s %s' % (name, engine, '  '.join(row)))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
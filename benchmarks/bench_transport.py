@@ -0,0 +1,88 @@
+"""Throughput of NodataPoolMan result transports
+
+    python benchmarks/bench_transport.py
+
+Times encode + decode of single masks in process, then whole pool runs
+of simple_mask over a synthetic raster, for every transport.
+"""
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import timeit
+
+import numpy
+import rasterio
+from rasterio.windows import Window
+
+from nodata.alphamask import simple_mask
+from nodata.scripts.alpha import (
+    NodataPoolMan, decode_mask, encode_mask, shared_memory, transports)
+
+
+def masks(size=1024):
+    uniform = numpy.zeros((size, size), dtype=numpy.uint8) + 255
+    edge = uniform.copy()
+    edge[:, :size // 3] = 0
+    noisy = (numpy.random.rand(size, size) > 0.5).astype(numpy.uint8) * 255
+    return [('uniform', uniform), ('edge', edge), ('noisy', noisy)]
+
+
+def make_raster(path, size=4096, block=512):
+    data = (numpy.random.rand(3, size, size) * 200 + 20).astype(numpy.uint8)
+    data[:, :, :size // 4] = 0
+    profile = {
+        'driver': 'GTiff', 'dtype': 'uint8', 'count': 3, 'nodata': 0,
+        'height': size, 'width': size, 'tiled': True,
+        'blockxsize': block, 'blockysize': block}
+    with rasterio.open(path, 'w', **profile) as dst:
+        dst.write(data)
+
+
+def available():
+    return [t for t in transports if t != 'shm' or shared_memory is not None]
+
+
+def bench_codec(number=20):
+    print('encode + decode, 1024 x 1024 uint8 mask (MB/s)')
+    for name, mask in masks():
+        row = []
+        for transport in available():
+            def roundtrip():
+                decode_mask(
+                    encode_mask(mask, transport), transport, mask.shape,
+                    mask.dtype)
+            seconds = timeit.timeit(roundtrip, number=number) / number
+            row.append('%s %8.0f' % (transport, mask.nbytes / seconds / 1e6))
+        print('  %-8s %s' % (name, '  '.join(row)))
+
+
+def bench_pool(path, workers=2, block=512):
+    print('NodataPoolMan simple_mask, %d workers (windows/s)' % workers)
+    with rasterio.open(path) as src:
+        windows = [
+            Window(c, r, block, block)
+            for r in range(0, src.height, block)
+            for c in range(0, src.width, block)]
+
+    for transport in available():
+        manager = NodataPoolMan(
+            path, simple_mask, (0, 0, 0), num_workers=workers,
+            transport=transport)
+        start = timeit.default_timer()
+        for window, mask in manager.mask(windows):
+            pass
+        seconds = timeit.default_timer() - start
+        manager.close()
+        print('  %-5s %8.1f' % (transport, len(windows) / seconds))
+
+
+if __name__ == '__main__':
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'bench.tif')
+        make_raster(path)
+        bench_codec()
+        bench_pool(path)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,84 @@
+"""Synthetic rasters for the benchmarks
+
+    python benchmarks/synthetic.py DST_PATH [size] [nodata_fraction] [edge_complexity]
+
+Nodata areas come from thresholding a smooth random field: edge
+complexity sets how fine that field is, from a few round blobs (0) to
+ragged, speckled areas (1), and the threshold is the field's quantile
+for the requested nodata fraction, so the fraction is exact.
+"""
+from __future__ import print_function
+import sys
+
+from affine import Affine
+import numpy
+import rasterio
+from scipy.ndimage import zoom
+
+
+def nodata_mask(height, width, nodata_fraction=0.1, edge_complexity=0.5,
+                seed=0):
+    """Boolean (height, width) array, True in nodata areas"""
+    rng = numpy.random.RandomState(seed)
+    if nodata_fraction <= 0:
+        return numpy.zeros((height, width), dtype=bool)
+
+    # from a 2 x 2 grid of random values up to one every 8 pixels
+    cells = 2 + int(edge_complexity * (max(height, width) // 8 - 2))
+    coarse = rng.rand(max(2, cells * height // max(height, width)),
+                      max(2, cells * width // max(height, width)))
+    field = zoom(
+        coarse, (height / float(coarse.shape[0]), width / float(coarse.shape[1])),
+        order=1, output=numpy.float32)[:height, :width]
+
+    threshold = numpy.quantile(field, nodata_fraction)
+    return field <= threshold
+
+
+def synthetic_data(height, width, count=3, dtype='uint8', nodata=0,
+                   nodata_fraction=0.1, edge_complexity=0.5, seed=0):
+    """(count, height, width) array of noisy valid values, which never
+    equal nodata, with nodata areas set to nodata. Returns the array and
+    its nodata mask."""
+    rng = numpy.random.RandomState(seed)
+    data = (rng.rand(count, height, width) * 200 + 20).astype(dtype)
+    mask = nodata_mask(height, width, nodata_fraction, edge_complexity, seed)
+    data[:, mask] = nodata
+    return data, mask
+
+
+def make_synthetic(path, size=4096, count=3, dtype='uint8', nodata=0,
+                   nodata_fraction=0.1, edge_complexity=0.5, block=256,
+                   tiled=True, alpha=False, compress='deflate', seed=0):
+    """Write a synthetic size x size raster.
+
+    Tiled rasters have block x block tiles, others strips of block rows.
+    With alpha the nodata areas go in an extra alpha band instead of a
+    nodata value (integer dtypes only).
+    """
+    data, mask = synthetic_data(
+        size, size, count, dtype, nodata, nodata_fraction, edge_complexity,
+        seed)
+    profile = {
+        'driver': 'GTiff', 'dtype': dtype, 'count': count, 'nodata': nodata,
+        'height': size, 'width': size, 'compress': compress,
+        'transform': Affine(1, 0, 0, 0, -1, size)}
+    if tiled:
+        profile.update(tiled=True, blockxsize=block, blockysize=block)
+    else:
+        profile.update(tiled=False, blockysize=block)
+
+    if alpha:
+        alpha_band = numpy.where(mask, 0, numpy.iinfo(dtype).max).astype(dtype)
+        data = numpy.concatenate([data, alpha_band[numpy.newaxis]])
+        profile.update(count=count + 1, nodata=None)
+
+    with rasterio.open(path, 'w', **profile) as dst:
+        dst.write(data)
+
+
+if __name__ == '__main__':
+    names = ('size', 'nodata_fraction', 'edge_complexity')
+    make_synthetic(sys.argv[1], **dict(
+        (name, cast(a)) for name, cast, a in zip(
+            names, (int, float, float), sys.argv[2:])))
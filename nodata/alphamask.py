@@ -1,27 +1,62 @@
 import numpy as np
-import skimage.measure as measure
-import scipy.ndimage.measurements as sci_meas
-from skimage.segmentation import slic
-from scipy.ndimage.morphology import binary_fill_holes
 
+# scikit-image and scipy.ndimage are slow to import and only needed for
+# SLIC masking, so they are imported where they are used.
 
-def _diff_nodata(image, ndv):
-    return np.sum([np.abs(im.astype(float) - n) for im, n in zip(image, ndv)], axis=0)
 
+def _accumulator_dtype(dtype, ndv):
+    """Smallest type that holds the summed band differences exactly:
+    integers stay integers unless a nodata value is fractional"""
+    dtype = np.dtype(dtype)
+    if dtype.kind not in 'iub' or not all(float(n).is_integer() for n in ndv):
+        return np.dtype(np.float64)
+    info = np.iinfo(dtype)
+    largest = sum(max(abs(info.max - int(n)), abs(info.min - int(n))) for n in ndv)
+    for acc in (np.int16, np.int32, np.int64):
+        if largest <= np.iinfo(acc).max:
+            return np.dtype(acc)
+    return np.dtype(np.float64)
 
-def _hacky_make_image(labeled_img, u_labels, measures, m_key, dtype=np.int16):
-    out = np.zeros(labeled_img.shape, dtype=dtype).ravel()
-    if m_key is None:
-        measures = [{"key": m} for m in measures]
-        m_key = "key"
 
-    def value_grab(a, b):
-        out[b] = measures[a[0] - 1][m_key]
-        return None
+def _diff_nodata(image, ndv, out=None):
+    """Sum of the absolute differences of every band from its nodata
+    value.
+
+    Bands are accumulated one at a time into out, which is allocated
+    (as _accumulator_dtype) if not given and can be reused across
+    windows of the same shape.
+    """
+    ndv = list(ndv)
+    if out is None:
+        out = np.empty(image.shape[1:], dtype=_accumulator_dtype(image.dtype, ndv))
+    acc = out.dtype
+    band_diff = np.empty(out.shape, dtype=acc)
+
+    out[...] = 0
+    for im, n in zip(image, ndv):
+        np.subtract(im, acc.type(n), out=band_diff, dtype=acc)
+        np.abs(band_diff, out=band_diff)
+        out += band_diff
+
+    return out
+
+
+def _label_means(labeled_img, intensity):
+    """Mean intensity of every label, indexed by label (0 where a label
+    has no pixels)"""
+    labels = labeled_img.ravel()
+    counts = np.bincount(labels)
+    sums = np.bincount(labels, weights=intensity.ravel(), minlength=counts.size)
+    means = np.zeros(counts.size, dtype=np.float64)
+    np.divide(sums, counts, out=means, where=counts > 0)
+    return means
 
-    sci_meas.labeled_comprehension(labeled_img, labeled_img, u_labels, value_grab, float, 0, pass_positions=True)
 
-    return out.reshape(labeled_img.shape)
+def _paint_labels(labeled_img, values, dtype=np.int16):
+    """Paint every labeled pixel with its label's value, through a
+    lookup table indexed by label"""
+    lut = np.asarray(values).astype(dtype)
+    return lut[labeled_img]
 
 
 def all_valid(data, ndv, threshold=0):
@@ -48,33 +83,117 @@ def all_valid_edges(data, ndv, threshold=0):
     return np.all(edges > (threshold * data.shape[0]))
 
 
-def simple_mask(data, ndv):
-    '''Exact nodata masking'''
+def simple_mask(data, ndv, out=None):
+    '''Exact nodata masking
+
+    A pixel is masked where every band equals its nodata value. The
+    bands are compared one at a time, and the mask is written to out
+    if given.
+    '''
     depth, rows, cols = data.shape
     nd = np.iinfo(data.dtype).max
-    alpha = np.invert(np.all(np.dstack(data) == ndv, axis=2)).astype(data.dtype) * nd
-    return alpha
+    ndv = np.broadcast_to(ndv, (depth,))
+
+    valid = np.zeros((rows, cols), dtype=bool)
+    band_valid = np.empty((rows, cols), dtype=bool)
+    for band, n in zip(data, ndv):
+        np.not_equal(band, n, out=band_valid)
+        valid |= band_valid
+
+    if out is None:
+        out = np.empty((rows, cols), dtype=data.dtype)
+    np.multiply(valid, nd, out=out, casting='unsafe')
+    return out
+
+
+def _slic(image, n_clusters):
+    """Segment a single band image, numbering clusters from 0"""
+    from skimage.segmentation import slic
+
+    try:
+        return slic(image, n_clusters, channel_axis=None, start_label=0)
+    except TypeError:
+        # scikit-image < 0.19 takes 2D images as they are
+        return slic(image, n_clusters)
 
 
-def slic_mask(arr, nodata, n_clusters=50, threshold=5, debug=False):
+def _decimate(image, factor):
+    """Block mean of image over factor x factor blocks, padding the
+    right and bottom edges with their last row and column"""
+    rows, cols = image.shape
+    dRows, dCols = -(-rows // factor), -(-cols // factor)
+    padded = np.pad(
+        image, ((0, dRows * factor - rows), (0, dCols * factor - cols)), mode='edge')
+    return padded.reshape(dRows, factor, dCols, factor).mean(axis=(1, 3))
+
+
+def _upsample(image, factor, shape):
+    """Repeat every pixel of a decimated image factor x factor times and
+    crop to shape"""
+    rows, cols = shape
+    return image.repeat(factor, axis=0).repeat(factor, axis=1)[:rows, :cols]
+
+
+def _slic_valid(near_nodata, n_clusters, threshold):
+    """Cluster near_nodata and flag the clusters whose mean distance
+    from nodata reaches threshold"""
+    from skimage.measure import label
+
+    clusters = _slic(near_nodata, n_clusters)
+    labeled = label(clusters) + 1
+    means = _label_means(labeled, near_nodata)
+    mean_intensity = _paint_labels(labeled, means)
+    return mean_intensity >= threshold, labeled, means, mean_intensity
+
+
+def slic_mask(arr, nodata, n_clusters=50, threshold=5, debug=False,
+              decimation=1, tolerance=None):
     """
     Uses @dnomadb algorithm, roughly:
         - cluster image using SLIC (k-means)
         - pull out contiguous regions and find aggregate stats
         - select regions that are likely ndv
         - fill inclusions
+
+    With decimation > 1 the clustering runs on a block mean of the
+    window decimation times smaller on each side, which cuts its cost by
+    about the square of that. The coarse result is upsampled and only
+    pixels within tolerance (default: decimation) pixels of its edges
+    are reclassified at full resolution, by the mean distance from
+    nodata over a decimation wide neighbourhood.
     """
+    from scipy.ndimage import (
+        binary_fill_holes, maximum_filter, minimum_filter, uniform_filter)
+
     assert arr.shape[0] == len(nodata)
-    near_nodata = _diff_nodata(arr, nodata)
-    clusters = slic(near_nodata, n_clusters)
-    labeled = measure.label(clusters) + 1
-    measures = measure.regionprops(labeled, intensity_image=near_nodata, cache=True)
-    mean_intensity = _hacky_make_image(labeled, np.unique(labeled), measures, 'mean_intensity')
-    mask = binary_fill_holes(np.invert(binary_fill_holes(mean_intensity >= threshold)))
+    # slic works in floats, so accumulate in them from the start
+    near_nodata = _diff_nodata(
+        arr, nodata, out=np.empty(arr.shape[1:], dtype=np.float64))
+
+    if decimation > 1:
+        if tolerance is None:
+            tolerance = decimation
+        coarse, labeled, means, mean_intensity = _slic_valid(
+            _decimate(near_nodata, decimation), n_clusters, threshold)
+        valid = _upsample(coarse, decimation, near_nodata.shape)
+
+        size = 2 * tolerance + 1
+        edges = maximum_filter(valid, size=size) != minimum_filter(valid, size=size)
+        local = uniform_filter(near_nodata, size=decimation, mode='nearest')
+        valid[edges] = local[edges] >= threshold
+
+        if debug:
+            labeled = _upsample(labeled, decimation, near_nodata.shape)
+            mean_intensity = _upsample(mean_intensity, decimation, near_nodata.shape)
+    else:
+        valid, labeled, means, mean_intensity = _slic_valid(
+            near_nodata, n_clusters, threshold)
+
+    mask = binary_fill_holes(np.invert(binary_fill_holes(valid)))
     nd = np.iinfo(arr.dtype).max
     mask = np.invert(mask) * nd
     if debug:
-        d = dict([(m.label, m.mean_intensity) for m in measures])
+        d = dict((l, means[l]) for l in np.unique(labeled))
         return mask.astype('uint8'), labeled.astype('uint32'), mean_intensity.astype('uint32'), d
     else:
         return mask.astype('uint8')
@@ -0,0 +1,162 @@
+from collections import OrderedDict
+from multiprocessing import Pool
+import os
+import timeit
+
+import rasterio as rio
+
+from nodata.blob import blob_worker, plan_blob
+from nodata.throttle import Throttle
+
+
+# Worker processes keep the datasets of the last few files they worked
+# on open, since windows of a file arrive together.
+
+open_datasets = OrderedDict()
+max_open_datasets = 4
+
+
+class BatchError(Exception):
+    """Failure to blob one file of a batch"""
+
+    def __init__(self, src_path, message):
+        # both in args, so that it survives the trip from a worker
+        super(BatchError, self).__init__(src_path, message)
+        self.src_path = src_path
+        self.message = message
+
+    def __str__(self):
+        return "%s: %s" % (self.src_path, self.message)
+
+
+def batch_worker(args):
+    """Blob one window of one of the batch's files"""
+    index, src_path, window, ij, globalArgs = args
+
+    src = open_datasets.pop(src_path, None)
+    if src is None:
+        src = rio.open(src_path)
+        while len(open_datasets) >= max_open_datasets:
+            open_datasets.popitem(last=False)[1].close()
+    open_datasets[src_path] = src
+
+    return index, window, blob_worker([src], window, ij, globalArgs)
+
+
+def batch_task(args):
+    """batch_worker, raising BatchError naming the file on failure"""
+    try:
+        return batch_worker(args)
+    except Exception as exc:
+        raise BatchError(args[1], str(exc))
+
+
+def output_path(template, src_path):
+    """Fill an output template's {name} (the source file name without
+    its extension) and {dir} (the source directory) fields"""
+    name = os.path.splitext(os.path.basename(src_path))[0]
+    return template.format(name=name, dir=os.path.dirname(src_path))
+
+
+def output_paths(template, src_paths):
+    """Output paths of src_paths, raising ValueError if two are the
+    same file or one is any of the sources"""
+    dst_paths = [output_path(template, src_path) for src_path in src_paths]
+    sources = dict(
+        (os.path.realpath(src_path), src_path) for src_path in src_paths)
+    seen = {}
+    for src_path, dst_path in zip(src_paths, dst_paths):
+        key = os.path.realpath(dst_path)
+        if key in seen:
+            raise ValueError("%s and %s would both be written to %s" % (
+                seen[key], src_path, dst_path))
+        if key in sources:
+            raise ValueError("%s would overwrite source %s" % (
+                dst_path, sources[key]))
+        seen[key] = src_path
+    return dst_paths
+
+
+def blob_batch(
+        src_paths, dst_template, bidx, max_search_distance, nibblemask,
+        creation_options, maskThreshold, workers, alphafy, **kwargs):
+    """Blob many files with one pool of worker processes.
+
+    Windows of all files go through the same pool, so that small files
+    don't leave workers idle, with at most max_in_flight (default four
+    per worker) windows queued at any time. Each file is planned as its
+    first window is queued. Outputs are named by dst_template (see
+    output_paths, which raises ValueError if they collide).
+
+    Yields (src_path, dst_path, seconds) as each file is finished,
+    seconds counting from the file's first window to its last write.
+    Raises BatchError naming the file if one can't be blobbed. Other
+    keyword arguments are those of plan_blob.
+    """
+    max_in_flight = kwargs.pop('max_in_flight', None) or 4 * workers
+    dst_paths = output_paths(dst_template, src_paths)
+
+    # plans of the files started and not finished, by index
+    plans = {}
+    throttle = Throttle(max_in_flight)
+
+    def tasks():
+        # the pool's feeder takes these as the consumer catches up
+        for index, src_path in enumerate(src_paths):
+            try:
+                windows, options, globalArgs = plan_blob(
+                    src_path, bidx, max_search_distance, nibblemask,
+                    creation_options, maskThreshold, alphafy, **kwargs)
+            except Exception as exc:
+                raise BatchError(src_path, str(exc))
+            plan = plans[index] = {
+                'src_path': src_path,
+                'dst_path': dst_paths[index],
+                'options': options,
+                'remaining': len(windows),
+                'dst': None,
+                'start': None}
+            for window, ij in windows:
+                if plan['start'] is None:
+                    plan['start'] = timeit.default_timer()
+                yield index, src_path, window, ij, globalArgs
+
+    if workers > 1:
+        pool = Pool(workers)
+        imap = pool.imap_unordered
+    else:
+        pool = None
+        imap = map
+
+    try:
+        for index, window, data in imap(batch_task, throttle.feed(tasks())):
+            throttle.release()
+            plan = plans[index]
+            try:
+                if plan['dst'] is None:
+                    plan['dst'] = rio.open(
+                        plan['dst_path'], 'w', **plan['options'])
+                plan['dst'].write(data, window=window)
+            except Exception as exc:
+                raise BatchError(plan['src_path'], str(exc))
+
+            plan['remaining'] -= 1
+            if plan['remaining'] == 0:
+                plan['dst'].close()
+                del plans[index]
+                yield (
+                    plan['src_path'], plan['dst_path'],
+                    timeit.default_timer() - plan['start'])
+    except BaseException:
+        throttle.stop()
+        raise
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        for plan in list(plans.values()):
+            if plan['dst'] is not None and not plan['dst'].closed:
+                plan['dst'].close()
+        if pool is None:
+            while open_datasets:
+                open_datasets.popitem()[1].close()
@@ -1,26 +1,25 @@
+from functools import partial
 import json
+import os
+import tempfile
 import numpy as np
 from numbers import Number
 
 import rasterio as rio
-from rasterio.fill import fillnodata
+from rasterio.enums import MaskFlags, Resampling
 from rasterio.windows import Window
-import riomucho
 
-from scipy.ndimage.filters import maximum_filter, minimum_filter
+from nodata.memory import blob_window_bytes, cache_options, fit_budget
+from nodata.pipeline import run_pipeline
+from nodata.overviews import (
+    OverviewAccumulator, cog_factors, create_overviews, keep_level,
+    level_bytes, write_overviews)
+from nodata.profiling import null_profiler, profiling, timed_writes
+from nodata.pyramid import fill_pyramid, pyramid_pad, read_levels
+from nodata.windows import grid_windows, halo_window, pad_window, tile_windows
 
-
-def pad_window(wnd, pad):
-    try:
-        wnd = wnd.toranges()
-    except AttributeError:
-        # rasterio < 1.0, already a tuple
-        pass
-
-    return (
-        (wnd[0][0] - pad, wnd[0][1] + pad),
-        (wnd[1][0] - pad, wnd[1][1] + pad)
-    )
+# riomucho, rasterio.fill and scipy are imported by the functions that
+# use them, so that runs which don't need them start faster.
 
 
 def test_rgb(count, nodata, alphafy, outCount):
@@ -36,151 +35,936 @@ def test_rgb(count, nodata, alphafy, outCount):
 
 
 def fill_nodata(img, mask, fillBands, maxSearchDistance):
+    from rasterio.fill import fillnodata
+
     for b in fillBands:
         img[b - 1] = fillnodata(img[b - 1], mask, maxSearchDistance)
 
     return img
 
 
+def fill_nodata_batched(img, mask, fillBands, maxSearchDistance):
+    from nodata import fill
+
+    return fill.fill_nodata_batched(img, mask, fillBands, maxSearchDistance)
+
+
+fill_engines = {
+    'gdal': fill_nodata,
+    'batched': fill_nodata_batched
+}
+
+
+# Cost of a GDAL fill in pixels of valid data: a fixed cost for every
+# call, and nodata pixels cost more than valid ones for their search
+_FILL_CALL_COST = 30000
+_FILL_NODATA_COST = 2.5
+
+
+def _fill_cost(nodata, pixels):
+    return _FILL_CALL_COST + pixels + _FILL_NODATA_COST * nodata
+
+
+def fill_regions(mask, maxSearchDistance, cell=64):
+    """Plan an edge-only fill of a window.
+
+    Only nodata pixels within maxSearchDistance of valid data can be
+    filled, from valid pixels within that distance. The window is cut
+    in cells of cell x cell pixels, and cells holding nodata with valid
+    data in reach are merged along rows into boxes, and boxes spanning
+    the same columns in consecutive rows into one.
+
+    Returns a list of (box, read) pairs of (rows, cols) slices: every
+    box is filled from the read around it, grown by maxSearchDistance.
+    Returns None when filling the boxes is estimated to cost about as
+    much as filling the whole window.
+    """
+    from scipy.ndimage import maximum_filter1d
+
+    rows, cols = mask.shape
+    gridRows, gridCols = -(-rows // cell), -(-cols // cell)
+
+    nodata = np.zeros((gridRows * cell, gridCols * cell), dtype=bool)
+    nodata[:rows, :cols] = mask == 0
+    valid = np.zeros_like(nodata)
+    valid[:rows, :cols] = ~nodata[:rows, :cols]
+    hasValid = valid.reshape(gridRows, cell, gridCols, cell).any(axis=(1, 3))
+    hasNodata = nodata.reshape(gridRows, cell, gridCols, cell).any(axis=(1, 3))
+
+    reach = -(-maxSearchDistance // cell)
+    edge = hasNodata & _square_filter(hasValid, 2 * reach + 1, maximum_filter1d)
+
+    boxes = []
+    for i in range(gridRows):
+        padded = np.concatenate(([0], edge[i].astype(np.int8), [0]))
+        starts, = np.nonzero(np.diff(padded) == 1)
+        stops, = np.nonzero(np.diff(padded) == -1)
+        r0, r1 = i * cell, min((i + 1) * cell, rows)
+        for j0, j1 in zip(starts, stops):
+            c0, c1 = j0 * cell, min(j1 * cell, cols)
+            for k, (br0, br1, bc0, bc1) in enumerate(boxes):
+                if br1 == r0 and (bc0, bc1) == (c0, c1):
+                    boxes[k] = (br0, r1, c0, c1)
+                    break
+            else:
+                boxes.append((r0, r1, c0, c1))
+
+    regions = []
+    cost = 0
+    for r0, r1, c0, c1 in boxes:
+        read = (
+            slice(max(r0 - maxSearchDistance, 0), min(r1 + maxSearchDistance, rows)),
+            slice(max(c0 - maxSearchDistance, 0), min(c1 + maxSearchDistance, cols)))
+        regions.append(((slice(r0, r1), slice(c0, c1)), read))
+        cost += _fill_cost(
+            np.count_nonzero(nodata[read]),
+            (read[0].stop - read[0].start) * (read[1].stop - read[1].start))
+
+    if cost > 0.8 * _fill_cost(np.count_nonzero(nodata), rows * cols):
+        return None
+
+    return regions
+
+
+def fill_edges(fill, img, mask, fillBands, maxSearchDistance):
+    """Run a fill engine only over the regions planned by fill_regions,
+    or over the whole window if that looks cheaper. The result is the
+    same as filling the whole window."""
+    regions = fill_regions(mask, maxSearchDistance)
+    if regions is None:
+        return fill(img, mask, fillBands, maxSearchDistance)
+
+    out = img.copy()
+    for box, read in regions:
+        filled = fill(img[:, read[0], read[1]].copy(), mask[read],
+                      fillBands, maxSearchDistance)
+        # the box within the read
+        rows = slice(box[0].start - read[0].start, box[0].stop - read[0].start)
+        cols = slice(box[1].start - read[1].start, box[1].stop - read[1].start)
+        out[:, box[0], box[1]] = filled[:, rows, cols]
+
+    return out
+
+
+def blob_pad(globalArgs):
+    """Halo read around every window"""
+    if 'pad' in globalArgs:
+        return globalArgs['pad']
+    if globalArgs.get('pyramid'):
+        return pyramid_pad(globalArgs['max_search_distance'])
+    return globalArgs['max_search_distance'] + 1
+
+
 def runNodataFiller(mask, pad):
-    nonZero = np.count_nonzero(mask[pad:-pad, pad:-pad])
+    rows, cols = mask.shape
+    inner = mask[pad:rows - pad, pad:cols - pad]
+    nonZero = np.count_nonzero(inner)
 
-    if nonZero == 0 or nonZero == mask[pad:-pad, pad:-pad].size:
+    if nonZero == 0 or nonZero == inner.size:
         return False
     else:
         return True
 
 
-def handle_RGB(img, mask):
-    return np.concatenate([img, mask.reshape(1, mask.shape[-2], mask.shape[-1])])
+def window_state(src, window, globalArgs):
+    """Classify a window from an unpadded read of its mask alone.
+
+    Returns 'valid' or 'nodata' when the mask is uniform and no fill is
+    needed, else None.
+    """
+    if isinstance(globalArgs['selectNodata'], Number):
+        mask = src.read_masks(1, window=window)
+    else:
+        mask = src.read(src.count, window=window)
+        if globalArgs['maskThreshold'] is not None:
+            mask = mask >= globalArgs['maskThreshold']
 
+    nonZero = np.count_nonzero(mask)
 
-def blob_worker(srcs, window, ij, globalArgs):
-    pad = globalArgs['max_search_distance'] + 1
-    padded = pad_window(window, pad)
-    padWindow = Window.from_slices(*padded, boundless=True)
-    img = srcs[0].read(boundless=True, window=padWindow)
+    if nonZero == mask.size:
+        return 'valid'
+    elif nonZero == 0:
+        return 'nodata'
+    else:
+        return None
+
+
+def read_uniform(src, window, state, globalArgs):
+    """Produce the output for a window with a uniform mask without a
+    padded read: valid windows are copied through, nodata windows are
+    written as constants"""
+    rows, cols = [int(x) for x in rio.windows.shape(window)]
+    dtype = src.dtypes[0]
+
+    if state == 'valid':
+        img = src.read(window=window)
+    else:
+        fill = globalArgs['selectNodata']
+        if not isinstance(fill, Number):
+            fill = 0
+        img = np.full((src.count, rows, cols), fill, dtype=dtype)
 
     if isinstance(globalArgs['selectNodata'], Number):
-        mask = srcs[0].read_masks(boundless=True, window=padWindow)[0]
+        mask = np.full((rows, cols), 255 if state == 'valid' else 0,
+                       dtype=np.uint8)
         img = handle_RGB(img, mask)
-        alphamask = False
+    elif state == 'valid' and globalArgs['maskThreshold'] is not None:
+        img[-1] = np.iinfo(dtype).max
+
+    return img
+
+
+def mask_from_pixels(img, nodata):
+    """The nodata mask GDAL would read for band 1, derived from its
+    pixels instead of a second read"""
+    return np.where(img[0] == nodata, 0, 255).astype(np.uint8)
+
+
+def handle_RGB(img, mask):
+    return np.concatenate([img, mask.reshape(1, mask.shape[-2], mask.shape[-1])])
+
+
+def blob_read(srcs, window, ij, globalArgs):
+    """Read stage of blob_worker.
+
+    Returns (img, mask, alphamask, levels): a finished output window
+    with mask None if the window needs no fill, else the padded image,
+    its mask, whether the mask is an alpha band and, in pyramid mode,
+    the coarser levels of the window (see nodata.pyramid).
+    """
+    profiler = globalArgs.get('profiler', null_profiler)
+    pyramid = globalArgs.get('pyramid')
+
+    if globalArgs.get('prepass', False):
+        with profiler.stage('prepass', window):
+            state = window_state(srcs[0], window, globalArgs)
+            # coarser levels may reach into a window of nodata
+            if state == 'nodata' and pyramid:
+                state = None
+            if state is not None:
+                img = read_uniform(srcs[0], window, state, globalArgs)
+        if state is not None:
+            return img, None, None, None
+
+    pad = blob_pad(globalArgs)
+    padWindow, (rows, cols) = halo_window(window, pad)
+    with profiler.stage('read', window):
+        img = srcs[0].read(boundless=True, window=padWindow)
+
+    with profiler.stage('mask', window):
+        if isinstance(globalArgs['selectNodata'], Number):
+            if globalArgs.get('maskFromPixels', False):
+                mask = mask_from_pixels(img, globalArgs['selectNodata'])
+            else:
+                mask = srcs[0].read_masks(boundless=True, window=padWindow)[0]
+            img = handle_RGB(img, mask)
+            alphamask = False
+        else:
+            mask = img[-1]
+            alphamask = True
+
+        if globalArgs['maskThreshold'] is not None and alphamask:
+            img[-1] = (np.invert(img[-1] < globalArgs['maskThreshold']).astype(img.dtype)
+                       * np.iinfo(img.dtype).max)
+            mask = img[-1]
+
+    levels = None
+    if pyramid:
+        with profiler.stage('levels', window):
+            levels = read_levels(srcs[0], window, pad, pyramid)
+
+    return img, mask, alphamask, levels
+
+
+def blob_compute(data, window, ij, globalArgs):
+    """Compute stage of blob_worker: fill and nibble what blob_read
+    read, cropped back to the window"""
+    img, mask, alphamask, levels = data
+    if mask is None:
+        return img
+
+    profiler = globalArgs.get('profiler', null_profiler)
+    pad = blob_pad(globalArgs)
+    padWindow, (rows, cols) = halo_window(window, pad)
+
+    if levels is not None:
+        needsFill = np.count_nonzero(mask[rows, cols]) < mask[rows, cols].size
     else:
-        mask = img[-1]
-        alphamask = True
-
-    if globalArgs['maskThreshold'] is not None and alphamask:
-        img[-1] = (np.invert(img[-1] < globalArgs['maskThreshold']).astype(img.dtype)
-                   * np.iinfo(img.dtype).max)
-        mask = img[-1]
-
-    if runNodataFiller(mask, pad):
-        img = fill_nodata(
-            img, mask, globalArgs['bands'],
-            globalArgs['max_search_distance'])[:, pad: -pad, pad: -pad]
-
-        if globalArgs['nibblemask'] \
-                and alphamask is False \
-                and 'nodata' in srcs[0].meta:
-
-            img = nibble_filled_mask(
-                img,
-                srcs[0].meta['nodata'],
-                globalArgs['max_search_distance'])
-
-        elif globalArgs['nibblemask'] and alphamask:
-            img[-1] = nibble_filled_mask(
-                img[-1],
-                None,
-                globalArgs['max_search_distance'],
-                True)
+        needsFill = runNodataFiller(mask, pad)
+
+    if needsFill:
+        fill = fill_engines[globalArgs.get('fillEngine', 'gdal')]
+        # the batched engine already searches only from pixels in
+        # reach of valid data
+        if globalArgs.get('edgeFill', False) and fill is fill_nodata:
+            fill = partial(fill_edges, fill)
+
+        with profiler.stage('fill', window):
+            if levels is not None:
+                img = fill_pyramid(
+                    fill, img, mask, levels, globalArgs['bands'],
+                    globalArgs['max_search_distance'], pad)
+            else:
+                img = fill(
+                    img, mask, globalArgs['bands'],
+                    globalArgs['max_search_distance'])
+        with profiler.stage('crop', window):
+            img = img[:, rows, cols]
+
+        with profiler.stage('nibble', window):
+            if globalArgs['nibblemask'] and alphamask is False:
+                img = nibble_filled_mask(
+                    img,
+                    globalArgs['nodata'],
+                    globalArgs['max_search_distance'])
+
+            elif globalArgs['nibblemask'] and alphamask:
+                img[-1] = nibble_filled_mask(
+                    img[-1],
+                    None,
+                    globalArgs['max_search_distance'],
+                    True)
 
     else:
-        img = img[:, pad: -pad, pad: -pad]
+        with profiler.stage('crop', window):
+            img = img[:, rows, cols]
 
     return img
 
 
-def blob_nodata(
-        src_path, dst_path, bidx, max_search_distance, nibblemask,
-        creation_options, maskThreshold, workers, alphafy):
+def blob_worker(srcs, window, ij, globalArgs):
+    return blob_compute(
+        blob_read(srcs, window, ij, globalArgs), window, ij, globalArgs)
+
+
+def blob_array(img, mask, max_search_distance=4, bands=None,
+               nibblemask=False, nodata=0, alpha=False, fillEngine='gdal',
+               edgeFill=True, pad=0):
+    """Blob an image held in memory, as blob_nodata does every window.
+
+    img is a (bands, rows, cols) array and mask a (rows, cols) array, 0
+    where img is nodata. The given bands (numbered from 1, default all)
+    are filled from valid pixels up to max_search_distance away. To get
+    a blobbed alpha band, as blob --alphafy writes, append the mask to
+    img as its last band.
+
+    With alpha, the last band of img is an alpha band and nibblemask
+    shrinks it by max_search_distance; otherwise nibblemask sets pixels
+    within max_search_distance of nodata in the first three bands back
+    to nodata. The pad rows and columns along every edge are context
+    for the fill only, and are cropped off the result.
+
+    Returns a new array; img isn't modified.
     """
+    rows, cols = mask.shape
+    window = Window(pad, pad, cols - 2 * pad, rows - 2 * pad)
+    globalArgs = {
+        'max_search_distance': max_search_distance,
+        'nibblemask': nibblemask,
+        'bands': list(bands or range(1, img.shape[0] + 1)),
+        'fillEngine': fillEngine,
+        'edgeFill': edgeFill,
+        'nodata': nodata,
+        'pad': pad
+    }
+
+    return blob_compute(
+        (img.copy(), mask, alpha, None), window, None, globalArgs)
+
+
+def blob_windows(src, max_search_distance=4, nibblemask=False, bidx=None,
+                 maskThreshold=None, alphafy=False, windows=None, **kwargs):
+    """Blob an open dataset window by window, without writing it.
+
+    Yields (window, array) pairs for windows (by default, the dataset's
+    blocks, or tiles of a tileSize), each array blobbed as blob_nodata
+    would write it. Other keyword arguments are those of plan_blob.
+    """
+    planned, options, globalArgs = plan_dataset(
+        src, bidx, max_search_distance, nibblemask, {}, maskThreshold,
+        alphafy, **kwargs)
+    if windows is None:
+        windows = [window for window, ij in planned]
+
+    for window in windows:
+        yield window, blob_worker([src], window, None, globalArgs)
+
+
+def plan_blob(
+        src_path, bidx, max_search_distance, nibblemask, creation_options,
+        maskThreshold, alphafy, prepass=True, fillEngine='gdal',
+        tileSize=None, maskFromPixels=True, edgeFill=True, pyramid=0,
+        cog=False):
+    """Plan a blob run: returns its [window, ij] list, output options
+    and the global arguments for blob_worker.
+
+    With pyramid levels, windows are also filled from that many coarser
+    levels, each reaching twice as far (see nodata.pyramid); this needs
+    a source with a nodata value.
+
+    With cog, the output is tiled as a cloud optimized GeoTIFF (see
+    cog_options) and the windows are its tiles, or runs of them along a
+    row with a tileSize, instead of the source's blocks.
     """
     with rio.open(src_path) as src:
+        return plan_dataset(
+            src, bidx, max_search_distance, nibblemask, creation_options,
+            maskThreshold, alphafy, prepass=prepass, fillEngine=fillEngine,
+            tileSize=tileSize, maskFromPixels=maskFromPixels,
+            edgeFill=edgeFill, pyramid=pyramid, cog=cog)
+
+
+def plan_dataset(
+        src, bidx, max_search_distance, nibblemask, creation_options,
+        maskThreshold, alphafy, prepass=True, fillEngine='gdal',
+        tileSize=None, maskFromPixels=True, edgeFill=True, pyramid=0,
+        cog=False):
+    """plan_blob for an open dataset. bidx is a JSON list of bands, as
+    the command line takes it, or a list."""
+    # coarse pyramid levels line up across windows only if their
+    # offsets are multiples of the coarsest level's pixels
+    align = 2 ** pyramid
+    windows = [
+        [window, ij] for ij, window in tile_windows(src, tileSize, align)
+    ]
+
+    options = src.meta.copy()
+    kwds = src.profile.copy()
+
+    nodata = src.nodata
+    outNodata, selectNodata, outCount = test_rgb(src.count, nodata, alphafy, 4)
+
+    options.update(**kwds)
+    options.update(**creation_options)
+    options.update(count=outCount, nodata=outNodata)
+
+    if cog:
+        options = cog_options(options, creation_options)
         windows = [
-            [window, ij] for ij, window in src.block_windows()
+            [window, ij] for ij, window in grid_windows(
+                src.shape, options['blockxsize'], tileSize)
         ]
 
-        options = src.meta.copy()
-        kwds = src.profile.copy()
+    if bidx:
+        try:
+            if isinstance(bidx, str):
+                bidx = json.loads(bidx)
+            bidx = [int(b) for b in bidx]
+        except Exception as e:
+            raise e
+
+        if bidx and (len(bidx) == 0 or len(bidx) > src.count):
+            raise ValueError(
+                "Bands %s differ from source count of %s" %
+                (', '.join([str(b) for b in bidx]), src.count))
+    elif alphafy and src.count == 3:
+        bidx = list(src.indexes)
+        bidx.append(src.indexes[-1] + 1)
+    else:
+        bidx = list(src.indexes)
+
+    if maskThreshold is not None:
+        maskThreshold = np.iinfo(options['dtype']).max - maskThreshold
+
+    if pyramid and not isinstance(selectNodata, Number):
+        raise ValueError(
+            "Pyramid fill needs a source with a nodata value")
+    for window, ij in windows:
+        if window.row_off % align or window.col_off % align:
+            raise ValueError(
+                "Pyramid fill of %d levels needs windows at multiples of "
+                "%d pixels, not at %d, %d" % (
+                    pyramid, align, window.row_off, window.col_off))
+
+    # Deriving the mask from the pixels already read matches GDAL
+    # only for a plain nodata mask on integer data: mask bands take
+    # precedence, and float nodata is compared with a tolerance
+    maskFromPixels = (
+        maskFromPixels
+        and isinstance(selectNodata, Number)
+        and src.mask_flag_enums[0] == (MaskFlags.nodata,)
+        and np.issubdtype(np.dtype(src.dtypes[0]), np.integer))
+
+    globalArgs = {
+        'max_search_distance': max_search_distance,
+        'nibblemask': nibblemask,
+        'bands': bidx,
+        'maskThreshold': maskThreshold,
+        'selectNodata': selectNodata,
+        'prepass': prepass,
+        'fillEngine': fillEngine,
+        'maskFromPixels': maskFromPixels,
+        'edgeFill': edgeFill,
+        'pyramid': pyramid,
+        'nodata': nodata
+    }
+
+    return windows, options, globalArgs
+
+
+def cog_options(options, creation_options, blocksize=512):
+    """Output options for a cloud optimized GeoTIFF: square tiles of the
+    creation options' blockxsize or blocksize, pixel interleaved and
+    compressed (deflate unless the creation options or source say
+    otherwise)"""
+    block = int(creation_options.get('blockxsize') or blocksize)
+    options = dict(options)
+    options.update(
+        driver='GTiff', tiled=True, blockxsize=block, blockysize=block,
+        interleave='pixel', compress=options.get('compress') or 'deflate')
+    options.setdefault('bigtiff', 'if_safer')
+    return options
+
+
+def write_cog(path, dst_path, options):
+    """Copy a GeoTIFF with overviews, created with options, to dst_path
+    as a cloud optimized GeoTIFF: headers first, then the overviews'
+    tiles from the smallest, then the full resolution tiles"""
+    import rasterio.shutil
+
+    creation = dict(
+        (k, v) for k, v in options.items()
+        if k not in ('driver', 'dtype', 'count', 'width', 'height', 'crs',
+                     'transform', 'nodata'))
+    rasterio.shutil.copy(
+        path, dst_path, driver='GTiff', copy_src_overviews=True, **creation)
+
+
+def plan_blob_memory(maxMemory, plan, tileSize, workers, engine, prefetch,
+                     overviewFactor=None):
+    """Fit a blob run to a budget of maxMemory bytes (see nodata.memory).
+
+    plan(tileSize=...) plans the run's windows (see plan_blob). Tiles
+    of tileSize are halved down to blocks until they fit, with as many
+    of the workers as possible; without a tileSize only blocks are
+    tried. With an overviewFactor, the finest overview level is kept in
+    memory too, if it fits in half of maxMemory. Returns the tileSize, workers and windows in flight to
+    run with.
+    """
+    windows, options, globalArgs = plan(tileSize=None)
+    block = max(max(w.height, w.width) for w, ij in windows)
+    sizes = []
+    size = tileSize
+    while size and size > block:
+        sizes.append(size)
+        size //= 2
+    sizes.append(None)
+
+    itemsize = np.dtype(options['dtype']).itemsize
+    bands = options['count']
+    pad = blob_pad(globalArgs)
+    candidates = []
+    for size in sizes:
+        windows, options, globalArgs = plan(tileSize=size)
+        rows = max(w.height for w, ij in windows)
+        cols = max(w.width for w, ij in windows)
+        window = blob_window_bytes(
+            (rows, cols), pad, bands, options['dtype'],
+            globalArgs['fillEngine'], globalArgs['pyramid'],
+            globalArgs['nibblemask'])
+        result = rows * cols * bands * itemsize
+        if engine == 'pipeline':
+            # windows are read ahead, padded
+            held = result + (
+                (rows + 2 * pad) * (cols + 2 * pad) * bands * itemsize)
+        elif engine == 'threads':
+            held = result
+        else:
+            # pickled, then unpickled
+            held = 2 * result
+        candidates.append((size, window, held))
 
-        outNodata, selectNodata, outCount = test_rgb(src.count, src.nodata, alphafy, 4)
+    fixed = 0
+    shape = (options['height'], options['width'])
+    if overviewFactor and keep_level(
+            shape, bands, options['dtype'], overviewFactor, maxMemory):
+        fixed = level_bytes(shape, bands, options['dtype'], overviewFactor)
 
-        options.update(**kwds)
-        options.update(**creation_options)
-        options.update(count=outCount, nodata=outNodata)
+    inFlight = prefetch if engine == 'pipeline' else max(prefetch, 2 * workers)
+    tileSize, workers, inFlight, _ = fit_budget(
+        maxMemory, candidates, workers, inFlight,
+        processes=engine == 'riomucho', fixed=fixed)
+    return tileSize, workers, inFlight
 
-        if bidx:
-            try:
-                bidx = [int(b) for b in json.loads(bidx)]
-            except Exception as e:
-                raise e
-
-            if bidx and (len(bidx) == 0 or len(bidx) > src.count):
-                raise ValueError(
-                    "Bands %s differ from source count of %s" %
-                    (', '.join([str(b) for b in bidx]), src.count))
-        elif alphafy and src.count == 3:
-            bidx = list(src.indexes)
-            bidx.append(src.indexes[-1] + 1)
-        else:
-            bidx = list(src.indexes)
 
-        if maskThreshold is not None:
-            maskThreshold = np.iinfo(options['dtype']).max - maskThreshold
+def blob_nodata(
+        src_path, dst_path, bidx, max_search_distance, nibblemask,
+        creation_options, maskThreshold, workers, alphafy, prepass=True,
+        fillEngine='gdal', tileSize=None, maskFromPixels=True,
+        engine='riomucho', prefetch=8, checkpoint=None, resume=False,
+        profile=False, edgeFill=True, pyramid=0, overviews=None,
+        overviewResampling='average', cog=False, maxMemory=None):
+    """
+    With profile, returns a summary of the time spent in each stage of
+    the windows (see nodata.profiling.summarize).
+
+    With overviews (a list of factors, multiples of the smallest), the
+    output gets internal overviews built from the windows as they are
+    written (see nodata.overviews). Checkpointed runs, windows that don't
+    line up with the smallest factor, and outputs whose finest level is
+    too large to keep in memory (see nodata.overviews.keep_level) get
+    them built from the output instead.
+
+    With cog, the output is a cloud optimized GeoTIFF: windows are its
+    tiles (see plan_blob), with overviews down to a single tile unless
+    overviews are given. As its overviews' tiles must come before the
+    full resolution ones, tiles and overviews are written, in tile order
+    by any engine, to a temporary file next to dst_path, which is then
+    copied to dst_path in that layout (see write_cog). It can't be
+    checkpointed.
+
+    With maxMemory, a budget in bytes, the tile size, workers and windows
+    in flight are lowered to fit it (see plan_blob_memory), and GDAL's
+    block cache is capped in every process. The riomucho engine is
+    replaced by a process pool that holds at most that many windows,
+    which also writes them in order.
+    """
+    if cog and (checkpoint or resume):
+        raise ValueError("COG output can't be checkpointed or resumed")
+
+    plan = partial(
+        plan_blob, src_path, bidx, max_search_distance, nibblemask,
+        creation_options, maskThreshold, alphafy, prepass=prepass,
+        fillEngine=fillEngine, maskFromPixels=maskFromPixels,
+        edgeFill=edgeFill, pyramid=pyramid, cog=cog)
+
+    maxInFlight = None
+    env = {}
+    if maxMemory:
+        overviewFactor = overviews[0] if overviews else (2 if cog else None)
+        tileSize, workers, maxInFlight = plan_blob_memory(
+            maxMemory, plan, tileSize, workers, engine, prefetch,
+            overviewFactor)
+        env.update(cache_options())
+
+    windows, options, globalArgs = plan(tileSize=tileSize)
+
+    if cog and not overviews:
+        overviews = cog_factors(
+            (options['height'], options['width']), options['blockxsize'])
+
+    outPath = dst_path
+    if cog:
+        fd, outPath = tempfile.mkstemp(
+            suffix='.tif', dir=os.path.dirname(os.path.abspath(dst_path)))
+        os.close(fd)
+
+    run = profiling(profile)
+    try:
+        with run as profiler, rio.Env(**env):
+            if profile:
+                globalArgs['profiler'] = profiler
+
+            aligned = overviews and not (checkpoint or resume) and all(
+                w.row_off % overviews[0] == 0 and
+                w.col_off % overviews[0] == 0 for w, ij in windows
+            ) and keep_level(
+                (options['height'], options['width']), options['count'],
+                options['dtype'], overviews[0], maxMemory)
+
+            if checkpoint or resume:
+                run_checkpointed(
+                    src_path, dst_path, windows, options, globalArgs,
+                    workers, engine, prefetch, checkpoint or 64, resume,
+                    tileSize, maxInFlight)
+            elif aligned:
+                dst = rio.open(outPath, 'w', **options)
+                create_overviews(dst, overviews)
+                accumulator = OverviewAccumulator(
+                    (options['height'], options['width']), options['count'],
+                    options['dtype'], overviews, overviewResampling,
+                    alpha=options['nodata'] is None, nodata=options['nodata'])
+                run_windows(
+                    src_path, accumulator.tap(dst), windows, options,
+                    globalArgs, workers, engine, prefetch, ordered=cog,
+                    maxInFlight=maxInFlight)
+                write_overviews(outPath, accumulator)
+            else:
+                run_windows(
+                    src_path, outPath, windows, options, globalArgs, workers,
+                    engine, prefetch, ordered=cog, maxInFlight=maxInFlight)
+
+            if overviews and not aligned:
+                with rio.open(outPath, 'r+') as dst:
+                    dst.build_overviews(
+                        overviews, getattr(Resampling, overviewResampling))
+
+            if cog:
+                write_cog(outPath, dst_path, options)
+    finally:
+        if cog:
+            os.remove(outPath)
+
+    return run.summary
+
+
+def run_windows(src_path, outpath_or_dataset, windows, options, globalArgs,
+                workers, engine='riomucho', prefetch=8, ordered=False,
+                maxInFlight=None, pool=None):
+    """Blob windows of src_path with one of the execution engines,
+    writing to a new dataset or one already opened for writing.
+
+    The pipeline and threads engines write windows in order. With
+    ordered, so does riomucho's: its worker processes are replaced by a
+    pool whose results wait for their turn (see run_ordered).
+
+    maxInFlight bounds the windows read, computed or waiting to be
+    written by any engine; riomucho's pool is replaced as for ordered.
+    So is it by a given process pool, which is left running.
+    """
+    if 'profiler' in globalArgs:
+        if not isinstance(outpath_or_dataset, rio.io.DatasetWriter):
+            outpath_or_dataset = rio.open(outpath_or_dataset, 'w', **options)
+        timed_writes(outpath_or_dataset, globalArgs['profiler'])
+
+    if engine == 'pipeline':
+        run_pipeline(
+            src_path, outpath_or_dataset, blob_read, blob_compute, windows,
+            options, globalArgs, workers=workers,
+            prefetch=maxInFlight or prefetch)
+        return
+    elif engine == 'threads':
+        # whole windows in a thread pool, without pickling results
+        run_pipeline(
+            src_path, outpath_or_dataset, blob_worker, None, windows,
+            options, globalArgs, readers=workers,
+            prefetch=maxInFlight or max(prefetch, 2 * workers))
+        return
+
+    elif ordered or maxInFlight or pool is not None:
+        if not isinstance(outpath_or_dataset, rio.io.DatasetWriter):
+            outpath_or_dataset = rio.open(outpath_or_dataset, 'w', **options)
+        run_ordered(
+            src_path, outpath_or_dataset, windows, globalArgs, workers,
+            maxInFlight or max(prefetch, 2 * workers), pool)
+        return
+
+    import riomucho
 
     with riomucho.RioMucho(
-            [src_path], dst_path, blob_worker,
+            [src_path], outpath_or_dataset, blob_worker,
             windows=windows,
-            global_args={
-                'max_search_distance': max_search_distance,
-                'nibblemask': nibblemask,
-                'bands': bidx,
-                'maskThreshold': maskThreshold,
-                'selectNodata': selectNodata
-            },
+            global_args=globalArgs,
             options=options,
             mode='manual_read') as rm:
 
         rm.run(workers)
 
 
+def run_ordered(src_path, dst, windows, globalArgs, workers, max_in_flight,
+                pool=None):
+    """Blob windows in worker processes, writing them to an open dataset
+    in window order, and close it.
+
+    Windows that finish early are held back until the ones before them
+    are written; at most max_in_flight windows are queued, computed or
+    held at any time. A given pool is used instead of a new one, and
+    left running.
+    """
+    from multiprocessing import Pool
+    from nodata import batch
+    from nodata.throttle import Throttle
+
+    # the pool's feeder waits on the throttle for the writes to catch up
+    throttle = Throttle(max_in_flight)
+    tasks = (
+        (0, src_path, window, ij, globalArgs) for window, ij in windows)
+
+    owned = pool is None and workers > 1
+    if owned:
+        pool = Pool(workers)
+    imap = pool.imap if pool is not None else map
+
+    try:
+        with dst:
+            for index, window, data in imap(
+                    batch.batch_worker, throttle.feed(tasks)):
+                dst.write(data, window=window)
+                throttle.release()
+    except BaseException:
+        # let the feeder go, or a shared pool stays parked on this run
+        throttle.stop()
+        raise
+    finally:
+        if owned:
+            pool.close()
+            pool.join()
+        if pool is None:
+            while batch.open_datasets:
+                batch.open_datasets.popitem()[1].close()
+
+
+def checkpoint_path(dst_path):
+    return dst_path + '.checkpoint'
+
+
+def read_checkpoint(path):
+    """Read a checkpoint file: its header, then the set of (i, j)
+    indexes of windows recorded as written"""
+    with open(path) as f:
+        header = json.loads(f.readline())
+        done = set()
+        for line in f:
+            try:
+                done.update(tuple(ij) for ij in json.loads(line))
+            except ValueError:
+                # a line cut short by the interruption
+                break
+
+    return header, done
+
+
+# Blob parameters a checkpoint is only good for
+_CHECKPOINT_PARAMS = (
+    'max_search_distance', 'nibblemask', 'bands', 'maskThreshold',
+    'selectNodata', 'fillEngine', 'edgeFill', 'pyramid')
+
+
+def checkpoint_header(src_path, windows, options, globalArgs, tileSize):
+    """What a checkpoint was written for: the source, the windows and
+    the blob parameters, as read back from the checkpoint file"""
+    header = {
+        'src_path': os.path.abspath(src_path),
+        'windows': len(windows),
+        'tileSize': tileSize,
+        'count': options['count']
+    }
+    header.update((k, globalArgs.get(k)) for k in _CHECKPOINT_PARAMS)
+    return json.loads(json.dumps(header))
+
+
+def run_checkpointed(src_path, dst_path, windows, options, globalArgs,
+                     workers, engine, prefetch, every, resume, tileSize,
+                     maxInFlight=None):
+    """Blob windows in runs of every windows, recording each finished run
+    in a checkpoint file next to dst_path. With resume, windows already
+    recorded are skipped and the output is updated in place; resuming
+    with another source or other blob parameters raises ValueError.
+
+    Every run closes the output, so that what the checkpoint records is
+    on disk, and reopens it. riomucho's worker processes are replaced by
+    one pool for all runs (see run_ordered), so a small every only costs
+    the reopening.
+
+    The checkpoint is removed once all windows are written.
+    """
+    path = checkpoint_path(dst_path)
+    header = checkpoint_header(
+        src_path, windows, options, globalArgs, tileSize)
+    started = False
+
+    if resume and os.path.exists(path):
+        previous, done = read_checkpoint(path)
+        if previous != header:
+            raise ValueError(
+                "Checkpoint %s was written for %s, not %s" % (
+                    path, previous, header))
+        # until a first run is recorded the output may not be usable
+        started = bool(done) and os.path.exists(dst_path)
+    elif resume and os.path.exists(dst_path):
+        raise ValueError("No checkpoint to resume %s from" % dst_path)
+
+    if started:
+        windows = [[w, ij] for w, ij in windows if tuple(ij) not in done]
+    else:
+        with open(path, 'w') as f:
+            f.write(json.dumps(header) + '\n')
+
+    pool = None
+    if engine == 'riomucho' and workers > 1:
+        from multiprocessing import Pool
+        pool = Pool(workers)
+
+    try:
+        for start in range(0, len(windows), every):
+            run = windows[start: start + every]
+            destination = rio.open(dst_path, 'r+') if started else dst_path
+            run_windows(
+                src_path, destination, run, options, globalArgs, workers,
+                engine, prefetch, maxInFlight=maxInFlight, pool=pool)
+            started = True
+
+            with open(path, 'a') as f:
+                f.write(json.dumps([list(ij) for w, ij in run]) + '\n')
+    finally:
+        # run_ordered has let its feeder go on error, so this only
+        # waits for the windows in flight; terminate() can hang while
+        # a worker is sending one
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    os.remove(path)
+
+
+def _square_filter(arr, size, filter1d):
+    """Apply a square min/max filter as two running 1D passes, whose
+    cost doesn't grow with the size of the square"""
+    return filter1d(filter1d(arr, size, axis=-2), size, axis=-1)
+
+
 def nibble_filled_mask(filled, nodataval, max_search_distance, is_mask=False):
+    from scipy.ndimage import maximum_filter1d, minimum_filter1d
+
     filled = np.array(filled)
+    size = max_search_distance * 2 + 1
     if is_mask:
-        filled = minimum_filter(filled, size=(max_search_distance * 2 + 1))
+        filled = _square_filter(filled, size, minimum_filter1d)
     else:
         nmsk = (filled[0] == nodataval) & (filled[1] == nodataval) & (filled[2] == nodataval)
-        nmsk = maximum_filter(nmsk, size=(max_search_distance * 2 + 1))
-        mskInds = np.where(nmsk == True)
-        filled[:, mskInds[0], mskInds[1]] = nodataval
+        if not nmsk.any():
+            return filled
+        nmsk = _square_filter(nmsk, size, maximum_filter1d)
+        for band in filled:
+            np.putmask(band, nmsk, nodataval)
 
     return filled
 
 
-def make_nibbled(src_path, dst_path, nibble):
+def nibble_worker(srcs, window, ij, globalArgs):
+    """Nibble one window, reading a halo of the nibble distance around
+    it. The halo is clipped to the raster rather than read boundless so
+    that the raster edge behaves as it does for a whole-raster nibble.
+    """
+    src = srcs[0]
+    pad = globalArgs['nibble']
+    read, (rows, cols) = halo_window(window, pad, src.shape)
+
+    img = src.read(window=read)
+    img = nibble_filled_mask(img, globalArgs['nodata'], pad)
+
+    return img[:, rows, cols]
+
+
+def make_nibbled(src_path, dst_path, nibble, creation_options=None,
+                 workers=1):
+    """Nibble nodata areas of a raster block by block, in bounded memory.
+    """
+    import riomucho
+
     with rio.open(src_path, 'r') as src:
-        img = src.read(masked=False)
-        kwargs = src.meta
+        windows = [
+            [window, ij] for ij, window in src.block_windows()
+        ]
+
+        options = src.meta.copy()
+        options.update(**src.profile)
         if 'nodata' in src.meta:
             nodataval = src.meta['nodata']
         else:
             nodataval = 0.0
 
-    kwargs.update(compress='lzw')
+    options.update(compress='lzw')
+    options.update(**(creation_options or {}))
 
-    nibbled = nibble_filled_mask(img, nodataval, nibble)
+    with riomucho.RioMucho(
+            [src_path], dst_path, nibble_worker,
+            windows=windows,
+            global_args={
+                'nibble': nibble,
+                'nodata': nodataval
+            },
+            options=options,
+            mode='manual_read') as rm:
 
-    with rio.open(dst_path, 'w', **kwargs) as dst:
-        for i, arr in enumerate(nibbled, 1):
-            dst.write(arr, i)
+        rm.run(workers)
@@ -0,0 +1,137 @@
+import numpy as np
+from scipy.ndimage import maximum_filter1d
+
+
+# Column records use this for "nothing in reach": any distance measured
+# to it is far beyond a search distance
+_FAR = -(1 << 24)
+
+
+def _column_records(valid, maxSearchDistance):
+    """For every pixel, the row of the nearest valid pixel in the same
+    column above (inclusive) and below (exclusive), within
+    maxSearchDistance rows.
+
+    This mirrors the top-down / bottom-up passes of GDAL's fillnodata.
+    """
+    rows = valid.shape[0]
+    rowIdx = np.arange(rows, dtype=np.int64).reshape(rows, 1)
+
+    above = np.maximum.accumulate(np.where(valid, rowIdx, _FAR), axis=0)
+    above[(rowIdx - above) > maxSearchDistance] = _FAR
+
+    below = np.full(valid.shape, _FAR, dtype=np.int64)
+    nextRow = np.minimum.accumulate(
+        np.where(valid, rowIdx, -_FAR)[::-1], axis=0)[::-1]
+    below[:-1] = nextRow[1:]
+    below[(below - rowIdx) > maxSearchDistance] = _FAR
+
+    return above, below
+
+
+def _quadrant_search(record, tRow, tCol, step, cols, maxSearchDistance):
+    """Scan one quadrant for the nearest valid pixel of each target.
+
+    Distances are compared squared, in integers. A target drops out of
+    the scan once the next column is further away than its best find,
+    so the work shrinks as the scan widens. Ties go to the pixel found
+    last, as in GDAL.
+    """
+    flatRecord = record.ravel()
+    reach2 = maxSearchDistance * maxSearchDistance
+
+    best2 = np.full(tRow.size, reach2 + 1, dtype=np.int64)
+    bestIdx = np.zeros(tRow.size, dtype=np.int64)
+
+    active = np.arange(tRow.size)
+    col = tCol.copy() if step == -1 else np.minimum(tCol + 1, cols - 1)
+    dx = np.abs(col - tCol)
+
+    while active.size:
+        keep = (col >= 0) & (col < cols) & (dx * dx < best2[active])
+        if not keep.all():
+            active, col, dx = active[keep], col[keep], dx[keep]
+            if not active.size:
+                break
+
+        row = tRow[active]
+        candRow = flatRecord[row * cols + col]
+        dist2 = dx * dx + (candRow - row) ** 2
+        better = (dist2 <= reach2) & (dist2 <= best2[active])
+
+        if better.any():
+            hit = active[better]
+            best2[hit] = dist2[better]
+            bestIdx[hit] = candRow[better] * cols + col[better]
+
+        col = col + step
+        dx = dx + 1
+
+    return best2, bestIdx
+
+
+def fill_weights(mask, maxSearchDistance):
+    """Compute the fill neighbourhood of a window from its mask alone.
+
+    Every nodata pixel searches four quadrants (above/below x left/right)
+    for the nearest valid pixel within maxSearchDistance, as GDAL's
+    fillnodata does; the pixel is then the inverse distance weighted
+    mean of what was found.
+
+    Returns (targets, sources, weights): the flat indices of the pixels
+    to fill, a (4, n) array of flat source indices and the matching
+    (4, n) weights, zero where a quadrant found nothing.
+    """
+    valid = np.asarray(mask) > 0
+    rows, cols = valid.shape
+
+    records = _column_records(valid, maxSearchDistance)
+
+    # only pixels with a column record in reach can be filled
+    reach = maximum_filter1d(
+        (records[0] != _FAR) | (records[1] != _FAR),
+        size=2 * maxSearchDistance + 1, axis=1)
+    targets = np.flatnonzero(~valid & reach)
+    tRow, tCol = np.divmod(targets, cols)
+
+    sources = np.zeros((4, targets.size), dtype=np.intp)
+    weights = np.zeros((4, targets.size), dtype=np.float64)
+
+    quad = 0
+    for record in records:
+        for step in (-1, 1):
+            best2, bestIdx = _quadrant_search(
+                record, tRow, tCol, step, cols, maxSearchDistance)
+            hit = best2 <= maxSearchDistance * maxSearchDistance
+            sources[quad] = bestIdx
+            weights[quad, hit] = 1.0 / np.sqrt(best2[hit])
+            quad += 1
+
+    filled = weights.sum(axis=0) > 0
+
+    return targets[filled], sources[:, filled], weights[:, filled]
+
+
+def fill_nodata_batched(img, mask, fillBands, maxSearchDistance):
+    """Fill nodata in several bands at once: the search is computed from
+    the mask a single time and applied to every band in fillBands."""
+    targets, sources, weights = fill_weights(mask, maxSearchDistance)
+    if targets.size == 0:
+        return img
+
+    bandIdx = np.asarray(fillBands) - 1
+    flat = img.reshape(img.shape[0], -1)
+
+    values = (flat[bandIdx][:, sources] * weights).sum(axis=1) / weights.sum(axis=0)
+
+    if np.issubdtype(img.dtype, np.integer):
+        # GDAL interpolates through a float32 buffer before rounding
+        info = np.iinfo(img.dtype)
+        values = np.clip(
+            np.floor(values.astype(np.float32) + np.float32(0.5)),
+            info.min, info.max)
+
+    for i, b in enumerate(bandIdx):
+        flat[b, targets] = values[i]
+
+    return flat.reshape(img.shape)
@@ -0,0 +1,134 @@
+"""Memory budgets for blob and alpha runs.
+
+A run's peak memory is about the sum, over its workers, of the worker
+process, its GDAL block cache and the working set of the window it is
+computing, plus the windows queued, computed or waiting to be written.
+Working sets are estimated per pixel of a (padded) window from the
+dtype and band count of the data and the algorithm; the constants come
+from the peak RSS of single windows, rounded up (see
+benchmarks/bench_memory.py).
+
+Budgets cover what grows with the run, not the parent process itself.
+"""
+import re
+
+import numpy as np
+
+
+# Private memory of a forked worker process
+_PROCESS_BYTES = 32 * 2 ** 20
+
+# GDAL block cache of every process of a budgeted run
+CACHE_MB = 32
+
+# Copies of a padded window's bands alive at once while it is read,
+# masked, filled and cropped
+_BLOB_COPIES = 4
+
+# Search records and four weighted sources of every pixel for the
+# batched fill engine
+_BATCHED_BYTES = 80
+
+# float64 distance from nodata, its band accumulator, and the smoothed
+# and clustered images of the slic method
+_SLIC_BYTES = 32
+_SLIC_CLUSTER_BYTES = 16
+
+_units = {'': 1, 'k': 2 ** 10, 'm': 2 ** 20, 'g': 2 ** 30, 't': 2 ** 40}
+
+
+def cache_options():
+    """GDAL options capping the block cache of a budgeted run at
+    CACHE_MB. An integer GDAL_CACHEMAX is taken as bytes."""
+    return {'GDAL_CACHEMAX': CACHE_MB * 2 ** 20}
+
+
+def parse_size(value):
+    """Bytes from a size such as 512M, 1.5G or 1000000"""
+    match = re.match(r'^\s*(\d+(?:\.\d*)?)\s*([kmgt]?)i?b?\s*$', str(value), re.I)
+    if not match:
+        raise ValueError("Invalid size: %s" % value)
+    number, unit = match.groups()
+    return int(float(number) * _units[unit.lower()])
+
+
+def format_size(nbytes):
+    """The largest unit that leaves a number of at least 1, as 1.5G"""
+    for unit in 'TGMK':
+        if nbytes >= _units[unit.lower()]:
+            return '%.3g%s' % (nbytes / float(_units[unit.lower()]), unit)
+    return '%d' % nbytes
+
+
+def blob_window_bytes(shape, pad, bands, dtype, fillEngine='gdal',
+                      pyramid=0, nibblemask=False):
+    """Working set of blobbing a window of shape (rows, cols) with a
+    halo of pad pixels into bands output bands (including the mask)"""
+    rows, cols = shape
+    pixels = (rows + 2 * pad) * (cols + 2 * pad)
+    perPixel = _BLOB_COPIES * bands * np.dtype(dtype).itemsize
+    if pyramid:
+        # the coarser levels, and each one upsampled into the next
+        perPixel *= 2
+    # the mask, and the nibble's
+    perPixel += 2 if nibblemask else 1
+    if fillEngine == 'batched':
+        perPixel += _BATCHED_BYTES
+
+    return pixels * perPixel
+
+
+def alpha_window_bytes(shape, padding, bands, dtype, method='simple',
+                       decimation=1):
+    """Working set of masking a window of shape (rows, cols) of bands
+    source bands read with padding pixels around it"""
+    rows, cols = shape
+    pixels = (rows + 2 * padding) * (cols + 2 * padding)
+    itemsize = np.dtype(dtype).itemsize
+    # the read, and the mask
+    perPixel = 2 * bands * itemsize + itemsize
+    if method == 'slic':
+        perPixel += _SLIC_BYTES + _SLIC_CLUSTER_BYTES / float(decimation ** 2)
+    else:
+        # the valid and band comparison masks
+        perPixel += 2
+
+    return int(pixels * perPixel)
+
+
+def fit_budget(budget, candidates, workers, max_in_flight, processes=True,
+               fixed=0):
+    """Pick the concurrency and window size of a run that fit a budget.
+
+    candidates are (key, window_bytes, held_bytes) triples, from the
+    preferred (largest) windows to the smallest: window_bytes is the
+    working set of a window being computed, held_bytes what every window
+    in flight takes until it is written. With processes, every worker
+    is a process with its own block cache, else they share the caller's.
+    fixed is taken off the budget first.
+
+    More workers are preferred to larger windows. Returns (key,
+    workers, in_flight, estimate); raises ValueError if even a single
+    worker on the smallest windows doesn't fit.
+    """
+    cache = CACHE_MB * 2 ** 20
+    # the caller's own cache, for writing
+    fixed += cache
+    for n in range(workers, 0, -1):
+        for key, window_bytes, held_bytes in candidates:
+            per_worker = window_bytes
+            if processes:
+                per_worker += _PROCESS_BYTES + cache
+            room = budget - fixed - n * per_worker
+            in_flight = min(max_in_flight, room // max(held_bytes, 1))
+            if in_flight >= n:
+                return (
+                    key, n, int(in_flight),
+                    fixed + n * per_worker + in_flight * held_bytes)
+
+    key, window_bytes, held_bytes = candidates[-1]
+    needed = fixed + window_bytes + held_bytes + (
+        _PROCESS_BYTES + cache if processes else 0)
+    raise ValueError(
+        "A memory budget of %s is below the %s a single window needs" % (
+            format_size(budget), format_size(needed)))
@@ -0,0 +1,184 @@
+"""Overviews built from windows as they are written.
+
+The output's overview levels are created empty before any data is
+written. Every window written is decimated into an in-memory copy of
+the finest level, from which the coarser levels are decimated in turn;
+all levels are written to the output's overviews once it is closed, so
+the output is never read back. The finest level takes a quarter of the
+output's size in memory at factor 2: above MAX_LEVEL_BYTES (see
+keep_level), overviews are built from the output instead.
+"""
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+
+from nodata.windows import pad_window
+
+# largest finest level kept in memory without a memory budget
+MAX_LEVEL_BYTES = 512 * 1024 * 1024
+
+
+def parse_factors(value):
+    """Overview factors from a comma separated string, such as 2,4,8"""
+    factors = sorted(set(int(f) for f in value.split(',') if f.strip()))
+    if not factors or factors[0] < 2:
+        raise ValueError("Overview factors must be integers above 1")
+    for f in factors[1:]:
+        if f % factors[0]:
+            raise ValueError(
+                "Overview factors must be multiples of the smallest one")
+    return factors
+
+
+def cog_factors(shape, block):
+    """Factors of 2 from 2 up to the first whose level fits in a single
+    block x block tile, as a cloud optimized GeoTIFF's overviews are"""
+    factors = []
+    f = 1
+    while -(-max(shape) // f) > block:
+        f *= 2
+        factors.append(f)
+    return factors
+
+
+def level_bytes(shape, count, dtype, factor):
+    """Bytes of an overview level at factor of a dataset"""
+    rows, cols = shape
+    return (count * np.dtype(dtype).itemsize *
+            -(-rows // factor) * -(-cols // factor))
+
+
+def keep_level(shape, count, dtype, factor, maxMemory=None):
+    """Whether the finest level, at factor, may be kept in memory: it
+    must fit in half of maxMemory, or MAX_LEVEL_BYTES without one"""
+    limit = maxMemory // 2 if maxMemory else MAX_LEVEL_BYTES
+    return level_bytes(shape, count, dtype, factor) <= limit
+
+
+def _cell_sums(a, factor):
+    """Sums over factor x factor cells of the last two axes, whose sizes
+    are multiples of factor, in wide accumulators"""
+    acc = np.float64 if np.issubdtype(a.dtype, np.floating) else np.int64
+    out = a[..., ::factor, ::factor].astype(acc)
+    for i in range(factor):
+        for j in range(factor):
+            if i or j:
+                out += a[..., i::factor, j::factor]
+    return out
+
+
+def decimate(arr, factor, resampling='average', alpha=False, nodata=None):
+    """Decimate a (bands, rows, cols) array factor times, taking the top
+    left pixel of every factor x factor cell or their average. Cells cut
+    by the array's bottom and right edges are decimated from the pixels
+    they have. With alpha, color bands are averaged over the pixels the
+    last (alpha) band shows. Otherwise, with nodata, as GDAL's average
+    does, nodata pixels are left out, and cells with nothing else are
+    nodata."""
+    bands, rows, cols = arr.shape
+    if resampling == 'nearest':
+        return arr[:, ::factor, ::factor].copy()
+    elif resampling != 'average':
+        raise ValueError("Unknown resampling: %s" % resampling)
+
+    outRows, outCols = -(-rows // factor), -(-cols // factor)
+    weights = np.ones((rows, cols), dtype=np.uint8)
+    if (outRows * factor, outCols * factor) != (rows, cols):
+        padded = np.zeros(
+            (bands, outRows * factor, outCols * factor), dtype=arr.dtype)
+        padded[:, :rows, :cols] = arr
+        weights = np.zeros(padded.shape[1:], dtype=np.uint8)
+        weights[:rows, :cols] = 1
+        arr = padded
+
+    counts = _cell_sums(weights, factor)
+    sums = _cell_sums(arr, factor)
+    if alpha:
+        shown = weights * (arr[-1] > 0)
+        colorCounts = _cell_sums(shown, factor)
+        sums[:-1] = _cell_sums(arr[:-1] * shown, factor)
+        counts = np.concatenate([
+            np.repeat(colorCounts[np.newaxis], bands - 1, axis=0),
+            counts[np.newaxis]])
+    elif nodata is not None:
+        if np.isnan(nodata):
+            valid = ~np.isnan(arr)
+        else:
+            valid = arr != nodata
+        shown = weights * valid
+        counts = _cell_sums(shown, factor)
+        sums = _cell_sums(np.where(valid, arr, 0), factor)
+
+    out = sums / np.maximum(counts, 1)
+    if np.issubdtype(arr.dtype, np.integer):
+        out = np.floor(out + 0.5)
+    if nodata is not None and not alpha:
+        out[counts == 0] = nodata
+    return out.astype(arr.dtype)
+
+
+class OverviewAccumulator:
+    """In-memory overview levels of a dataset being written window by
+    window. Averages are taken as decimate's, with alpha or nodata."""
+
+    def __init__(self, shape, count, dtype, factors, resampling='average',
+                 alpha=False, nodata=None):
+        self.factors = factors
+        self.resampling = resampling
+        self.alpha = alpha
+        self.nodata = nodata
+        rows, cols = shape
+        f = factors[0]
+        self.level = np.zeros(
+            (count, -(-rows // f), -(-cols // f)), dtype=dtype)
+
+    def add(self, window, data):
+        """Decimate a window of data into the finest level. The window's
+        offsets must be multiples of the finest factor."""
+        f = self.factors[0]
+        (r0, r1), (c0, c1) = pad_window(window, 0)
+        if r0 % f or c0 % f:
+            raise ValueError(
+                "Window %s is not aligned to overview factor %d" % (
+                    window, f))
+        small = decimate(data, f, self.resampling, self.alpha, self.nodata)
+        self.level[:, r0 // f:r0 // f + small.shape[1],
+                   c0 // f:c0 // f + small.shape[2]] = small
+
+    def tap(self, dst):
+        """Also add every window written to an open dataset. Returns the
+        dataset."""
+        write = dst.write
+
+        def tapped_write(data, *args, **kwargs):
+            write(data, *args, **kwargs)
+            self.add(kwargs['window'], data)
+
+        dst.write = tapped_write
+        return dst
+
+    def levels(self):
+        """(factor, array) of every level, each decimated from the
+        previous one"""
+        level = self.level
+        previous = self.factors[0]
+        yield previous, level
+        for f in self.factors[1:]:
+            level = decimate(
+                level, f // previous, self.resampling, self.alpha, self.nodata)
+            previous = f
+            yield f, level
+
+
+def create_overviews(dst, factors):
+    """Add empty overview levels to a newly created dataset: with no
+    data written yet, there's nothing to read"""
+    dst.build_overviews(factors, Resampling.nearest)
+
+
+def write_overviews(path, accumulator):
+    """Write the accumulated levels to the overviews of a closed dataset
+    made with create_overviews"""
+    for index, (factor, level) in enumerate(accumulator.levels()):
+        with rasterio.open(path, 'r+', overview_level=index) as ovr:
+            ovr.write(level[:, :ovr.height, :ovr.width])
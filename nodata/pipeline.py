@@ -0,0 +1,129 @@
+from collections import deque
+import threading
+
+import rasterio
+
+try:
+    from concurrent.futures import Future, ThreadPoolExecutor
+except ImportError:
+    # Python 2 without the futures backport
+    Future = ThreadPoolExecutor = None
+
+
+class ReadAheadPipeline:
+    """Read, compute and write windows of a raster in three stages.
+
+    A pool of reader threads, each with its own dataset handle, reads
+    windows ahead of the compute stage; a pool of compute threads works
+    on whatever has been read; the caller writes results in window
+    order. At most prefetch windows are read, computed or waiting to be
+    written at any time.
+
+    read_func(srcs, window, ij, globalArgs) and compute_func(data,
+    window, ij, globalArgs) split the work of a riomucho manual_read
+    worker: whatever read_func returns is passed on to compute_func.
+    Without a compute_func, read_func does all the work and the readers
+    are a plain thread pool.
+    """
+
+    def __init__(self, src_path, read_func, compute_func, global_args,
+                 readers=2, workers=1, prefetch=8):
+        if ThreadPoolExecutor is None:
+            raise ValueError(
+                "Thread pools need concurrent.futures, from the futures "
+                "package on Python 2")
+        self.src_path = src_path
+        self.read_func = read_func
+        self.compute_func = compute_func
+        self.global_args = global_args
+        self.readers = readers
+        self.workers = workers
+        self.prefetch = max(prefetch, 1)
+
+        self._local = threading.local()
+        self._handles = []
+        self._lock = threading.Lock()
+
+    def _srcs(self):
+        """This thread's dataset handles"""
+        srcs = getattr(self._local, 'srcs', None)
+        if srcs is None:
+            srcs = self._local.srcs = [rasterio.open(self.src_path)]
+            with self._lock:
+                self._handles.extend(srcs)
+        return srcs
+
+    def _read(self, window, ij):
+        return self.read_func(self._srcs(), window, ij, self.global_args)
+
+    def _submit(self, window, ij):
+        """Queue a read, then a compute once the read is done"""
+        done = Future()
+
+        def chain(future, then=None):
+            try:
+                result = future.result()
+            except Exception as exc:
+                done.set_exception(exc)
+                return
+            if then is None:
+                done.set_result(result)
+            else:
+                try:
+                    compute = self._compute_pool.submit(
+                        then, result, window, ij, self.global_args)
+                except RuntimeError as exc:
+                    # the pipeline is shutting down
+                    done.set_exception(exc)
+                else:
+                    compute.add_done_callback(chain)
+
+        read = self._read_pool.submit(self._read, window, ij)
+        read.add_done_callback(lambda f: chain(f, self.compute_func))
+        return done
+
+    def run(self, windows):
+        """Iterate over ([window, ij] pairs) windows, yielding window,
+        result pairs in the same order"""
+        pending = deque()
+        self._read_pool = ThreadPoolExecutor(self.readers)
+        self._compute_pool = ThreadPoolExecutor(
+            self.workers if self.compute_func else 1)
+        try:
+            for window, ij in windows:
+                pending.append((window, self._submit(window, ij)))
+                if len(pending) >= self.prefetch:
+                    window, result = pending.popleft()
+                    yield window, result.result()
+
+            while pending:
+                window, result = pending.popleft()
+                yield window, result.result()
+        finally:
+            for future in [f for w, f in pending]:
+                future.cancel()
+            self._read_pool.shutdown(wait=True)
+            self._compute_pool.shutdown(wait=True)
+            for src in self._handles:
+                src.close()
+            self._handles = []
+
+
+def run_pipeline(src_path, outpath_or_dataset, read_func, compute_func,
+                 windows, options, global_args, readers=2, workers=1,
+                 prefetch=8):
+    """Run a ReadAheadPipeline over windows, writing every result to a
+    new dataset created with options, or, as riomucho does, to a
+    dataset already opened for writing"""
+    pipeline = ReadAheadPipeline(
+        src_path, read_func, compute_func, global_args,
+        readers=readers, workers=workers, prefetch=prefetch)
+
+    if isinstance(outpath_or_dataset, rasterio.io.DatasetWriter):
+        destination = outpath_or_dataset
+    else:
+        destination = rasterio.open(outpath_or_dataset, 'w', **options)
+
+    with destination as dst:
+        for window, data in pipeline.run(windows):
+            dst.write(data, window=window)
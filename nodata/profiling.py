@@ -0,0 +1,162 @@
+"""Per-window stage timing.
+
+Workers time stages of their windows with a profiler taken from their
+global arguments. The default NullProfiler does nothing. A
+StageProfiler appends every timing as a JSON line to a file of its
+directory, one file per process and thread, so that timings of all
+workers can be summarized afterwards without any shared state. Each
+process and thread keeps its file open, line buffered so that nothing
+is lost when pool workers exit without flushing.
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import timeit
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_null_stage = _NullStage()
+
+
+class NullProfiler:
+    """Profiler that records nothing"""
+
+    def stage(self, name, window):
+        return _null_stage
+
+    def record(self, name, window, seconds):
+        pass
+
+
+null_profiler = NullProfiler()
+
+
+class _Stage:
+    def __init__(self, profiler, name, window):
+        self.profiler = profiler
+        self.name = name
+        self.window = window
+
+    def __enter__(self):
+        self.start = timeit.default_timer()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.record(
+            self.name, self.window, timeit.default_timer() - self.start)
+        return False
+
+
+class StageProfiler:
+    """Profiler that records stage timings under directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._files = {}
+
+    def __getstate__(self):
+        # open files stay with the process that opened them
+        return {'directory': self.directory}
+
+    def __setstate__(self, state):
+        self.__init__(state['directory'])
+
+    def stage(self, name, window):
+        """Context manager timing one stage of a window"""
+        return _Stage(self, name, window)
+
+    def _file(self):
+        key = (os.getpid(), threading.current_thread().ident)
+        f = self._files.get(key)
+        if f is None:
+            f = self._files[key] = open(
+                os.path.join(self.directory, '%d-%d.jsonl' % key), 'a',
+                buffering=1)
+        return f
+
+    def record(self, name, window, seconds):
+        self._file().write(json.dumps({
+            'stage': name,
+            'window': [int(window.row_off), int(window.col_off)],
+            'seconds': seconds}) + '\n')
+
+    def close(self):
+        """Close the files this process opened"""
+        pid = os.getpid()
+        for key in [key for key in self._files if key[0] == pid]:
+            self._files.pop(key).close()
+
+
+def timed_writes(dst, profiler):
+    """Time every write to an open dataset as a 'write' stage of its
+    window. Returns the dataset."""
+    write = dst.write
+
+    def timed_write(*args, **kwargs):
+        with profiler.stage('write', kwargs.get('window')):
+            return write(*args, **kwargs)
+
+    dst.write = timed_write
+    return dst
+
+
+def summarize(directory):
+    """Aggregate the timings recorded under directory: window count and,
+    per stage, the number of timings, total seconds, mean and max
+    milliseconds and share of all recorded time"""
+    stages = {}
+    windows = set()
+    for name in os.listdir(directory):
+        with open(os.path.join(directory, name)) as f:
+            for line in f:
+                rec = json.loads(line)
+                windows.add(tuple(rec['window']))
+                times = stages.setdefault(rec['stage'], [])
+                times.append(rec['seconds'])
+
+    total = sum(sum(times) for times in stages.values()) or 1.0
+    return {
+        'windows': len(windows),
+        'stages': dict(
+            (name, {
+                'count': len(times),
+                'total_s': round(sum(times), 6),
+                'mean_ms': round(1000 * sum(times) / len(times), 3),
+                'max_ms': round(1000 * max(times), 3),
+                'share': round(sum(times) / total, 4)})
+            for name, times in stages.items())}
+
+
+class profiling:
+    """Context manager giving a StageProfiler over a temporary directory,
+    or a NullProfiler if not enabled. The summary of what was recorded
+    is in its summary attribute on exit."""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.summary = None
+
+    def __enter__(self):
+        if not self.enabled:
+            return NullProfiler()
+        self.directory = tempfile.mkdtemp(prefix='nodata-profile-')
+        self.profiler = StageProfiler(self.directory)
+        return self.profiler
+
+    def __exit__(self, *args):
+        if self.enabled:
+            try:
+                self.profiler.close()
+                self.summary = summarize(self.directory)
+            finally:
+                shutil.rmtree(self.directory)
+        return False
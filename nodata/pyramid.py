@@ -0,0 +1,129 @@
+"""Coarse-to-fine fill.
+
+Level k of a window's pyramid is the window read decimated 2**k times,
+nodata aware, with a halo of the same number of (coarser) pixels, so
+that a fill with the same search distance reaches 2**k times further at
+level k. The coarse grids line up across windows as long as window
+offsets are multiples of 2**levels, which blob's planning makes sure of
+(see nodata.blob.plan_dataset).
+"""
+import numpy as np
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+
+from nodata.windows import pad_window
+
+
+def pyramid_pad(max_search_distance):
+    """The halo of every level: at least max_search_distance + 1, and
+    even so that each level's halo lines up with the next one's"""
+    pad = max_search_distance + 1
+    return pad + pad % 2
+
+
+def level_window(window, pad, level):
+    """The window to read for a pyramid level and its shape at that
+    level. The window is grown to a whole number of level pixels, then
+    by the halo of pad level pixels."""
+    scale = 2 ** level
+    (r0, r1), (c0, c1) = pad_window(window, 0)
+    rows = -(-(r1 - r0) // scale)
+    cols = -(-(c1 - c0) // scale)
+    read = Window(
+        c0 - pad * scale, r0 - pad * scale,
+        (cols + 2 * pad) * scale, (rows + 2 * pad) * scale)
+
+    return read, (rows + 2 * pad, cols + 2 * pad)
+
+
+def read_level(src, read, shape, scale):
+    """Read a level window decimated scale times as an (img, mask) pair.
+
+    Only the level pixels wholly inside the dataset are read, which
+    avoids slow boundless reads; the rest, including the last partial
+    level pixels of a dataset that isn't a whole number of them, is
+    nodata.
+    """
+    rows, cols = shape
+    (r0, r1), (c0, c1) = pad_window(read, 0)
+    i0, i1 = -(-max(0, -r0) // scale), min(rows, (src.height - r0) // scale)
+    j0, j1 = -(-max(0, -c0) // scale), min(cols, (src.width - c0) // scale)
+
+    img = np.full(
+        (src.count, rows, cols), src.nodata or 0, dtype=src.dtypes[0])
+    mask = np.zeros((rows, cols), dtype=np.uint8)
+    if i1 > i0 and j1 > j0:
+        inner = Window(
+            c0 + j0 * scale, r0 + i0 * scale,
+            (j1 - j0) * scale, (i1 - i0) * scale)
+        img[:, i0:i1, j0:j1] = src.read(
+            window=inner, out_shape=(src.count, i1 - i0, j1 - j0),
+            resampling=Resampling.average)
+        # a level pixel is valid if any of its pixels is
+        mask[i0:i1, j0:j1] = src.read_masks(
+            1, window=inner, out_shape=(i1 - i0, j1 - j0),
+            resampling=Resampling.average)
+        mask[mask > 0] = 255
+
+    return img, mask
+
+
+def read_levels(src, window, pad, levels):
+    """Read levels 1 to levels of a window's pyramid as (img, mask)
+    pairs, the image with its mask appended as a last band, as blob's
+    padded reads are"""
+    out = []
+    for level in range(1, levels + 1):
+        read, shape = level_window(window, pad, level)
+        img, mask = read_level(src, read, shape, 2 ** level)
+        out.append((np.concatenate([img, mask[np.newaxis].astype(img.dtype)]), mask))
+
+    return out
+
+
+def fill_reach(fill, img, mask, fillBands, maxSearchDistance):
+    """Fill img with a fill engine, also returning which pixels are
+    valid or were filled: an extra band of ones where valid comes back
+    non zero wherever the fill reached"""
+    valid = np.count_nonzero(mask)
+    if valid == 0 or valid == mask.size:
+        return img.copy(), mask != 0
+
+    reach = (mask != 0).astype(img.dtype)[np.newaxis]
+    filled = fill(
+        np.concatenate([img, reach]), mask,
+        list(fillBands) + [img.shape[0] + 1], maxSearchDistance)
+
+    return filled[:-1], filled[-1] != 0
+
+
+def fill_pyramid(fill, img, mask, levels, fillBands, maxSearchDistance, pad):
+    """Fill a padded window from its coarser levels up.
+
+    Every level is filled with maxSearchDistance; pixels that a level
+    leaves unfilled take the value of the coarser level's pixel over
+    them, if that one is valid or filled.
+    """
+    coarse = None
+    for levelImg, levelMask in reversed([(img, mask)] + levels):
+        filled, reached = fill_reach(
+            fill, levelImg, levelMask, fillBands, maxSearchDistance)
+
+        if coarse is not None:
+            # this level starts pad pixels into the coarser one, at the
+            # coarser one's resolution twice this level's
+            coarseImg, coarseReached = coarse
+            rows, cols = reached.shape
+            up = coarseImg.repeat(2, axis=-2).repeat(2, axis=-1)[
+                :, pad:pad + rows, pad:pad + cols]
+            upReached = coarseReached.repeat(2, axis=-2).repeat(2, axis=-1)[
+                pad:pad + rows, pad:pad + cols]
+
+            take = upReached & ~reached
+            for b in fillBands:
+                filled[b - 1][take] = up[b - 1][take]
+            reached |= upReached
+
+        coarse = filled, reached
+
+    return coarse[0]
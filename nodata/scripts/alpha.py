@@ -1,6 +1,8 @@
 from itertools import repeat
 from multiprocessing import cpu_count, Pool
 import sys
+import threading
+import weakref
 import zlib
 try:
     from itertools import izip
@@ -10,6 +12,23 @@ except ImportError:
 import numpy
 import rasterio
 
+from nodata.memory import alpha_window_bytes, cache_options, fit_budget
+from nodata.profiling import null_profiler, profiling
+from nodata.throttle import Throttle
+from nodata.windows import halo_window, merge_blocks
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    # Python < 3.8
+    shared_memory = None
+
+try:
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+except ImportError:
+    # Python 2 without the futures backport
+    ThreadPoolExecutor = None
+
 
 # We're compelled to use global variables for the source dataset and masking
 # algorithm function. The worker initialization and finalization functions
@@ -18,19 +37,96 @@ import rasterio
 
 src_dataset = None
 mask_function = None
+result_transport = 'zlib'
+stage_profiler = null_profiler
 
 
-def init_worker(path, func):
-    global mask_function, src_dataset
+def init_worker(path, func, transport='zlib', profiler=None):
+    global mask_function, src_dataset, result_transport, stage_profiler
     mask_function = func
     src_dataset = rasterio.open(path)
+    result_transport = transport
+    stage_profiler = profiler or null_profiler
 
 
 def finalize_worker():
-    global mask_function, src_dataset
+    global mask_function, src_dataset, result_transport, stage_profiler
     src_dataset.close()
     mask_function = None
     src_dataset = None
+    result_transport = 'zlib'
+    stage_profiler = null_profiler
+
+
+# Masks travel from workers to the pool manager in one of these forms:
+#
+# zlib: deflated bytes
+# raw: the array itself, pickled
+# rle: run values and lengths of the flattened array, which collapses
+#      the usual single-valued masks to a single run, or the raw array
+#      if the runs would take more room than it
+# shm: the name of a shared memory block holding the array, which the
+#      decoded mask is a view of
+
+transports = ('zlib', 'raw', 'rle', 'shm')
+
+
+def encode_mask(result, transport):
+    """Pack a mask array for the trip back to the pool manager"""
+    if transport == 'zlib':
+        return zlib.compress(result.tobytes())
+    elif transport == 'raw':
+        return result
+    elif transport == 'rle':
+        flat = result.ravel()
+        starts = numpy.concatenate(
+            ([0], numpy.flatnonzero(flat[1:] != flat[:-1]) + 1))
+        if starts.size * (flat.itemsize + starts.itemsize) >= flat.nbytes:
+            # noisy: the runs are no smaller than the mask
+            return result
+        lengths = numpy.diff(numpy.append(starts, flat.size))
+        return flat[starts], lengths
+    elif transport == 'shm':
+        shm = shared_memory.SharedMemory(
+            create=True, size=max(result.nbytes, 1))
+        numpy.ndarray(
+            result.shape, result.dtype, buffer=shm.buf)[...] = result
+        shm.close()
+        # the block stays registered with the resource tracker shared
+        # with the pool manager, which unlinks it when the mask is
+        # decoded, or at exit if it never is
+        return shm.name, result.dtype.str
+    else:
+        raise ValueError("Unknown transport: %s" % transport)
+
+
+def decode_mask(data, transport, shape, dtype):
+    """Unpack a mask array packed by encode_mask"""
+    if transport == 'zlib':
+        return numpy.frombuffer(zlib.decompress(data), dtype).reshape(shape)
+    elif transport == 'raw':
+        return data.reshape(shape)
+    elif transport == 'rle':
+        if isinstance(data, numpy.ndarray):
+            return data.reshape(shape)
+        values, lengths = data
+        return numpy.repeat(values, lengths).reshape(shape)
+    elif transport == 'shm':
+        name, dtype = data
+        shm = shared_memory.SharedMemory(name=name)
+        # the mapping outlives the name
+        shm.unlink()
+        count = int(numpy.prod(shape))
+        flat = numpy.frombuffer(
+            shm.buf[:count * numpy.dtype(dtype).itemsize], dtype, count)
+        # close the block once the last view of the mask is gone
+        view = flat
+        while not isinstance(view, memoryview):
+            view = view.base
+        weakref.finalize(view, shm.close)
+        return flat.reshape(shape)
+    else:
+        raise ValueError("Unknown transport: %s" % transport)
 
 
 # The following function is executed by worker processes.
@@ -39,28 +135,37 @@ def compute_window_mask(args):
     """Execute the given function with keyword arguments to compute a
     valid data mask.
 
-    Returns the window and mask as deflated bytes.
+    Returns the window and the mask, encoded for the worker's transport
+    (deflated bytes by default).
     """
     window, nodata, extra_args = args
-    global mask_function, src_dataset
+    global mask_function, src_dataset, result_transport, stage_profiler
 
-    padding = int(extra_args.get('padding', 0))
+    result = window_mask(
+        src_dataset, mask_function, window, nodata, extra_args,
+        stage_profiler)
+    with stage_profiler.stage('encode', window):
+        data = encode_mask(result, result_transport)
+    return window, data
 
-    if padding:
-        start, stop = zip(*window)
-        start = [v - 10 for v in start]
-        stop = [v + 10 for v in stop]
-        read_window = zip(*[start, stop])
-    else:
-        read_window = window
 
-    source = src_dataset.read(window=read_window, boundless=True)
-    result = mask_function(source, nodata, **extra_args)
+def window_mask(src, func, window, nodata, extra_args,
+                profiler=null_profiler):
+    """Read a window of src and compute its mask with func, timing the
+    'read' and 'mask' stages with profiler"""
+    # padding is ours, not the mask function's: the window is read with
+    # a halo of that many pixels (clipped to the dataset), which is
+    # cropped off the mask again
+    extra_args = dict(extra_args)
+    padding = int(extra_args.pop('padding', 0))
+    read_window, (rows, cols) = halo_window(window, padding, src.shape)
 
-    if padding:
-        result = result[:, padding:-padding, padding:-padding]
+    with profiler.stage('read', window):
+        source = src.read(window=read_window)
+    with profiler.stage('mask', window):
+        result = func(source, nodata, **extra_args)
 
-    return window, zlib.compress(result.tobytes())
+    return result[rows, cols]
 
 
 def all_valid(arr, nodata, **kwargs):
@@ -77,20 +182,71 @@ class NodataPoolMan:
     """
 
     def __init__(self, input_path, func, nodata, num_workers=None,
-            max_tasks=100):
-        """Create a pool of workers to process window masks"""
+            max_tasks=100, max_in_flight=None, transport='zlib',
+            engine='processes', profiler=None):
+        """Create a pool of workers to process window masks
+
+        When max_in_flight is set, no more than that many windows are
+        queued or computed ahead of the consumer of mask(), so memory
+        stays flat however many windows there are.
+
+        transport is one of 'zlib' (the default), 'raw', 'rle' or 'shm'
+        and decides how masks get back from the workers. 'shm' needs
+        Python 3.8+; its masks are views of the shared memory blocks
+        the workers wrote them into.
+
+        With engine 'threads' the workers are threads, each with its own
+        dataset handle, and masks are handed over as they are; windows
+        in flight default to twice the number of workers.
+
+        A profiler (see nodata.profiling) times the read, mask and encode
+        stages of every window in the workers and the decode stage in
+        mask().
+        """
+        if engine not in ('processes', 'threads'):
+            raise ValueError("Unknown engine: %s" % engine)
+        if transport not in transports:
+            raise ValueError("Unknown transport: %s" % transport)
+        if transport == 'shm' and shared_memory is None:
+            raise ValueError("Shared memory transport needs Python 3.8+")
+        if engine == 'threads' and ThreadPoolExecutor is None:
+            raise ValueError(
+                "Thread engine needs concurrent.futures, from the futures "
+                "package on Python 2")
+
         self.input_path = input_path
         self.func = func
         self.nodata = nodata
+        self.max_in_flight = max_in_flight
+        self.transport = transport
+        self.engine = engine
+        self.profiler = profiler or null_profiler
 
         # Peek in the source file for metadata. We could even get the
         # nodata value from here in some cases.
         with rasterio.open(input_path) as src:
             self.dtype = src.dtypes[0]
 
+        num_workers = num_workers or max(cpu_count() - 1, 1)
+
+        if engine == 'threads':
+            self.pool = ThreadPoolExecutor(num_workers)
+            self.num_workers = num_workers
+            self._pending = set()
+            self._local = threading.local()
+            self._handles = []
+            self._lock = threading.Lock()
+            return
+
+        self._throttle = None
+        if transport == 'shm':
+            # share one tracker with the workers, so that their blocks
+            # are unlinked at exit if the pool manager never decodes them
+            resource_tracker.ensure_running()
+
         self.pool = Pool(
-            num_workers or cpu_count()-1, init_worker, (input_path, func),
-            max_tasks)
+            num_workers, init_worker,
+            (input_path, func, transport, self.profiler), max_tasks)
 
     def mask(self, windows, **kwargs):
         """Iterate over windows and compute mask arrays.
@@ -100,12 +256,207 @@ class NodataPoolMan:
 
         Yields window, ndarray pairs.
         """
+        if self.engine == 'threads':
+            for out_window, out_data in self._thread_mask(windows, kwargs):
+                yield out_window, out_data
+            return
+
+        throttle = None
+        if self.max_in_flight:
+            throttle = self._throttle = Throttle(self.max_in_flight)
+            windows = throttle.feed(windows)
+
         iterargs = izip(windows, repeat(self.nodata), repeat(kwargs))
         for out_window, data in self.pool.imap_unordered(
                 compute_window_mask, iterargs):
 
-            out_data = numpy.fromstring(
-                        zlib.decompress(data), self.dtype).reshape(
-                            [int(x) for x in rasterio.windows.shape(out_window)])
+            with self.profiler.stage('decode', out_window):
+                out_data = decode_mask(
+                    data, self.transport,
+                    [int(x) for x in rasterio.windows.shape(out_window)],
+                    self.dtype)
 
             yield out_window, out_data
+
+            if throttle is not None:
+                throttle.release()
+
+    def _thread_compute(self, window, kwargs):
+        src = getattr(self._local, 'src', None)
+        if src is None:
+            src = self._local.src = rasterio.open(self.input_path)
+            with self._lock:
+                self._handles.append(src)
+        return window, window_mask(
+            src, self.func, window, self.nodata, kwargs, self.profiler)
+
+    def _thread_mask(self, windows, kwargs):
+        """mask() for the threads engine"""
+        # masks are handed over as they are, so bound them even without
+        # max_in_flight
+        max_in_flight = self.max_in_flight or 2 * self.num_workers
+        pending = self._pending
+        for window in windows:
+            pending.add(self.pool.submit(self._thread_compute, window, kwargs))
+            if len(pending) >= max_in_flight:
+                done = wait(pending, return_when=FIRST_COMPLETED).done
+                pending.difference_update(done)
+                for future in done:
+                    yield future.result()
+
+        while pending:
+            done = wait(pending, return_when=FIRST_COMPLETED).done
+            pending.difference_update(done)
+            for future in done:
+                yield future.result()
+
+    def close(self):
+        """Shut down the pool's workers"""
+        if self.engine == 'threads':
+            self.pool.shutdown(wait=True)
+            for src in self._handles:
+                src.close()
+        else:
+            self.pool.close()
+            self.pool.join()
+
+    def terminate(self):
+        """Shut down the pool's workers without waiting for the windows
+        not yet in flight"""
+        if self.engine == 'threads':
+            # shutdown(cancel_futures=True) needs Python 3.9+
+            for future in list(self._pending):
+                future.cancel()
+            self.pool.shutdown(wait=True)
+            for src in self._handles:
+                src.close()
+        elif self._throttle is not None:
+            # the task feeder may be parked on a slot: let it go, and
+            # wait for the windows in flight only (see Throttle)
+            self._throttle.stop()
+            self.pool.close()
+            self.pool.join()
+        else:
+            self.pool.terminate()
+
+
+def alpha_nodata(src_path, dst_path, func, nodata, creation_options,
+                 workers=None, mask_band=False, max_in_flight=None,
+                 transport='zlib', merge=1, engine='processes', profile=False,
+                 max_memory=None, **kwargs):
+    """Compute a valid data mask for every block of a raster in a pool
+    of workers, writing the source bands plus the mask as each result
+    arrives.
+
+    The mask is written as an extra alpha band, or as an internal mask
+    band if mask_band is True. In-flight windows default to twice the
+    number of workers. See NodataPoolMan for transport and engine. With
+    merge > 1, tiles of merge x merge blocks are processed instead of
+    single blocks.
+
+    With profile, returns a summary of the time spent in each stage of
+    the windows (see nodata.profiling.summarize).
+
+    With max_memory, a budget in bytes, merge, workers and max_in_flight
+    are lowered to fit it (see alpha_memory), and GDAL's block cache is
+    capped in every process.
+    """
+    env = {}
+    if max_memory:
+        merge, workers, max_in_flight = alpha_memory(
+            max_memory, src_path, func, merge,
+            workers or max(cpu_count() - 1, 1),
+            max_in_flight or 2 * (workers or cpu_count()), engine, kwargs)
+        env.update(cache_options())
+
+    with rasterio.open(src_path) as src:
+        windows = [
+            window for ij, window in merge_blocks(src.block_windows(), merge)]
+        options = src.profile.copy()
+
+    options.update(**creation_options)
+    count = options['count']
+    options.update(nodata=None)
+    if not mask_band:
+        options.update(count=count + 1)
+
+    run = profiling(profile)
+    with run as profiler, rasterio.Env(**env):
+        _alpha_run(
+            src_path, dst_path, func, nodata, windows, options, count,
+            workers, mask_band, max_in_flight, transport, engine, profiler,
+            kwargs)
+
+    return run.summary
+
+
+def alpha_memory(max_memory, src_path, func, merge, workers, max_in_flight,
+                 engine, kwargs):
+    """Fit an alpha_nodata run to a budget of max_memory bytes (see
+    nodata.memory): tiles of merge x merge blocks are shrunk down to
+    single blocks until they fit, with as many of the workers as
+    possible. Returns the merge, workers and max_in_flight to run
+    with."""
+    from nodata.alphamask import slic_mask
+
+    with rasterio.open(src_path) as src:
+        blocks = list(src.block_windows())
+        count, dtype = src.count, src.dtypes[0]
+    itemsize = numpy.dtype(dtype).itemsize
+
+    candidates = []
+    while True:
+        windows = [window for ij, window in merge_blocks(blocks, merge)]
+        shape = (max(w.height for w in windows), max(w.width for w in windows))
+        window = alpha_window_bytes(
+            shape, int(kwargs.get('padding', 0)), count, dtype,
+            'slic' if func is slic_mask else 'simple',
+            kwargs.get('decimation') or 1)
+        # decoded masks, and encoded ones on their way from processes
+        held = shape[0] * shape[1] * itemsize * (
+            1 if engine == 'threads' else 2)
+        candidates.append((merge, window, held, shape))
+        if merge == 1:
+            break
+        merge //= 2
+
+    # the source bands of the window being written
+    rows, cols = candidates[0][3]
+    merge, workers, max_in_flight, _ = fit_budget(
+        max_memory, [c[:3] for c in candidates], workers, max_in_flight,
+        processes=engine != 'threads', fixed=rows * cols * count * itemsize)
+    return merge, workers, max_in_flight
+
+
+def _alpha_run(src_path, dst_path, func, nodata, windows, options, count,
+               workers, mask_band, max_in_flight, transport, engine,
+               profiler, kwargs):
+    """Mask and write windows for alpha_nodata"""
+    manager = NodataPoolMan(
+        src_path, func, nodata, num_workers=workers,
+        max_in_flight=max_in_flight or 2 * (workers or cpu_count()),
+        transport=transport, engine=engine, profiler=profiler)
+
+    try:
+        with rasterio.open(src_path) as src:
+            with rasterio.Env(GDAL_TIFF_INTERNAL_MASK=True):
+                with rasterio.open(dst_path, 'w', **options) as dst:
+                    for window, mask in manager.mask(windows, **kwargs):
+                        with profiler.stage('read', window):
+                            data = src.read(window=window)
+                        with profiler.stage('write', window):
+                            dst.write(
+                                data, window=window,
+                                indexes=list(range(1, count + 1)))
+                            if mask_band:
+                                dst.write_mask(mask, window=window)
+                            else:
+                                dst.write(
+                                    mask.astype(options['dtype']), count + 1,
+                                    window=window)
+    except Exception:
+        # don't wait for the windows not yet queued
+        manager.terminate()
+        raise
+    else:
+        manager.close()
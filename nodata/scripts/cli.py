@@ -1,9 +1,65 @@
 from __future__ import print_function
+import glob
+import json
+import timeit
+
 import click
 
-from rasterio.rio.options import creation_options
+# Subcommands import rasterio, scipy and friends themselves, so that
+# `nodata --help` and the commands that don't need all of them start
+# quickly.
+
+
+def _cb_key_val(ctx, param, value):
+    """Collect --co KEY=VAL options into a dict, as rasterio's
+    creation_options option does"""
+    out = {}
+    for pair in value or ():
+        if '=' not in pair:
+            raise click.BadParameter(
+                "Invalid syntax for KEY=VAL arg: %s" % pair)
+        k, v = pair.split('=', 1)
+        k = k.lower()
+        v = v.lower()
+        out[k] = None if v in ['none', 'null', 'nil', 'nada'] else v
+    return out
+
+
+def _cb_factors(ctx, param, value):
+    """Parse --overviews factors"""
+    if not value:
+        return None
+    from nodata.overviews import parse_factors
+    try:
+        return parse_factors(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def _cb_size(ctx, param, value):
+    """Parse a size such as 512M into bytes"""
+    if not value:
+        return None
+    from nodata.memory import parse_size
+    try:
+        return parse_size(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
 
-from nodata.blob import blob_nodata
+max_memory = click.option(
+    '--max-memory', default=None, callback=_cb_size, metavar='SIZE',
+    help="Lower the tile size, jobs and windows in flight to fit this "
+         "much memory, such as 512M or 2G [default=no limit]")
+
+
+creation_options = click.option(
+    '--co', '--profile', 'creation_options',
+    metavar='NAME=VALUE',
+    multiple=True,
+    callback=_cb_key_val,
+    help="Driver specific creation options. See the documentation for "
+         "the selected output driver for more information.")
 
 
 @click.group()
@@ -32,14 +88,240 @@ def cli():
     help="Number of workers for multiprocessing [default=4]")
 @click.option('--alphafy', '-a', is_flag=True,
     help='If a RGB raster is found, blob + add alpha band where nodata is')
+@click.option('--fill-engine', default='gdal',
+    type=click.Choice(['gdal', 'batched']),
+    help="Fill each band with GDAL, or search once per window and fill "
+         "all bands together [default=gdal]")
+@click.option('--tile-size', default=None, type=int,
+    help="Process tiles of about this many pixels a side, made of whole "
+         "blocks, and report the read amplification [default=blocks]")
+@click.option('--engine', default='riomucho',
+    type=click.Choice(['riomucho', 'pipeline', 'threads']),
+    help="Run windows in riomucho worker processes, through a threaded "
+         "read-ahead pipeline, or in a thread pool [default=riomucho]")
+@click.option('--prefetch', default=8, type=int,
+    help="Windows read ahead by the pipeline engine [default=8]")
+@click.option('--checkpoint', default=None, type=int,
+    help="Record progress every N windows in DST_PATH.checkpoint "
+         "[default=off]")
+@click.option('--resume', is_flag=True,
+    help="Update DST_PATH in place, skipping windows its checkpoint "
+         "records as written")
+@click.option('--timings', is_flag=True,
+    help="Time every stage of every window and print a JSON summary")
+@click.option('--pyramid', default=0, type=int,
+    help="Also fill from this many coarser levels, each reaching twice "
+         "as far, for large gaps [default=0]")
+@click.option('--overviews', default=None, callback=_cb_factors,
+    metavar='F1,F2,...',
+    help="Write internal overviews at these factors, built from the "
+         "windows as they are written [default=none]")
+@click.option('--overview-resampling', default='average',
+    type=click.Choice(['average', 'nearest']),
+    help="Overview resampling [default=average]")
+@click.option('--cog', is_flag=True,
+    help="Write a cloud optimized GeoTIFF: tile-aligned windows and "
+         "overviews, copied into COG layout from a temporary file")
+@max_memory
 def blob(src_path, dst_path, bidx, max_search_distance, nibblemask,
-        creation_options, mask_threshold, jobs, alphafy):
+        creation_options, mask_threshold, jobs, alphafy, fill_engine,
+        tile_size, engine, prefetch, checkpoint, resume, timings, pyramid,
+        overviews, overview_resampling, cog, max_memory):
     """"""
     args = (src_path, dst_path, bidx, max_search_distance, nibblemask,
             creation_options, mask_threshold, jobs, alphafy)
-    blob_nodata(
+    import rasterio
+    from nodata.blob import blob_nodata
+    from nodata.pyramid import pyramid_pad
+    from nodata.windows import read_amplification, tile_windows
+
+    if tile_size and not cog:
+        with rasterio.open(src_path) as src:
+            pad = (
+                pyramid_pad(max_search_distance) if pyramid
+                else max_search_distance + 1)
+            blocks = tile_windows(src, align=2 ** pyramid)
+            tiles = tile_windows(src, tile_size, align=2 ** pyramid)
+            click.echo(
+                "%d tiles, read amplification %.2fx (%d blocks, %.2fx)" % (
+                    len(tiles),
+                    read_amplification(tiles, pad, src.shape, pyramid),
+                    len(blocks),
+                    read_amplification(blocks, pad, src.shape, pyramid)),
+                err=True)
+
+    summary = blob_nodata(
         src_path, dst_path, bidx, max_search_distance, nibblemask,
-        creation_options, mask_threshold, jobs, alphafy)
+        creation_options, mask_threshold, jobs, alphafy,
+        fillEngine=fill_engine, tileSize=tile_size, engine=engine,
+        prefetch=prefetch, checkpoint=checkpoint, resume=resume,
+        profile=timings, pyramid=pyramid, overviews=overviews,
+        overviewResampling=overview_resampling, cog=cog,
+        maxMemory=max_memory)
+
+    if timings:
+        click.echo(json.dumps(summary, indent=2, sort_keys=True))
+
+
+@click.command('blob-batch',
+    short_help="Blob many files with one pool of workers")
+@click.argument('sources', nargs=-1)
+@click.option('--file-list', type=click.File('r'), default=None,
+    help="File with one source path per line")
+@click.option('--output', '-o', 'dst_template', required=True,
+    help="Output path template, with {name} for the source file name "
+         "without extension and {dir} for its directory")
+@click.option('--bidx', '-b', default=None,
+    help="Bands to blob [default = all]")
+@click.option('--max-search-distance', '-m', default=4,
+    help="Maximum blobbing radius [default = 4]")
+@click.option('--nibblemask', '-n', default=False, is_flag=True,
+    help="Nibble blobbed nodata areas [default=False]")
+@creation_options
+@click.option('--mask-threshold', '-d', default=None, type=int,
+    help="Alpha pixel threshold upon which to regard data as masked "
+         "(ie, for lossy you'd want an aggressive threshold of 0) "
+         "[default=None]")
+@click.option('--jobs', '-j', default=4, type=int,
+    help="Number of workers for multiprocessing [default=4]")
+@click.option('--alphafy', '-a', is_flag=True,
+    help='If a RGB raster is found, blob + add alpha band where nodata is')
+@click.option('--fill-engine', default='gdal',
+    type=click.Choice(['gdal', 'batched']),
+    help="Fill each band with GDAL, or search once per window and fill "
+         "all bands together [default=gdal]")
+@click.option('--tile-size', default=None, type=int,
+    help="Process tiles of about this many pixels a side, made of whole "
+         "blocks [default=blocks]")
+def blob_batch_cmd(sources, file_list, dst_template, bidx,
+                   max_search_distance, nibblemask, creation_options,
+                   mask_threshold, jobs, alphafy, fill_engine, tile_size):
+    """Sources are paths or glob patterns. Prints the time taken by each
+    file as it is finished."""
+    from nodata.batch import BatchError, blob_batch, output_paths
+
+    src_paths = []
+    for source in sources:
+        src_paths.extend(sorted(glob.glob(source)) or [source])
+    if file_list is not None:
+        src_paths.extend(line.strip() for line in file_list if line.strip())
+
+    if not src_paths:
+        raise click.BadParameter(
+            "no sources given", param_hint='SOURCES / --file-list')
+    if '{name}' not in dst_template:
+        raise click.BadParameter(
+            "template must contain {name}", param_hint='--output')
+    try:
+        output_paths(dst_template, src_paths)
+    except ValueError as exc:
+        raise click.BadParameter(str(exc), param_hint='--output')
+
+    start = timeit.default_timer()
+    try:
+        for src_path, dst_path, seconds in blob_batch(
+                src_paths, dst_template, bidx, max_search_distance,
+                nibblemask, creation_options, mask_threshold, jobs, alphafy,
+                fillEngine=fill_engine, tileSize=tile_size):
+            click.echo("%s -> %s %.2fs" % (src_path, dst_path, seconds))
+    except BatchError as exc:
+        raise click.ClickException(str(exc))
+
+    click.echo("%d files %.2fs" % (
+        len(src_paths), timeit.default_timer() - start), err=True)
+
+
+@click.command(
+    short_help="Nibble away the edges of nodata areas, block by block")
+@click.argument('src_path', type=click.Path(exists=True))
+@click.argument('dst_path', type=click.Path(exists=False))
+@click.option('--max-search-distance', '-m', default=4,
+    help="Nibbling radius [default = 4]")
+@creation_options
+@click.option('--jobs', '-j', default=1, type=int,
+    help="Number of workers for multiprocessing [default=1]")
+def nibble(src_path, dst_path, max_search_distance, creation_options, jobs):
+    """"""
+    from nodata.blob import make_nibbled
+
+    make_nibbled(
+        src_path, dst_path, max_search_distance,
+        creation_options=creation_options, workers=jobs)
+
+
+@click.command(
+    short_help="Add an alpha band (or mask band) computed from nodata values")
+@click.argument('src_path', type=click.Path(exists=True))
+@click.argument('dst_path', type=click.Path(exists=False))
+@click.option('--method', default='simple',
+    type=click.Choice(['simple', 'slic']),
+    help="Masking algorithm: exact nodata match, or SLIC clustering for "
+         "lossy nodata [default=simple]")
+@click.option('--nodata', default=None, type=float,
+    help="Nodata value of every band [default=source nodata]")
+@click.option('--mask-band', is_flag=True,
+    help="Write an internal mask band instead of an alpha band")
+@creation_options
+@click.option('--jobs', '-j', default=4, type=int,
+    help="Number of workers for multiprocessing [default=4]")
+@click.option('--max-in-flight', default=None, type=int,
+    help="Maximum number of windows queued or being computed "
+         "[default=2 x jobs]")
+@click.option('--transport', default='zlib',
+    type=click.Choice(['zlib', 'raw', 'rle', 'shm']),
+    help="How masks are passed back from workers [default=zlib]")
+@click.option('--engine', default='processes',
+    type=click.Choice(['processes', 'threads']),
+    help="Compute masks in worker processes or threads "
+         "[default=processes]")
+@click.option('--padding', default=0, type=int,
+    help="Pixels of overlap read around every window [default=0]")
+@click.option('--merge-blocks', default=1, type=int,
+    help="Process tiles of N x N blocks instead of single blocks "
+         "[default=1]")
+@click.option('--slic-decimation', default=1, type=int,
+    help="Cluster on a window this many times smaller on each side "
+         "(slic method only) [default=1]")
+@click.option('--slic-tolerance', default=None, type=int,
+    help="Width in pixels of the edge band reclassified at full "
+         "resolution after decimated clustering [default=decimation]")
+@click.option('--timings', is_flag=True,
+    help="Time every stage of every window and print a JSON summary")
+@max_memory
+def alpha(src_path, dst_path, method, nodata, mask_band, creation_options,
+          jobs, max_in_flight, transport, engine, padding, merge_blocks,
+          slic_decimation, slic_tolerance, timings, max_memory):
+    """"""
+    import rasterio
+    from nodata.alphamask import simple_mask, slic_mask
+    from nodata.scripts.alpha import alpha_nodata
+
+    with rasterio.open(src_path) as src:
+        if nodata is None:
+            nodata = src.nodata
+        count = src.count
+
+    if nodata is None:
+        raise click.BadParameter(
+            "source has no nodata value, pass one with --nodata",
+            param_hint='--nodata')
+
+    func = {'simple': simple_mask, 'slic': slic_mask}[method]
+    kwargs = {'padding': padding}
+    if method == 'slic':
+        kwargs.update(decimation=slic_decimation, tolerance=slic_tolerance)
+
+    summary = alpha_nodata(
+        src_path, dst_path, func, (nodata,) * count, creation_options,
+        workers=jobs, mask_band=mask_band, max_in_flight=max_in_flight,
+        transport=transport, merge=merge_blocks, engine=engine,
+        profile=timings, max_memory=max_memory, **kwargs)
+
+    if timings:
+        click.echo(json.dumps(summary, indent=2, sort_keys=True))
 
 
+cli.add_command(alpha)
 cli.add_command(blob)
+cli.add_command(blob_batch_cmd)
+cli.add_command(nibble)
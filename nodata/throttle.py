@@ -0,0 +1,50 @@
+"""Bounded task feeds for worker pools.
+
+A pool's task feeder takes tasks from a generator as fast as it can.
+Feeding it through a Throttle holds tasks back until the results of
+earlier ones are taken, so that no more than a given number are queued,
+computed or waiting at any time.
+"""
+from threading import BoundedSemaphore
+
+
+class Throttle:
+    """At most slots tasks in flight.
+
+    Every task fed takes a slot, and every result taken should give
+    one back with release(). A run abandoned before its results are
+    all taken must stop() the throttle, letting the feeder go if it is
+    parked on a slot, before closing and joining the pool, which then
+    only waits for the tasks already in flight. Terminating it instead
+    can hang if a worker is still sending a result.
+    """
+
+    def __init__(self, slots):
+        self.slots = BoundedSemaphore(slots)
+        self.stopped = False
+
+    def feed(self, tasks):
+        """Yield tasks, each once a slot is free"""
+        tasks = iter(tasks)
+        while True:
+            self.slots.acquire()
+            if self.stopped:
+                return
+            try:
+                task = next(tasks)
+            except StopIteration:
+                return
+            yield task
+
+    def release(self):
+        """Give back the slot of a result taken"""
+        self.slots.release()
+
+    def stop(self):
+        """Stop feeding tasks, letting a parked feeder go"""
+        self.stopped = True
+        try:
+            self.slots.release()
+        except ValueError:
+            # every slot is free, so nothing is parked
+            pass
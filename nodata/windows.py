@@ -0,0 +1,138 @@
+from rasterio.windows import Window
+
+
+def pad_window(wnd, pad):
+    """Grow a window by pad pixels on every side, as
+    ((row_start, row_stop), (col_start, col_stop))"""
+    try:
+        wnd = wnd.toranges()
+    except AttributeError:
+        # rasterio < 1.0, already a tuple
+        pass
+
+    return (
+        (wnd[0][0] - pad, wnd[0][1] + pad),
+        (wnd[1][0] - pad, wnd[1][1] + pad)
+    )
+
+
+def halo_window(window, pad, shape=None):
+    """Plan a read of window with a halo of pad pixels around it.
+
+    Without a shape the halo extends past the raster edges and has to be
+    read boundless. With the raster's (height, width) shape it is clipped
+    to the raster instead.
+
+    Returns the window to read and a (rows, cols) pair of slices that
+    crop the read back to the original window.
+    """
+    (r0, r1), (c0, c1) = pad_window(window, 0)
+    (pr0, pr1), (pc0, pc1) = pad_window(window, pad)
+
+    if shape is not None:
+        height, width = shape
+        pr0, pr1 = max(pr0, 0), min(pr1, height)
+        pc0, pc1 = max(pc0, 0), min(pc1, width)
+
+    read = Window.from_slices((pr0, pr1), (pc0, pc1), boundless=True)
+    crop = (slice(r0 - pr0, r1 - pr0), slice(c0 - pc0, c1 - pc0))
+
+    return read, crop
+
+
+def merge_blocks(block_windows, rows, cols=None):
+    """Merge blocks into tiles of rows x cols adjacent blocks.
+
+    block_windows is a sequence of ((i, j), window) pairs as yielded by
+    a dataset's block_windows(). Returns the tiles the same way, indexed
+    by tile row and column; tiles along the right and bottom edges may
+    hold fewer blocks.
+    """
+    cols = cols or rows
+    tiles = {}
+    for (i, j), window in block_windows:
+        ij = (i // rows, j // cols)
+        (r0, r1), (c0, c1) = pad_window(window, 0)
+        if ij in tiles:
+            (tr0, tr1), (tc0, tc1) = tiles[ij]
+            r0, r1 = min(r0, tr0), max(r1, tr1)
+            c0, c1 = min(c0, tc0), max(c1, tc1)
+        tiles[ij] = ((r0, r1), (c0, c1))
+
+    return [
+        (ij, Window.from_slices(*tiles[ij])) for ij in sorted(tiles)]
+
+
+def tile_windows(src, tile_size=None, align=1):
+    """Plan processing tiles for a dataset.
+
+    Without a tile_size these are the dataset's blocks. Otherwise blocks
+    are merged into tiles of about tile_size x tile_size pixels, aligned
+    to block boundaries, so that the halo read around each one is a
+    smaller share of it. With align, tiles take as many more blocks as
+    it takes for their offsets to be multiples of align pixels. Returns
+    ((i, j), window) pairs.
+    """
+    blocks = list(src.block_windows())
+    block_rows, block_cols = src.block_shapes[0]
+    rows = _aligned(max(1, (tile_size or 0) // block_rows), block_rows, align)
+    cols = _aligned(max(1, (tile_size or 0) // block_cols), block_cols, align)
+    if rows == cols == 1:
+        return blocks
+
+    return merge_blocks(blocks, rows, cols)
+
+
+def _aligned(count, block, align):
+    """The smallest number of blocks from count up that spans a multiple
+    of align pixels"""
+    while (count * block) % align:
+        count += 1
+    return count
+
+
+def grid_windows(shape, block, tile_size=None):
+    """Plan processing windows on a grid of block x block tiles over a
+    raster of shape (height, width), such as the tiles of an output
+    rather than the blocks of a source.
+
+    With a tile_size, windows are runs of about tile_size // block tiles
+    along a row of tiles, so that writing the windows in order writes
+    the tiles in order. Returns ((i, j), window) pairs in row-major
+    order.
+    """
+    height, width = shape
+    blocks = [
+        ((i, j), Window(
+            j * block, i * block,
+            min(block, width - j * block), min(block, height - i * block)))
+        for i in range(-(-height // block))
+        for j in range(-(-width // block))]
+    if not tile_size:
+        return blocks
+
+    return merge_blocks(blocks, 1, max(1, tile_size // block))
+
+
+def read_amplification(windows, pad, shape, levels=0):
+    """Ratio of pixels read for windows with a halo of pad pixels,
+    clipped to a raster of shape (height, width), to the pixels of the
+    windows themselves. With levels, the reads of that many coarser
+    pyramid levels around each window count too (see nodata.pyramid)."""
+    from nodata.pyramid import level_window
+
+    height, width = shape
+    read = 0
+    total = 0
+    for ij, window in windows:
+        read_window, crop = halo_window(window, pad, shape)
+        read += read_window.height * read_window.width
+        total += window.height * window.width
+        for level in range(1, levels + 1):
+            (r0, r1), (c0, c1) = pad_window(
+                level_window(window, pad, level)[0], 0)
+            read += (
+                max(0, min(r1, height) - max(r0, 0)) *
+                max(0, min(c1, width) - max(c0, 0)))
+
+    return read / float(total)
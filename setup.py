@@ -22,6 +22,7 @@ setup(name='nodata',
       zip_safe=False,
       install_requires=[
           'click',
+          'futures; python_version < "3"',
           'raster-tester',
           'rasterio>=1.0a12',
           'rio-mucho',
@@ -0,0 +1,143 @@
+import json
+import os
+
+from click.testing import CliRunner
+import numpy as np
+import rasterio as rio
+
+from nodata.alphamask import simple_mask
+from nodata.scripts.cli import cli
+
+
+def test_alpha_simple(tmpdir):
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/blob/rgb_toblob.tif')
+    outfile = str(tmpdir.join('alpha.tif'))
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        'alpha', infile, outfile, '-j', 2, '--max-in-flight', 2])
+    assert result.exit_code == 0
+
+    with rio.open(infile) as src:
+        data = src.read()
+
+    with rio.open(outfile) as out:
+        assert out.count == 4
+        assert out.nodata is None
+        assert np.array_equal(out.read(indexes=[1, 2, 3]), data)
+        assert np.array_equal(out.read(4), simple_mask(data, (0, 0, 0)))
+
+
+def test_alpha_max_memory(tmpdir):
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/blob/rgb_toblob.tif')
+    outfile = str(tmpdir.join('alpha.tif'))
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        'alpha', infile, outfile, '-j', 2, '--merge-blocks', 4,
+        '--max-memory', '100M'])
+    assert result.exit_code == 0
+
+    with rio.open(infile) as src:
+        data = src.read()
+
+    with rio.open(outfile) as out:
+        assert np.array_equal(out.read(indexes=[1, 2, 3]), data)
+        assert np.array_equal(out.read(4), simple_mask(data, (0, 0, 0)))
+
+
+def test_alpha_mask_band(tmpdir):
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/blob/rgb_toblob.tif')
+    outfile = str(tmpdir.join('masked.tif'))
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        'alpha', infile, outfile, '-j', 1, '--mask-band'])
+    assert result.exit_code == 0
+
+    with rio.open(infile) as src:
+        data = src.read()
+
+    with rio.open(outfile) as out:
+        assert out.count == 3
+        assert np.array_equal(out.read_masks(1), simple_mask(data, (0, 0, 0)))
+
+
+def test_alpha_no_nodata(tmpdir):
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/blob/seams_4band.tif')
+    outfile = str(tmpdir.join('alpha.tif'))
+
+    runner = CliRunner()
+    result = runner.invoke(cli, ['alpha', infile, outfile])
+    assert result.exit_code == 2
+    assert '--nodata' in result.output
+
+
+def test_alpha_slic_decimation(tmpdir):
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/alpha/lossy-curved-edges.tif')
+    outfile = str(tmpdir.join('alpha.tif'))
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        'alpha', infile, outfile, '--method', 'slic', '--nodata', 255,
+        '--slic-decimation', 2, '-j', 1])
+    assert result.exit_code == 0
+
+    with rio.open(outfile) as out:
+        assert out.count == 4
+        alpha = out.read(4)
+        assert np.any(alpha == 0) and np.any(alpha == 255)
+
+
+def test_alpha_padding_merge_blocks(tmpdir):
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/blob/rgb_toblob.tif')
+    outfile = str(tmpdir.join('alpha.tif'))
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        'alpha', infile, outfile, '-j', 1, '--padding', 5,
+        '--merge-blocks', 2])
+    assert result.exit_code == 0
+
+    with rio.open(infile) as src:
+        data = src.read()
+
+    with rio.open(outfile) as out:
+        assert np.array_equal(out.read(4), simple_mask(data, (0, 0, 0)))
+
+
+def test_alpha_threads(tmpdir):
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/blob/rgb_toblob.tif')
+    outfile = str(tmpdir.join('alpha.tif'))
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        'alpha', infile, outfile, '-j', 2, '--engine', 'threads'])
+    assert result.exit_code == 0
+
+    with rio.open(infile) as src:
+        data = src.read()
+
+    with rio.open(outfile) as out:
+        assert np.array_equal(out.read(4), simple_mask(data, (0, 0, 0)))
+
+
+def test_alpha_timings(tmpdir):
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/blob/rgb_toblob.tif')
+    outfile = str(tmpdir.join('alpha.tif'))
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        'alpha', infile, outfile, '-j', 2, '--timings'])
+    assert result.exit_code == 0
+
+    summary = json.loads(result.stdout)
+    assert sorted(summary['stages']) == [
+        'decode', 'encode', 'mask', 'read', 'write']
+    with rio.open(infile) as src:
+        windows = len(list(src.block_windows()))
+    assert summary['windows'] == windows
+    for name, stage in summary['stages'].items():
+        # every window is read by its worker for the mask, and again
+        # by the writer for the bands
+        assert stage['count'] == (2 * windows if name == 'read' else windows)
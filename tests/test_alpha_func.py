@@ -70,6 +70,71 @@ def test_alphamask_good_alphaonly():
     assert len(createColIdx) == 1
     assert rColIdx == createColIdx[0]
 
+def test_simple_mask_out():
+    """simple_mask writes into a given buffer"""
+    arr = np.random.randint(1, 255, size=(3, 20, 30)).astype(np.uint8)
+    arr[:, :5] = 0
+    arr[1, 10:15] = 0
+
+    out = np.empty((20, 30), dtype=np.uint8)
+    mask = alphamask.simple_mask(arr, (0, 0, 0), out=out)
+
+    assert mask is out
+    assert np.all(mask[:5] == 0)
+    assert np.all(mask[5:] == 255)
+
+
+def test_simple_mask_memory():
+    """simple_mask allocates about as much as a window, not a copy of it"""
+    import tracemalloc
+    arr = np.random.randint(200, size=(3, 512, 512)).astype(np.uint8)
+
+    tracemalloc.start()
+    alphamask.simple_mask(arr, (0, 0, 0))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    assert peak < 1.5 * arr.nbytes
+
+
+@pytest.mark.parametrize('dtype, ndv', [
+    ('uint8', (0, 0, 0)),
+    ('uint8', (255, 0, 255)),
+    ('int16', (-32768, 32767)),
+    ('uint16', (0, 0, 0)),
+    ('uint8', (0.5, 0, 0)),
+    ('float32', (0, 0, 0))])
+def test_diff_nodata(dtype, ndv):
+    """Band differences match a float64 sum, in an integer accumulator
+    where they are exact"""
+    info = np.iinfo(dtype) if dtype != 'float32' else np.iinfo(np.int16)
+    arr = np.random.randint(
+        info.min, info.max, size=(len(ndv), 10, 10)).astype(dtype)
+
+    expected = np.sum([np.abs(im.astype(float) - n) for im, n in zip(arr, ndv)], axis=0)
+    diff = alphamask._diff_nodata(arr, ndv)
+
+    assert np.array_equal(diff, expected)
+    if dtype != 'float32' and ndv[0] != 0.5:
+        assert diff.dtype.kind == 'i'
+
+
+def test_label_means_paint():
+    """Painted label means match regionprops"""
+    from skimage.measure import label, regionprops
+    near_nodata = np.random.randint(0, 20, size=(40, 40)).astype(float)
+    labeled = label(np.arange(1600).reshape(40, 40) // 37 % 5) + 1
+
+    means = alphamask._label_means(labeled, near_nodata)
+    painted = alphamask._paint_labels(labeled, means)
+
+    assert painted.dtype == np.int16
+    for region in regionprops(labeled, intensity_image=near_nodata):
+        assert means[region.label] == region.mean_intensity
+        assert np.all(
+            painted[labeled == region.label] == np.int16(region.mean_intensity))
+
+
 def test_all_valid():
     all_valid = alphamask.all_valid
     ndv = (255, 255, 255)
@@ -111,6 +176,29 @@ def test_slic_mask_not_any():
     assert np.all(mask == 255)
 
 
+def test_decimate_upsample():
+    image = np.arange(35, dtype=float).reshape(5, 7)
+    small = alphamask._decimate(image, 2)
+    assert small.shape == (3, 4)
+    assert small[0, 0] == image[:2, :2].mean()
+    assert small[-1, -1] == image[-1, -1]
+    assert alphamask._upsample(small, 2, image.shape).shape == image.shape
+
+
+@pytest.mark.parametrize('decimation', [2, 4])
+def test_slic_mask_decimation(decimation):
+    """Decimated SLIC stays close to the full resolution mask"""
+    arr = image_reader('tests/fixtures/alpha/lossy-curved-edges.tif')
+    ndv = (255, 255, 255)
+
+    full = alphamask.slic_mask(arr, ndv)
+    mask = alphamask.slic_mask(arr, ndv, decimation=decimation)
+
+    assert mask.shape == full.shape
+    assert np.any(full == 0)
+    assert np.mean(mask != full) < 0.01
+
+
 @pytest.mark.xfail()
 def test_slic_mask_any():
     """SLIC does identify nodata on the edge of a noisy background."""
@@ -1,10 +1,13 @@
+import json
 import os, shutil
 
 from click.testing import CliRunner
+import pytest
 import rasterio as rio
 
 import make_testing_data
 import raster_tester
+from nodata.blob import nibble_filled_mask
 from nodata.scripts.cli import cli
 
 
@@ -201,3 +204,533 @@ def test_blob_fail_no_nodata():
     assert result.exit_code == -1
 
     tester.cleanup()
+
+def test_nibble():
+    tmpdir = '/tmp/blob_filling'
+    tester = TestingSetup(tmpdir)
+
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/blob/rgb_toblob.tif')
+    nibbled_file = os.path.join(tmpdir, 'nibbled.tif')
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        'nibble', infile, nibbled_file, '-m', 10, '-j', 2])
+    assert result.exit_code == 0
+
+    with rio.open(infile) as src:
+        expected = nibble_filled_mask(src.read(), src.nodata, 10)
+
+    with rio.open(nibbled_file) as nibbled:
+        assert nibbled.profile['compress'] == 'lzw'
+        assert (nibbled.read() == expected).all()
+
+    tester.cleanup()
+
+
+def test_blob_tile_size():
+    tmpdir = '/tmp/blob_filling'
+    tester = TestingSetup(tmpdir)
+
+    blobfile = os.path.join(os.getcwd(), 'tests/fixtures/blob/seams_4band.tif')
+    block_file = os.path.join(tmpdir, 'blocks.tif')
+    tile_file = os.path.join(tmpdir, 'tiles.tif')
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        'blob', blobfile, block_file, '-m', 10, '-j', 1])
+    assert result.exit_code == 0
+
+    result = runner.invoke(cli, [
+        'blob', blobfile, tile_file, '-m', 10, '-j', 1, '--tile-size', 512])
+    assert result.exit_code == 0
+    assert 'read amplification' in result.output
+
+    with rio.open(block_file) as blocks, rio.open(tile_file) as tiles:
+        assert (blocks.read() == tiles.read()).all()
+
+    tester.cleanup()
+
+
+@pytest.mark.parametrize('engine', ['pipeline', 'threads'])
+def test_blob_engine(engine):
+    tmpdir = '/tmp/blob_filling'
+    tester = TestingSetup(tmpdir)
+
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/blob/rgb_toblob.tif')
+    mucho_file = os.path.join(tmpdir, 'riomucho.tif')
+    pipeline_file = os.path.join(tmpdir, 'pipeline.tif')
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        'blob', infile, mucho_file, '-m', 10, '-n', '--alphafy', '-j', 1])
+    assert result.exit_code == 0
+
+    result = runner.invoke(cli, [
+        'blob', infile, pipeline_file, '-m', 10, '-n', '--alphafy', '-j', 2,
+        '--engine', engine, '--prefetch', 3])
+    assert result.exit_code == 0
+
+    with rio.open(mucho_file) as mucho, rio.open(pipeline_file) as pipeline:
+        assert (mucho.read() == pipeline.read()).all()
+
+    tester.cleanup()
+
+
+def test_blob_resume(monkeypatch):
+    import nodata.blob as blob
+
+    tmpdir = '/tmp/blob_filling'
+    tester = TestingSetup(tmpdir)
+
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/blob/rgb_toblob.tif')
+    expected_file = os.path.join(tmpdir, 'expected.tif')
+    resumed_file = os.path.join(tmpdir, 'resumed.tif')
+    checkpoint = resumed_file + '.checkpoint'
+    args = ['-m', 10, '-n', '--alphafy', '-j', 1]
+
+    runner = CliRunner()
+    result = runner.invoke(cli, ['blob', infile, expected_file] + args)
+    assert result.exit_code == 0
+
+    run_windows = blob.run_windows
+    calls = []
+
+    def interrupted(*args, **kwargs):
+        calls.append(len(args[2]))
+        if len(calls) == 3:
+            raise KeyboardInterrupt()
+        return run_windows(*args, **kwargs)
+
+    monkeypatch.setattr(blob, 'run_windows', interrupted)
+    result = runner.invoke(cli, [
+        'blob', infile, resumed_file, '--checkpoint', 4] + args)
+    assert result.exit_code != 0
+    assert os.path.exists(checkpoint)
+    assert len(blob.read_checkpoint(checkpoint)[1]) == 8
+
+    monkeypatch.setattr(blob, 'run_windows', run_windows)
+    result = runner.invoke(cli, [
+        'blob', infile, resumed_file, '--checkpoint', 4, '--resume'] + args)
+    assert result.exit_code == 0
+    assert not os.path.exists(checkpoint)
+
+    with rio.open(expected_file) as expected, rio.open(resumed_file) as resumed:
+        assert (expected.read() == resumed.read()).all()
+
+    tester.cleanup()
+
+
+def test_blob_resume_other_params(monkeypatch):
+    import multiprocessing
+    import nodata.blob as blob
+
+    tmpdir = '/tmp/blob_filling'
+    tester = TestingSetup(tmpdir)
+
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/blob/rgb_toblob.tif')
+    expected_file = os.path.join(tmpdir, 'expected.tif')
+    outfile = os.path.join(tmpdir, 'checkpointed.tif')
+    args = ['-m', 10, '--alphafy']
+
+    runner = CliRunner()
+    result = runner.invoke(cli, ['blob', infile, expected_file, '-j', 1] + args)
+    assert result.exit_code == 0
+
+    # one pool of processes for all runs
+    Pool = multiprocessing.Pool
+    pools = []
+
+    def counted(*args, **kwargs):
+        pools.append(args)
+        return Pool(*args, **kwargs)
+
+    monkeypatch.setattr(multiprocessing, 'Pool', counted)
+    result = runner.invoke(cli, [
+        'blob', infile, outfile, '--checkpoint', 4, '-j', 2] + args)
+    assert result.exit_code == 0
+    assert len(pools) == 1
+    monkeypatch.setattr(multiprocessing, 'Pool', Pool)
+    with rio.open(expected_file) as expected, rio.open(outfile) as out:
+        assert (expected.read() == out.read()).all()
+
+    windows, options, globalArgs = blob.plan_blob(
+        infile, None, 10, False, {}, None, True)
+    with open(blob.checkpoint_path(outfile), 'w') as f:
+        f.write(json.dumps(blob.checkpoint_header(
+            infile, windows, options, globalArgs, None)) + '\n')
+        f.write(json.dumps([[0, 0]]) + '\n')
+
+    for other in (['-m', 5, '--alphafy'], ['-m', 10, '--alphafy', '-n'],
+                  ['-m', 10, '--alphafy', '--pyramid', 1]):
+        result = runner.invoke(cli, [
+            'blob', infile, outfile, '--resume', '-j', 1] + other)
+        assert result.exit_code == 1
+        assert isinstance(result.exception, ValueError)
+
+    result = runner.invoke(cli, [
+        'blob', infile, outfile, '--resume', '-j', 1] + args)
+    assert result.exit_code == 0
+
+    tester.cleanup()
+
+
+def test_blob_batch():
+    tmpdir = '/tmp/blob_filling'
+    tester = TestingSetup(tmpdir)
+
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/blob/rgb_toblob.tif')
+    expected_file = os.path.join(tmpdir, 'expected.tif')
+    for name in ('a', 'b', 'c'):
+        shutil.copy(infile, os.path.join(tmpdir, 'scene-%s.tif' % name))
+    file_list = os.path.join(tmpdir, 'list.txt')
+    with open(file_list, 'w') as f:
+        f.write(os.path.join(tmpdir, 'scene-c.tif') + '\n')
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        'blob', infile, expected_file, '-m', 10, '--alphafy', '-j', 1])
+    assert result.exit_code == 0
+
+    for jobs in (1, 2):
+        result = runner.invoke(cli, [
+            'blob-batch', os.path.join(tmpdir, 'scene-[ab].tif'),
+            '--file-list', file_list,
+            '-o', os.path.join(tmpdir, '{name}-blob-%d.tif' % jobs),
+            '-m', 10, '--alphafy', '-j', jobs])
+        assert result.exit_code == 0
+        assert result.output.count(' -> ') == 3
+
+        with rio.open(expected_file) as expected:
+            for name in ('a', 'b', 'c'):
+                outfile = os.path.join(
+                    tmpdir, 'scene-%s-blob-%d.tif' % (name, jobs))
+                with rio.open(outfile) as out:
+                    assert out.profile == expected.profile
+                    assert (out.read() == expected.read()).all()
+
+    tester.cleanup()
+
+
+def test_blob_batch_bad_template():
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        'blob-batch', 'tests/fixtures/blob/rgb_toblob.tif', '-o', 'out.tif'])
+    assert result.exit_code == 2
+    assert '{name}' in result.output
+
+
+@pytest.mark.parametrize('sources, template', [
+    # the same name in two directories
+    (['tests/fixtures/blob/rgb_toblob.tif',
+      'tests/fixtures/alpha/rgb_toblob.tif'], '/tmp/{name}.tif'),
+    # a source given twice
+    (['tests/fixtures/blob/rgb_toblob.tif'] * 2, '/tmp/{name}-blob.tif'),
+    # an output over its source
+    (['tests/fixtures/blob/rgb_toblob.tif'], '{dir}/{name}.tif')])
+def test_blob_batch_colliding_outputs(sources, template):
+    runner = CliRunner()
+    result = runner.invoke(cli, ['blob-batch'] + sources + ['-o', template])
+    assert result.exit_code == 2
+    assert 'would' in result.output
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_blob_batch_bad_file(jobs):
+    tmpdir = '/tmp/blob_filling'
+    tester = TestingSetup(tmpdir)
+
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/blob/rgb_toblob.tif')
+    badfile = os.path.join(tmpdir, 'scene-b.tif')
+    with open(badfile, 'w') as f:
+        f.write('not a raster')
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        'blob-batch', infile, badfile,
+        '-o', os.path.join(tmpdir, '{name}-blob.tif'), '-a', '-j', jobs])
+    assert result.exit_code == 1
+    assert 'Error: %s: ' % badfile in result.output
+
+    # outputs are opened by the parent
+    result = runner.invoke(cli, [
+        'blob-batch', infile,
+        '-o', os.path.join(tmpdir, 'missing', '{name}.tif'), '-a',
+        '-j', jobs])
+    assert result.exit_code == 1
+    assert 'Error: %s: ' % infile in result.output
+
+    tester.cleanup()
+
+
+@pytest.mark.parametrize('engine', ['riomucho', 'pipeline'])
+def test_blob_timings(engine):
+    tmpdir = '/tmp/blob_filling'
+    tester = TestingSetup(tmpdir)
+
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/blob/rgb_toblob.tif')
+    plain_file = os.path.join(tmpdir, 'plain.tif')
+    profile_file = os.path.join(tmpdir, 'profile.tif')
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        'blob', infile, plain_file, '-m', 10, '-n', '--alphafy', '-j', 1])
+    assert result.exit_code == 0
+
+    result = runner.invoke(cli, [
+        'blob', infile, profile_file, '-m', 10, '-n', '--alphafy', '-j', 1,
+        '--engine', engine, '--timings'])
+    assert result.exit_code == 0
+
+    summary = json.loads(result.stdout)
+    with rio.open(infile) as src:
+        assert summary['windows'] == len(list(src.block_windows()))
+    stages = summary['stages']
+    assert stages['write']['count'] == summary['windows']
+    assert set(stages) <= set(
+        ['prepass', 'read', 'mask', 'fill', 'crop', 'nibble', 'write'])
+    assert 'fill' in stages
+
+    with rio.open(plain_file) as plain, rio.open(profile_file) as profiled:
+        assert (plain.read() == profiled.read()).all()
+
+    tester.cleanup()
+
+
+def test_blob_profile_creation_options():
+    """--profile is still the --co alias it has always been"""
+    tmpdir = '/tmp/blob_filling'
+    tester = TestingSetup(tmpdir)
+
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/blob/rgb_toblob.tif')
+    outfile = os.path.join(tmpdir, 'deflated.tif')
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        'blob', infile, outfile, '--alphafy', '-j', 1,
+        '--profile', 'compress=deflate'])
+    assert result.exit_code == 0
+    with rio.open(outfile) as out:
+        assert out.compression.name == 'deflate'
+
+    tester.cleanup()
+
+
+def test_blob_pyramid():
+    tmpdir = '/tmp/blob_filling'
+    tester = TestingSetup(tmpdir)
+
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/blob/rgb_toblob.tif')
+    plain_file = os.path.join(tmpdir, 'plain.tif')
+    pyramid_file = os.path.join(tmpdir, 'pyramid.tif')
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        'blob', infile, plain_file, '-m', 2, '--alphafy', '-j', 1])
+    assert result.exit_code == 0
+
+    result = runner.invoke(cli, [
+        'blob', infile, pyramid_file, '-m', 2, '--alphafy', '-j', 1,
+        '--pyramid', 4])
+    assert result.exit_code == 0
+
+    with rio.open(plain_file) as plain, rio.open(pyramid_file) as pyramid:
+        assert (pyramid.read(4) == 0).sum() < (plain.read(4) == 0).sum()
+
+    tester.cleanup()
+
+
+def test_blob_pyramid_alignment():
+    """Windows are merged until the coarsest level's grid lines up
+    across them, and output tiles that can't be are refused"""
+    import nodata.blob as blob
+    tmpdir = '/tmp/blob_filling'
+    tester = TestingSetup(tmpdir)
+
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/blob/rgb_toblob.tif')
+    windows, options, globalArgs = blob.plan_blob(
+        infile, None, 2, False, {}, None, True, pyramid=9)
+    assert all(
+        w.row_off % 512 == 0 and w.col_off % 512 == 0 for w, ij in windows)
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        'blob', infile, os.path.join(tmpdir, 'cog.tif'), '-m', 2,
+        '--alphafy', '-j', 1, '--cog', '--pyramid', 10])
+    assert result.exit_code == 1
+    assert isinstance(result.exception, ValueError)
+
+    tester.cleanup()
+
+
+def test_blob_pyramid_no_nodata():
+    tmpdir = '/tmp/blob_filling'
+    tester = TestingSetup(tmpdir)
+
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/blob/seams_4band.tif')
+    outfile = os.path.join(tmpdir, 'pyramid.tif')
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        'blob', infile, outfile, '-m', 2, '-j', 1, '--pyramid', 2])
+    assert result.exit_code == 1
+    assert isinstance(result.exception, ValueError)
+
+    tester.cleanup()
+
+
+@pytest.mark.parametrize('extra', [[], ['--checkpoint', 2]])
+def test_blob_overviews(extra):
+    tmpdir = '/tmp/blob_filling'
+    tester = TestingSetup(tmpdir)
+
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/blob/rgb_toblob.tif')
+    outfile = os.path.join(tmpdir, 'overviews.tif')
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        'blob', infile, outfile, '-m', 10, '--alphafy', '-j', 1,
+        '--overviews', '2,4', '--overview-resampling', 'nearest'] + extra)
+    assert result.exit_code == 0
+
+    with rio.open(outfile) as out:
+        assert out.overviews(1) == [2, 4]
+        full = out.read()
+        for factor in (2, 4):
+            shape = (
+                out.count, -(-out.height // factor), -(-out.width // factor))
+            assert (out.read(out_shape=shape) ==
+                    full[:, ::factor, ::factor]).all()
+
+    tester.cleanup()
+
+
+def test_blob_overviews_too_large(monkeypatch):
+    """Overviews of outputs whose finest level doesn't fit in memory are
+    built from the output"""
+    import nodata.blob as blob
+    import nodata.overviews as overviews
+    tmpdir = '/tmp/blob_filling'
+    tester = TestingSetup(tmpdir)
+
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/blob/rgb_toblob.tif')
+    outfile = os.path.join(tmpdir, 'overviews.tif')
+
+    def never(*args, **kwargs):
+        raise AssertionError("finest level kept in memory")
+
+    monkeypatch.setattr(overviews, 'MAX_LEVEL_BYTES', 1000)
+    monkeypatch.setattr(blob, 'OverviewAccumulator', never)
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        'blob', infile, outfile, '-m', 10, '--alphafy', '-j', 1,
+        '--overviews', '2,4'])
+    assert result.exit_code == 0
+
+    with rio.open(outfile) as out:
+        assert out.overviews(1) == [2, 4]
+
+    tester.cleanup()
+
+
+@pytest.mark.parametrize('extra', [
+    ['-j', 2], ['--engine', 'pipeline', '-j', 1],
+    ['--engine', 'threads', '-j', 2, '--tile-size', 1024]])
+def test_blob_cog(extra):
+    tmpdir = '/tmp/blob_filling'
+    tester = TestingSetup(tmpdir)
+
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/blob/rgb_toblob.tif')
+    blobfile = os.path.join(tmpdir, 'blobbed.tif')
+    outfile = os.path.join(tmpdir, 'cog.tif')
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        'blob', infile, blobfile, '-m', 10, '--alphafy', '-j', 1])
+    assert result.exit_code == 0
+    result = runner.invoke(cli, [
+        'blob', infile, outfile, '-m', 10, '--alphafy', '--cog'] + extra)
+    assert result.exit_code == 0
+
+    with rio.open(blobfile) as blobbed, rio.open(outfile) as out:
+        assert out.block_shapes[0] == (512, 512)
+        assert out.overviews(1) == [2, 4]
+        assert (out.read() == blobbed.read()).all()
+
+        # headers come first, then the overviews' tiles from the
+        # smallest, then the full resolution tiles in row-major order
+        levels = [None, 0, 1]
+        ifds = [
+            int(out.get_tag_item('IFD_OFFSET', 'TIFF', bidx=1, ovr=ovr))
+            for ovr in levels]
+        firsts = [
+            int(out.get_tag_item('BLOCK_OFFSET_0_0', 'TIFF', bidx=1, ovr=ovr))
+            for ovr in levels]
+        assert ifds == sorted(ifds)
+        assert firsts == sorted(firsts, reverse=True)
+        assert ifds[-1] < firsts[-1]
+        offsets = [
+            int(out.get_tag_item(
+                'BLOCK_OFFSET_%d_%d' % (j, i), 'TIFF', bidx=1))
+            for i in range(3) for j in range(3)]
+        assert offsets == sorted(offsets)
+
+    with open(outfile, 'rb') as f:
+        assert b'LAYOUT=IFDS_BEFORE_DATA' in f.read(1024)
+    assert sorted(os.listdir(tmpdir)) == ['blobbed.tif', 'cog.tif']
+
+    tester.cleanup()
+
+
+def test_blob_cog_checkpoint():
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/blob/rgb_toblob.tif')
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        'blob', infile, '/tmp/never.tif', '--cog', '--checkpoint', 2])
+    assert result.exit_code == 1
+    assert isinstance(result.exception, ValueError)
+
+
+@pytest.mark.parametrize('engine', ['riomucho', 'pipeline'])
+def test_blob_max_memory(engine):
+    tmpdir = '/tmp/blob_filling'
+    tester = TestingSetup(tmpdir)
+
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/blob/rgb_toblob.tif')
+    blobfile = os.path.join(tmpdir, 'blobbed.tif')
+    outfile = os.path.join(tmpdir, 'budget.tif')
+
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        'blob', infile, blobfile, '-m', 10, '--alphafy', '-j', 1])
+    assert result.exit_code == 0
+    result = runner.invoke(cli, [
+        'blob', infile, outfile, '-m', 10, '--alphafy', '-j', 2,
+        '--engine', engine, '--tile-size', 1024, '--max-memory', '100M'])
+    assert result.exit_code == 0
+
+    with rio.open(blobfile) as blobbed, rio.open(outfile) as out:
+        assert (out.read() == blobbed.read()).all()
+
+    tester.cleanup()
+
+
+def test_blob_max_memory_too_small():
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/blob/rgb_toblob.tif')
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        'blob', infile, '/tmp/never.tif', '--max-memory', '1M'])
+    assert result.exit_code == 1
+    assert isinstance(result.exception, ValueError)
+
+    result = runner.invoke(cli, [
+        'blob', infile, '/tmp/never.tif', '--max-memory', 'lots'])
+    assert result.exit_code == 2
+
+
+def test_blob_bad_overviews():
+    infile = os.path.join(os.getcwd(), 'tests/fixtures/blob/rgb_toblob.tif')
+    runner = CliRunner()
+    result = runner.invoke(cli, [
+        'blob', infile, '/tmp/never.tif', '--overviews', '2,3'])
+    assert result.exit_code == 2
+    assert 'multiples' in result.output
@@ -1,6 +1,8 @@
 import numpy as np
 import nodata.blob as blob
 import pytest
+import rasterio as rio
+from rasterio.windows import Window
 
 def test_window_padding():
     window = (
@@ -78,3 +80,148 @@ def test_run_nodatafiller_one(has_one_nodata):
 
 def test_run_nodatafiller_all(has_all_nodata):
     assert blob.runNodataFiller(has_all_nodata, 2) is False
+
+def test_window_state():
+    globalArgs = {'selectNodata': None, 'maskThreshold': None}
+    with rio.open('tests/fixtures/blob/seams_4band.tif') as src:
+        alpha = src.read(4)
+        for ij, window in src.block_windows():
+            state = blob.window_state(src, window, globalArgs)
+            interior = alpha[window.toslices()]
+            if state == 'valid':
+                assert np.all(interior)
+            elif state == 'nodata':
+                assert not np.any(interior)
+            else:
+                assert blob.runNodataFiller(np.pad(interior, 1), 1)
+
+def test_read_uniform_nodata():
+    globalArgs = {'selectNodata': 0, 'maskThreshold': None}
+    with rio.open('tests/fixtures/blob/rgb_toblob.tif') as src:
+        img = blob.read_uniform(src, Window(0, 0, 16, 8), 'nodata', globalArgs)
+    assert img.shape == (4, 8, 16)
+    assert not np.any(img)
+
+@pytest.mark.parametrize('distance', [1, 4, 50])
+def test_nibble_matches_square_kernel(distance):
+    from scipy.ndimage import maximum_filter, minimum_filter
+    img = np.zeros((4, 128, 96), dtype=np.uint8) + 200
+    img[:3, 40:44, :] = 0
+    img[:3, 100, 10] = 0
+    img[-1] = np.random.randint(0, 256, (128, 96))
+
+    expected = img.copy()
+    nmsk = maximum_filter(np.all(img[:3] == 0, axis=0), size=distance * 2 + 1)
+    expected[:, nmsk] = 0
+    assert np.array_equal(blob.nibble_filled_mask(img, 0, distance), expected)
+
+    assert np.array_equal(
+        blob.nibble_filled_mask(img[-1], None, distance, True),
+        minimum_filter(img[-1], size=distance * 2 + 1))
+
+def test_nibble_no_nodata():
+    img = np.zeros((3, 16, 16), dtype=np.uint8) + 1
+    nibbled = blob.nibble_filled_mask(img, 0, 4)
+    assert np.array_equal(nibbled, img)
+    assert nibbled is not img
+
+
+@pytest.mark.parametrize('pad', [0, 11])
+def test_mask_from_pixels(pad):
+    """Masks derived from padded pixel reads match GDAL's nodata masks"""
+    with rio.open('tests/fixtures/blob/rgb_toblob.tif') as src:
+        for ij, window in src.block_windows():
+            padWindow, crop = blob.halo_window(window, pad)
+            img = src.read(boundless=True, window=padWindow)
+            expected = src.read_masks(boundless=True, window=padWindow)[0]
+            mask = blob.mask_from_pixels(img, src.nodata)
+            assert mask.dtype == expected.dtype
+            assert np.array_equal(mask, expected)
+
+
+@pytest.fixture
+def largeHole():
+    img = np.random.randint(1, 255, (4, 800, 800)).astype(np.uint8)
+    img[-1] = 255
+    img[:, 50:750, 80:760] = 0
+    img[:, 500:, :40] = 0
+    return img
+
+
+def test_fill_regions_skip_interior(largeHole):
+    mask = largeHole[-1]
+    regions = blob.fill_regions(mask, 10)
+    assert regions is not None
+
+    covered = np.zeros(mask.shape, dtype=bool)
+    for box, read in regions:
+        covered[box] = True
+    # every nodata pixel in reach of valid data is in a box...
+    assert covered[50:60, 80:760].all()
+    assert covered[500:510, :40].all()
+    # ...but the middle of the hole is not
+    assert not covered[250:550, 250:550].any()
+
+
+def test_fill_regions_whole_window():
+    mask = np.full((300, 300), 255, dtype=np.uint8)
+    mask[::7, ::5] = 0
+    assert blob.fill_regions(mask, 4) is None
+
+
+@pytest.mark.parametrize('distance', [3, 10, 20])
+def test_fill_edges_same_as_fill(largeHole, distance):
+    mask = largeHole[-1].copy()
+    assert blob.fill_regions(mask, distance) is not None
+    expected = blob.fill_nodata(largeHole.copy(), mask, (1, 2, 3, 4), distance)
+    filled = blob.fill_edges(
+        blob.fill_nodata, largeHole.copy(), mask, (1, 2, 3, 4), distance)
+    assert np.array_equal(filled, expected)
+
+
+def test_blob_array(areaToFill):
+    img = areaToFill[:3].copy()
+    mask = areaToFill[-1].copy()
+    stacked = blob.handle_RGB(img, mask)
+
+    filled = blob.blob_array(stacked, mask, 10)
+    assert np.array_equal(stacked[:3], img)
+    assert np.array_equal(
+        filled, blob.fill_nodata(stacked.copy(), mask, (1, 2, 3, 4), 10))
+
+    cropped = blob.blob_array(stacked, mask, 10, pad=11)
+    assert np.array_equal(cropped, filled[:, 11:-11, 11:-11])
+
+    # nothing to fill
+    assert np.array_equal(blob.blob_array(img, np.full_like(mask, 255)), img)
+
+
+def test_blob_windows():
+    path = 'tests/fixtures/blob/rgb_toblob.tif'
+    windows, options, globalArgs = blob.plan_blob(
+        path, None, 10, False, {}, None, True)
+
+    with rio.open(path) as src:
+        pairs = list(blob.blob_windows(src, 10, alphafy=True))
+        assert [w for w, arr in pairs] == [w for w, ij in windows]
+        for window, arr in pairs:
+            assert np.array_equal(
+                arr, blob.blob_worker([src], window, None, globalArgs))
+
+        window = Window(100, 200, 300, 150)
+        (w, arr), = blob.blob_windows(
+            src, 10, alphafy=True, bidx=[1, 2], windows=[window])
+        assert w == window
+        assert arr.shape == (4, 150, 300)
+
+
+def test_run_ordered_write_error(tmpdir):
+    """A failed write ends the run instead of leaving it parked"""
+    path = 'tests/fixtures/blob/rgb_toblob.tif'
+    windows, options, globalArgs = blob.plan_blob(
+        path, None, 10, False, {}, None, True)
+
+    # a dataset opened for reading has no write method
+    with pytest.raises(AttributeError):
+        blob.run_ordered(
+            path, rio.open(path), windows, globalArgs, 2, 2)
@@ -0,0 +1,40 @@
+"""Startup cost of the CLI and library modules, measured with
+python -X importtime in a fresh interpreter"""
+import subprocess
+import sys
+
+import pytest
+
+
+def import_times(module):
+    """Cumulative import time in microseconds of every module imported
+    by importing module"""
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+        stderr=subprocess.PIPE, check=True, universal_newlines=True).stderr
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize('module, heavy', [
+    ('nodata.scripts.cli', ['rasterio', 'numpy', 'scipy', 'skimage', 'riomucho']),
+    ('nodata.alphamask', ['rasterio', 'scipy', 'skimage']),
+    ('nodata.blob', ['scipy', 'skimage', 'riomucho']),
+    ('nodata.scripts.alpha', ['scipy', 'skimage', 'riomucho'])])
+def test_lazy_imports(module, heavy):
+    times = import_times(module)
+    assert module in times
+    assert not [name for name in heavy if name in times]
+
+
+def test_cli_import_time():
+    """The CLI imports only click, so it loads in a small fraction of
+    the time rasterio alone takes"""
+    cli = import_times('nodata.scripts.cli')['nodata.scripts.cli']
+    rasterio = import_times('rasterio')['rasterio']
+    assert cli < rasterio
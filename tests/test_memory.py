@@ -0,0 +1,80 @@
+import ctypes
+
+import pytest
+import rasterio
+
+from nodata.memory import (
+    CACHE_MB, alpha_window_bytes, blob_window_bytes, cache_options,
+    fit_budget, format_size, parse_size)
+
+
+def loaded_gdal():
+    """The GDAL library rasterio loaded, found in the process's memory
+    map (Linux only)"""
+    try:
+        with open('/proc/self/maps') as f:
+            paths = [line.split()[-1] for line in f if 'libgdal' in line]
+    except IOError:
+        paths = []
+    if not paths:
+        pytest.skip("Can't find the GDAL library rasterio loaded")
+    gdal = ctypes.CDLL(paths[0])
+    gdal.GDALGetCacheMax64.restype = ctypes.c_int64
+    return gdal
+
+
+def test_cache_options():
+    gdal = loaded_gdal()
+    with rasterio.Env(**cache_options()):
+        assert gdal.GDALGetCacheMax64() == CACHE_MB * 2 ** 20
+
+
+def test_parse_size():
+    assert parse_size('1000') == 1000
+    assert parse_size('512M') == 512 * 2 ** 20
+    assert parse_size('1.5g') == 3 * 2 ** 29
+    assert parse_size('2GiB') == 2 ** 31
+    with pytest.raises(ValueError):
+        parse_size('lots')
+
+
+def test_format_size():
+    assert format_size(512 * 2 ** 20) == '512M'
+    assert format_size(3 * 2 ** 29) == '1.5G'
+    assert format_size(100) == '100'
+
+
+def test_blob_window_bytes():
+    small = blob_window_bytes((256, 256), 5, 4, 'uint8')
+    assert blob_window_bytes((512, 512), 5, 4, 'uint8') > 3 * small
+    assert blob_window_bytes((256, 256), 5, 4, 'uint16') > small
+    assert blob_window_bytes((256, 256), 5, 4, 'uint8', 'batched') > small
+    assert blob_window_bytes((256, 256), 6, 4, 'uint8', pyramid=2) > small
+
+
+def test_alpha_window_bytes():
+    simple = alpha_window_bytes((256, 256), 0, 3, 'uint8')
+    slic = alpha_window_bytes((256, 256), 0, 3, 'uint8', 'slic')
+    decimated = alpha_window_bytes((256, 256), 0, 3, 'uint8', 'slic', 4)
+    assert simple < decimated < slic
+
+
+def test_fit_budget():
+    mb = 2 ** 20
+    candidates = [(1024, 40 * mb, 8 * mb), (None, 10 * mb, 2 * mb)]
+
+    # everything fits
+    assert fit_budget(2 ** 30, candidates, 4, 8)[:3] == (1024, 4, 8)
+    # workers are kept before tiles
+    key, workers, in_flight, estimate = fit_budget(
+        400 * mb, candidates, 4, 8)
+    assert (key, workers) == (None, 4)
+    assert in_flight >= workers
+    assert estimate <= 400 * mb
+    # then workers
+    assert fit_budget(300 * mb, candidates, 4, 8)[:2] == (None, 3)
+    # threads share the process and its cache
+    assert fit_budget(300 * mb, candidates, 4, 8, processes=False)[:2] == (
+        1024, 4)
+    with pytest.raises(ValueError):
+        fit_budget(50 * mb, candidates, 4, 8)
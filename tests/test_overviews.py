@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from rasterio.enums import Resampling
+from rasterio.io import MemoryFile
+from rasterio.windows import Window
+
+from nodata.overviews import (
+    OverviewAccumulator, cog_factors, decimate, keep_level, parse_factors)
+
+
+def test_parse_factors():
+    assert parse_factors('8,2,4') == [2, 4, 8]
+    with pytest.raises(ValueError):
+        parse_factors('1,2')
+    with pytest.raises(ValueError):
+        parse_factors('2,3')
+
+
+def test_cog_factors():
+    assert cog_factors((1064, 1064), 512) == [2, 4]
+    assert cog_factors((300, 2048), 512) == [2, 4]
+    assert cog_factors((512, 512), 512) == []
+
+
+def test_decimate_average():
+    arr = np.arange(25, dtype=np.uint8).reshape(1, 5, 5)
+    expected = np.array([[3, 5, 7], [13, 15, 17], [21, 23, 24]])
+    assert np.array_equal(decimate(arr, 2)[0], expected)
+
+
+def test_decimate_nearest():
+    arr = np.arange(25, dtype=np.uint8).reshape(1, 5, 5)
+    assert np.array_equal(decimate(arr, 2, 'nearest'), arr[:, ::2, ::2])
+
+
+def test_decimate_alpha():
+    arr = np.zeros((2, 2, 2), dtype=np.uint8)
+    arr[0] = [[100, 0], [0, 0]]
+    arr[1] = [[255, 0], [0, 0]]
+    # transparent pixels don't count towards color
+    assert decimate(arr, 2, alpha=True)[:, 0, 0].tolist() == [100, 64]
+
+
+def test_accumulator_levels():
+    data = np.random.randint(0, 255, (3, 100, 130)).astype(np.uint8)
+    accumulator = OverviewAccumulator((100, 130), 3, 'uint8', [2, 4, 8])
+    for row in range(0, 100, 32):
+        for col in range(0, 130, 32):
+            window = Window(col, row, min(32, 130 - col), min(32, 100 - row))
+            accumulator.add(
+                window, data[:, row:row + window.height, col:col + window.width])
+
+    levels = list(accumulator.levels())
+    assert [f for f, level in levels] == [2, 4, 8]
+    assert [level.shape for f, level in levels] == [
+        (3, 50, 65), (3, 25, 33), (3, 13, 17)]
+    assert np.array_equal(levels[0][1], decimate(data, 2))
+
+    with pytest.raises(ValueError):
+        accumulator.add(Window(1, 0, 4, 4), data[:, :4, :4])
+
+
+def test_decimate_nodata():
+    arr = np.array([[[0, 10, 0, 0], [20, 0, 0, 0]]], dtype=np.uint8)
+    # nodata pixels don't count, and cells of nodata stay nodata
+    assert decimate(arr, 2, nodata=0).tolist() == [[[15, 0]]]
+
+    arr = np.array([[[np.nan, 1.0], [3.0, 5.0]]])
+    assert decimate(arr, 2, nodata=np.nan).tolist() == [[[3.0]]]
+
+
+def test_decimate_nodata_matches_gdal():
+    data = np.random.randint(1, 255, (1, 64, 64)).astype(np.uint8)
+    data[:, np.random.rand(64, 64) < 0.5] = 7
+    data[:, :8, :8] = 7
+    profile = dict(
+        driver='GTiff', width=64, height=64, count=1, dtype='uint8',
+        nodata=7, tiled=True, blockxsize=32, blockysize=32)
+    with MemoryFile() as memfile:
+        with memfile.open(**profile) as dst:
+            dst.write(data)
+            dst.build_overviews([2], Resampling.average)
+        with memfile.open() as src:
+            gdal = src.read(out_shape=(1, 32, 32), masked=False)
+    assert np.array_equal(decimate(data, 2, nodata=7), gdal)
+
+
+def test_keep_level():
+    # a quarter of 3 x 2000 x 2000 bytes
+    assert keep_level((2000, 2000), 3, 'uint8', 2)
+    assert keep_level((2000, 2000), 3, 'uint8', 2, maxMemory=6000000)
+    assert not keep_level((2000, 2000), 3, 'uint8', 2, maxMemory=5000000)
+    assert not keep_level((40000, 40000), 4, 'uint8', 2)
@@ -0,0 +1,54 @@
+import pytest
+import rasterio
+from rasterio.windows import Window
+
+from nodata.pipeline import ReadAheadPipeline
+
+
+def read_band(srcs, window, ij, globalArgs):
+    return srcs[0].read(1, window=window)
+
+
+def compute_sum(data, window, ij, globalArgs):
+    if ij == globalArgs.get('fail'):
+        raise ValueError("failed %s" % (ij,))
+    return int(data.sum())
+
+
+def windows():
+    return [[Window(0, i * 16, 16, 16), (i, 0)] for i in range(10)]
+
+
+@pytest.mark.parametrize("prefetch", [1, 3, 20])
+def test_pipeline_order(prefetch):
+    """Results come back in window order, whatever the read-ahead"""
+    path = 'tests/fixtures/blob/rgb_toblob.tif'
+    pipeline = ReadAheadPipeline(
+        path, read_band, compute_sum, {}, readers=2, workers=3,
+        prefetch=prefetch)
+
+    results = list(pipeline.run(windows()))
+
+    with rasterio.open(path) as src:
+        expected = [
+            (w, int(src.read(1, window=w).sum())) for w, ij in windows()]
+    assert results == expected
+    assert pipeline._handles == []
+
+
+def test_pipeline_error():
+    pipeline = ReadAheadPipeline(
+        'tests/fixtures/blob/rgb_toblob.tif', read_band, compute_sum,
+        {'fail': (4, 0)}, prefetch=2)
+
+    with pytest.raises(ValueError):
+        list(pipeline.run(windows()))
+
+
+def test_pipeline_without_futures(monkeypatch):
+    """Python 2 without the futures backport gets an error, not an
+    ImportError on import"""
+    monkeypatch.setattr('nodata.pipeline.ThreadPoolExecutor', None)
+    with pytest.raises(ValueError):
+        ReadAheadPipeline(
+            'tests/fixtures/blob/rgb_toblob.tif', read_band, compute_sum, {})
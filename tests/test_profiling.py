@@ -0,0 +1,48 @@
+import pickle
+
+from rasterio.windows import Window
+
+from nodata.profiling import NullProfiler, profiling
+
+
+def test_null_profiler():
+    with profiling(False) as profiler:
+        assert isinstance(profiler, NullProfiler)
+        with profiler.stage('read', Window(0, 0, 1, 1)):
+            pass
+
+
+def test_profiling_summary():
+    run = profiling()
+    with run as profiler:
+        # profilers travel to worker processes with their arguments
+        profiler = pickle.loads(pickle.dumps(profiler))
+        for col in range(3):
+            window = Window(col * 10, 0, 10, 10)
+            with profiler.stage('read', window):
+                pass
+            with profiler.stage('fill', window):
+                pass
+        profiler.record('fill', Window(0, 0, 10, 10), 1.0)
+
+    summary = run.summary
+    assert summary['windows'] == 3
+    assert summary['stages']['read']['count'] == 3
+    assert summary['stages']['fill']['count'] == 4
+    assert summary['stages']['fill']['max_ms'] >= 1000
+    assert summary['stages']['fill']['share'] > summary['stages']['read']['share']
+    assert abs(sum(s['share'] for s in summary['stages'].values()) - 1) < 1e-3
+
+
+def test_profiler_keeps_file_open():
+    run = profiling()
+    with run as profiler:
+        for col in range(3):
+            profiler.record('read', Window(col * 10, 0, 10, 10), 0.1)
+        assert len(profiler._files) == 1
+        # a copy in another process opens its own
+        assert pickle.loads(pickle.dumps(profiler))._files == {}
+        f, = profiler._files.values()
+
+    assert f.closed
+    assert run.summary['stages']['read']['count'] == 3
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+import rasterio
+from rasterio.windows import Window
+
+from nodata.blob import fill_nodata
+from nodata.pyramid import (
+    fill_pyramid, level_window, pyramid_pad, read_levels)
+
+
+def test_pyramid_pad():
+    assert pyramid_pad(4) == 6
+    assert pyramid_pad(5) == 6
+
+
+def test_level_window():
+    read, shape = level_window(Window(256, 512, 256, 100), 6, 2)
+    assert read == Window(256 - 24, 512 - 24, 256 + 48, 100 + 48)
+    assert shape == (25 + 12, 64 + 12)
+
+
+@pytest.fixture
+def holey(tmpdir):
+    path = str(tmpdir.join('holey.tif'))
+    data = np.random.randint(1, 255, (3, 512, 512)).astype(np.uint8)
+    data[:, 100:400, 150:450] = 0
+    with rasterio.open(
+            path, 'w', driver='GTiff', count=3, dtype='uint8', nodata=0,
+            width=512, height=512, tiled=True, blockxsize=128,
+            blockysize=128) as dst:
+        dst.write(data)
+    return path
+
+
+def test_read_levels(holey):
+    window = Window(256, 256, 128, 128)
+    with rasterio.open(holey) as src:
+        levels = read_levels(src, window, 6, 3)
+        corner = read_levels(src, Window(0, 0, 128, 128), 6, 3)
+
+    for level, (img, mask) in enumerate(levels, 1):
+        read, shape = level_window(window, 6, level)
+        assert img.shape == (4,) + shape
+        assert np.array_equal(img[-1], mask)
+        # the hole is nodata at every level...
+        assert not mask[shape[0] // 2, shape[1] // 2]
+    assert mask.any()
+
+    for img, mask in corner:
+        # ...as is everything outside the dataset
+        assert not mask[:6, :6].any()
+        assert mask[6:12, 6:12].all()
+
+
+def test_fill_pyramid(holey):
+    window = Window(256, 256, 128, 128)
+    pad = pyramid_pad(4)
+    with rasterio.open(holey) as src:
+        img = src.read(window=Window(256 - pad, 256 - pad, 128 + 2 * pad,
+                                     128 + 2 * pad), boundless=True)
+        mask = src.read_masks(1, window=Window(
+            256 - pad, 256 - pad, 128 + 2 * pad, 128 + 2 * pad), boundless=True)
+        img = np.concatenate([img, mask[np.newaxis]])
+        levels = read_levels(src, window, pad, 5)
+
+    # the window is in the middle of the hole, out of reach of level 0
+    assert not mask.any()
+    filled = fill_pyramid(fill_nodata, img, mask, levels, [1, 2, 3, 4], 4, pad)
+    assert (filled[-1] == 255).all()
+    assert (filled[:3] > 0).all()
+
+    filled = fill_pyramid(fill_nodata, img, mask, levels[:2], [1, 2, 3, 4], 4, pad)
+    # fewer levels don't reach the middle of the hole
+    assert not filled[-1][pad + 32:pad + 96, pad + 32:pad + 96].any()
@@ -8,7 +8,7 @@ from rasterio.windows import Window
 
 from nodata.scripts.alpha import (
     all_valid, init_worker, finalize_worker, compute_window_mask,
-    NodataPoolMan)
+    encode_mask, decode_mask, shared_memory, transports, NodataPoolMan)
 
 
 def test_all_valid():
@@ -54,7 +54,7 @@ def test_pool_man_mask(input_path):
 
 
 @pytest.mark.parametrize("keywords", [
-    {'padding': 0}])
+    {'padding': 0}, {'padding': 7}, {'padding': 10}])
 def test_pool_man_mask_keywords(keywords):
     """NodataPoolMan initializes and computes mask of a file"""
     manager = NodataPoolMan(
@@ -65,3 +65,146 @@ def test_pool_man_mask_keywords(keywords):
     assert (arr == 255).all()
     with pytest.raises(StopIteration):
         next(result)
+
+
+def test_pool_man_max_in_flight():
+    """Throttled managers still yield every window"""
+    manager = NodataPoolMan(
+        'tests/fixtures/alpha/lossy-curved-edges.tif', all_valid, 0,
+        num_workers=2, max_in_flight=1)
+    windows = [Window(0, i * 10, 10, 10) for i in range(5)]
+    results = list(manager.mask(windows=windows))
+    manager.close()
+    assert sorted(w.row_off for w, arr in results) == [0, 10, 20, 30, 40]
+    assert all((arr == 255).all() for w, arr in results)
+
+
+@pytest.mark.parametrize("transport", transports)
+def test_mask_transport_roundtrip(transport):
+    """Masks survive encoding and decoding unchanged"""
+    mask = numpy.zeros((30, 40), dtype='uint8')
+    mask[5:20, 10:] = 255
+    data = encode_mask(mask, transport)
+    out = decode_mask(data, transport, mask.shape, mask.dtype)
+    assert out.dtype == mask.dtype
+    assert (out == mask).all()
+
+
+def test_rle_noisy_mask():
+    """Masks with more runs than bytes go as they are"""
+    mask = numpy.zeros((30, 40), dtype='uint8')
+    mask[:, ::2] = 255
+    data = encode_mask(mask, 'rle')
+    assert isinstance(data, numpy.ndarray)
+    assert (decode_mask(data, 'rle', mask.shape, mask.dtype) == mask).all()
+
+
+@pytest.mark.skipif(shared_memory is None, reason="needs Python 3.8+")
+def test_shm_mask_view():
+    """Shared memory masks are views of their unlinked block"""
+    mask = numpy.full((30, 40), 255, dtype='uint8')
+    data = encode_mask(mask, 'shm')
+    out = decode_mask(data, 'shm', mask.shape, mask.dtype)
+    assert not out.flags.owndata
+    assert (out == mask).all()
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=data[0])
+
+
+@pytest.mark.parametrize("transport", transports)
+def test_pool_man_transport(transport):
+    """Every transport yields the same masks"""
+    manager = NodataPoolMan(
+        'tests/fixtures/alpha/lossy-curved-edges.tif', all_valid, 0,
+        num_workers=1, transport=transport)
+    windows = [Window(0, i * 10, 10, 10) for i in range(3)]
+    results = list(manager.mask(windows=windows))
+    manager.close()
+    assert len(results) == 3
+    assert all((arr == 255).all() for w, arr in results)
+
+
+def test_pool_man_bad_transport():
+    with pytest.raises(ValueError):
+        NodataPoolMan(
+            'tests/fixtures/alpha/lossy-curved-edges.tif', all_valid, 0,
+            transport='carrier-pigeon')
+
+
+@pytest.mark.parametrize("padding", [0, 3, 10, 64])
+def test_compute_window_mask_padding(padding):
+    """Padded windows are cropped back onto the window they were read for"""
+    from nodata.alphamask import simple_mask
+    path = 'tests/fixtures/blob/rgb_toblob.tif'
+    init_worker(path, simple_mask)
+    try:
+        with rasterio.open(path) as src:
+            expected = simple_mask(src.read(), (0, 0, 0))
+            windows = [w for ij, w in src.block_windows()]
+        for window in windows:
+            out_window, data = compute_window_mask(
+                (window, (0, 0, 0), {'padding': padding}))
+            assert out_window == window
+            (r0, r1), (c0, c1) = window.toranges()
+            assert numpy.array_equal(
+                numpy.frombuffer(zlib.decompress(data), 'uint8').reshape(
+                    r1 - r0, c1 - c0),
+                expected[r0:r1, c0:c1])
+    finally:
+        finalize_worker()
+
+
+@pytest.mark.parametrize("max_in_flight", [None, 2])
+def test_pool_man_threads(max_in_flight):
+    """The threads engine yields the same masks as the processes engine"""
+    from nodata.alphamask import simple_mask
+    path = 'tests/fixtures/blob/rgb_toblob.tif'
+    with rasterio.open(path) as src:
+        windows = [w for ij, w in src.block_windows()]
+        expected = simple_mask(src.read(), (0, 0, 0))
+
+    manager = NodataPoolMan(
+        path, simple_mask, (0, 0, 0), num_workers=3,
+        max_in_flight=max_in_flight, engine='threads')
+    results = list(manager.mask(windows=windows))
+    manager.close()
+
+    assert len(results) == len(windows)
+    for window, arr in results:
+        (r0, r1), (c0, c1) = window.toranges()
+        assert numpy.array_equal(arr, expected[r0:r1, c0:c1])
+
+
+def test_pool_man_threads_bounded():
+    """Without max_in_flight, the threads engine still holds back
+    windows until masks are taken, and terminate cancels the rest"""
+    path = 'tests/fixtures/blob/rgb_toblob.tif'
+    with rasterio.open(path) as src:
+        windows = [w for ij, w in src.block_windows()]
+    submitted = []
+
+    def tracked():
+        for window in windows:
+            submitted.append(window)
+            yield window
+
+    manager = NodataPoolMan(path, all_valid, 0, num_workers=2,
+                            engine='threads')
+    results = manager.mask(windows=tracked())
+    next(results)
+    assert len(submitted) <= 4 < len(windows)
+    manager.terminate()
+    assert all(f.done() for f in manager._pending)
+
+
+def test_pool_man_terminate_throttled():
+    """terminate() doesn't hang on a task feeder parked on a slot"""
+    path = 'tests/fixtures/blob/rgb_toblob.tif'
+    with rasterio.open(path) as src:
+        windows = [w for ij, w in src.block_windows()]
+
+    manager = NodataPoolMan(path, all_valid, 0, num_workers=2,
+                            max_in_flight=2)
+    results = manager.mask(windows=windows)
+    next(results)
+    manager.terminate()
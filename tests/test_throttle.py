@@ -0,0 +1,34 @@
+import threading
+
+from nodata.throttle import Throttle
+
+
+def test_throttle_feed():
+    throttle = Throttle(2)
+    fed = []
+
+    def feeder():
+        for task in throttle.feed(range(10)):
+            fed.append(task)
+
+    thread = threading.Thread(target=feeder)
+    thread.start()
+    thread.join(0.2)
+    # parked on the third task
+    assert thread.is_alive()
+    assert fed == [0, 1]
+
+    throttle.release()
+    thread.join(0.2)
+    assert fed == [0, 1, 2]
+
+    throttle.stop()
+    thread.join(1)
+    assert not thread.is_alive()
+    assert fed == [0, 1, 2]
+
+
+def test_throttle_stop_unparked():
+    throttle = Throttle(2)
+    throttle.stop()
+    assert list(throttle.feed(range(10))) == []
@@ -0,0 +1,95 @@
+import pytest
+import rasterio
+from rasterio.windows import Window
+
+from nodata.windows import (
+    grid_windows, halo_window, merge_blocks, pad_window, read_amplification,
+    tile_windows)
+
+
+def test_pad_window():
+    window = Window.from_slices((0, 256), (0, 256))
+    assert pad_window(window, 10) == ((-10, 266), (-10, 266))
+
+
+@pytest.mark.parametrize("pad", [0, 1, 10, 300])
+def test_halo_window_boundless(pad):
+    window = Window.from_slices((256, 512), (0, 100))
+    read, (rows, cols) = halo_window(window, pad)
+    assert read.toranges() == ((256 - pad, 512 + pad), (-pad, 100 + pad))
+    assert (rows.start, rows.stop) == (pad, pad + 256)
+    assert (cols.start, cols.stop) == (pad, pad + 100)
+
+
+def test_halo_window_clipped():
+    window = Window.from_slices((256, 512), (0, 100))
+    read, (rows, cols) = halo_window(window, 10, (520, 1000))
+    assert read.toranges() == ((246, 520), (0, 110))
+    assert (rows.start, rows.stop) == (10, 266)
+    assert (cols.start, cols.stop) == (0, 100)
+
+
+def test_merge_blocks():
+    blocks = [
+        ((i, j), Window.from_slices(
+            (i * 256, min((i + 1) * 256, 600)),
+            (j * 256, min((j + 1) * 256, 600))))
+        for i in range(3) for j in range(3)]
+
+    tiles = merge_blocks(blocks, 2)
+    assert [ij for ij, w in tiles] == [(0, 0), (0, 1), (1, 0), (1, 1)]
+    assert tiles[0][1].toranges() == ((0, 512), (0, 512))
+    assert tiles[1][1].toranges() == ((0, 512), (512, 600))
+    assert tiles[3][1].toranges() == ((512, 600), (512, 600))
+
+    assert merge_blocks(blocks, 1) == blocks
+
+
+def test_tile_windows():
+    with rasterio.open('tests/fixtures/blob/seams_4band.tif') as src:
+        blocks = list(src.block_windows())
+        assert tile_windows(src) == blocks
+        tiles = tile_windows(src, 512)
+
+    assert len(blocks) == 9
+    assert len(tiles) == 4
+    assert tiles[0][1].toranges() == ((0, 512), (0, 512))
+
+
+def test_tile_windows_align():
+    with rasterio.open('tests/fixtures/blob/seams_4band.tif') as src:
+        block_rows, block_cols = src.block_shapes[0]
+        # 256 pixel blocks, taken in pairs for offsets at multiples of 512
+        tiles = tile_windows(src, align=2 * block_rows)
+        assert tiles == tile_windows(src, 2 * block_rows)
+        assert tile_windows(src, 2 * block_rows, align=block_rows) == tiles
+        assert all(
+            w.row_off % 512 == 0 and w.col_off % 512 == 0 for ij, w in tiles)
+
+
+def test_grid_windows():
+    tiles = grid_windows((600, 1100), 512)
+    assert [ij for ij, w in tiles] == [
+        (0, 0), (0, 1), (0, 2), (1, 0), (1, 1), (1, 2)]
+    assert tiles[2][1].toranges() == ((0, 512), (1024, 1100))
+    assert tiles[5][1].toranges() == ((512, 600), (1024, 1100))
+
+    runs = grid_windows((600, 1100), 512, 1024)
+    assert [ij for ij, w in runs] == [(0, 0), (0, 1), (1, 0), (1, 1)]
+    assert runs[0][1].toranges() == ((0, 512), (0, 1024))
+    assert runs[3][1].toranges() == ((512, 600), (1024, 1100))
+
+
+def test_read_amplification():
+    windows = [((0, 0), Window(0, 0, 100, 100))]
+    assert read_amplification(windows, 0, (100, 100)) == 1.0
+    assert read_amplification(windows, 10, (100, 100)) == 1.0
+    assert read_amplification(windows, 10, (200, 200)) == 1.21
+
+    # a level 1 read of a 50 pixel window with a halo of 10 level pixels
+    # is 25 + 20 level pixels, or 90 pixels, a side
+    windows = [((0, 0), Window(100, 100, 50, 50))]
+    assert read_amplification(windows, 10, (400, 400), levels=1) == (
+        70 * 70 + 90 * 90) / 2500.
+    assert read_amplification(windows, 10, (150, 150), levels=1) == (
+        60 * 60 + 70 * 70) / 2500.